@@ -33,13 +33,9 @@ if not defined ORIGINAL_ENGINE (
 call :BuildPlatform windows windows
 if errorlevel 1 set "BUILD_FAILED=1"
 
+rem Linux and Android share the Linux engine and build concurrently.
 if "!BUILD_FAILED!"=="0" (
-    call :BuildPlatform linux linux
-    if errorlevel 1 set "BUILD_FAILED=1"
-)
-
-if "!BUILD_FAILED!"=="0" (
-    call :BuildPlatform android linux
+    call :BuildPlatform "linux android" linux
     if errorlevel 1 set "BUILD_FAILED=1"
 )
 
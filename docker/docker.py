@@ -1,14 +1,21 @@
 import argparse
+import base64
+import hashlib
+import json
 import os
 import shutil
 import subprocess
+import sys
+import threading
 import time
+import urllib.request
 from enum import Enum
 
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
 IMAGE_PREFIX = "v8-packager"
+DEFAULT_VERSION = "13.6"
 
 
 class Platform(str, Enum):
@@ -19,11 +26,21 @@ class Platform(str, Enum):
 
 SUPPORTED_ARCHITECTURES = {
     Platform.Windows: ["x64"],
-    Platform.Linux: ["x64"],
+    Platform.Linux: ["x64", "Arm64"],
     Platform.Android: ["x64", "Arm64"],
 }
 BUILD_CONFIGURATIONS = ["Debug", "Release"]
 IMAGE_PLATFORMS = [Platform.Windows, Platform.Linux]
+STORAGE_MODES = ["bind", "volume", "tmpfs"]
+V8_DEPS_URL = (
+    "https://chromium.googlesource.com/v8/v8/+/refs/heads/{}-lkgr/DEPS?format=TEXT"
+)
+# DEPS entries that pin the toolchains each platform downloads at run time.
+TOOLCHAIN_DEPS = {
+    Platform.Windows: ["build", "tools/clang"],
+    Platform.Linux: ["build", "tools/clang"],
+    Platform.Android: ["build", "tools/clang", "third_party/android_toolchain/ndk"],
+}
 
 
 def docker_platform(platform):
@@ -40,6 +57,106 @@ def run(command):
         )
 
 
+class ParallelRunner:
+    """Runs commands concurrently with prefixed output and fails fast."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._containers = set()
+        self.cancelled = threading.Event()
+
+    def log(self, prefix, message):
+        with self._lock:
+            sys.stdout.write(f"[{prefix}] {message}\n")
+            sys.stdout.flush()
+
+    def run(self, command, prefix, container=None):
+        if self.cancelled.is_set():
+            raise RuntimeError(f"{prefix}: cancelled")
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+        with self._lock:
+            self._processes.add(process)
+            if container:
+                self._containers.add(container)
+        try:
+            for line in process.stdout:
+                self.log(prefix, line.rstrip("\r\n"))
+            returncode = process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+                self._containers.discard(container)
+        if returncode != 0:
+            if self.cancelled.is_set():
+                raise RuntimeError(f"{prefix}: cancelled")
+            raise RuntimeError(
+                f"{prefix}: command failed with exit code {returncode}: "
+                f"{' '.join(command)}"
+            )
+
+    def cancel(self):
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        with self._lock:
+            containers = list(self._containers)
+            processes = list(self._processes)
+        for container in containers:
+            subprocess.run(
+                ["docker", "kill", container],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        for process in processes:
+            process.terminate()
+
+    def run_all(self, tasks):
+        errors = []
+
+        def _run(name, task):
+            try:
+                task()
+            except Exception as error:
+                errors.append(error)
+                if not self.cancelled.is_set():
+                    self.log(name, f"Error: {error}")
+                self.cancel()
+
+        threads = [
+            threading.Thread(target=_run, args=(name, task))
+            for name, task in tasks
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+def parse_memory(value):
+    units = {"b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    value = value.strip().lower()
+    unit = value[-1] if value and value[-1] in units else "b"
+    number = value[:-1] if value and value[-1] in units else value
+    try:
+        return int(float(number) * units[unit])
+    except ValueError:
+        raise RuntimeError(f"Invalid memory limit: {value!r}")
+
+
+def split_resources(memory, jobs, count):
+    memory_share = parse_memory(memory) // count // (1024 ** 2)
+    return f"{max(memory_share, 1)}m", max(jobs // count, 1)
+
+
 def docker_os(timeout=180):
     deadline = time.monotonic() + timeout
     last_error = ""
@@ -71,6 +188,40 @@ def image_name(platform):
     return f"{IMAGE_PREFIX}/{platform.value}:latest"
 
 
+def container_workspace_dir(platform):
+    if docker_platform(platform) == Platform.Windows:
+        return "C:/workspace"
+    return "/workspace"
+
+
+def workspace_name(platform, version):
+    # The default version keeps the name workspaces had before several
+    # versions could be built, so existing checkouts and volumes are reused.
+    if lkgr_branch(version) == lkgr_branch(DEFAULT_VERSION):
+        return f"workspace-{platform.value}"
+    return f"workspace-{platform.value}-{lkgr_branch(version)}"
+
+
+def workspace_volume(platform, version):
+    return f"{IMAGE_PREFIX}-{workspace_name(platform, version)}"
+
+
+def volume_has_valid_checkout(platform, volume):
+    container_workspace = container_workspace_dir(platform)
+    result = subprocess.run(
+        [
+            "docker", "run", "--rm",
+            "--volume", f"{volume}:{container_workspace}",
+            "--workdir", container_workspace,
+            image_name(platform),
+            "git", "-C", "v8", "rev-parse", "--verify", "--quiet", "HEAD",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    return result.returncode == 0
+
+
 def build_image(platform):
     platform = docker_platform(platform)
     run([
@@ -82,10 +233,83 @@ def build_image(platform):
     ])
 
 
+def lkgr_branch(version):
+    return ".".join(version.split(".")[:2])
+
+
+def toolchain_key(platform, version):
+    url = V8_DEPS_URL.format(lkgr_branch(version))
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            deps_content = base64.b64decode(response.read()).decode("utf-8")
+    except OSError as error:
+        raise RuntimeError(f"Unable to read V8 DEPS from {url}: {error}")
+
+    namespace = {}
+    exec("Var = lambda name: vars[name]; Str = str", namespace)
+    exec(deps_content, namespace)
+    deps = namespace.get("deps", {})
+    pinned = {
+        "gn_version": namespace.get("vars", {}).get("gn_version"),
+    }
+    for name in TOOLCHAIN_DEPS[platform]:
+        pinned[name] = deps.get(name)
+    encoded = json.dumps(pinned, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def toolchain_image_name(platform, version, key):
+    return (
+        f"{IMAGE_PREFIX}/{platform.value}-toolchains:"
+        f"{lkgr_branch(version)}-{key}"
+    )
+
+
+def image_exists(name):
+    result = subprocess.run(
+        ["docker", "image", "inspect", name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def build_toolchain_image(platform, source, version):
+    key = toolchain_key(platform, version)
+    name = toolchain_image_name(platform, version, key)
+    if image_exists(name):
+        print(f"Using toolchain image: {name}")
+        return name
+
+    engine = docker_platform(platform)
+    if not image_exists(image_name(engine)):
+        build_image(engine)
+    run([
+        "docker",
+        "build",
+        "--tag",
+        name,
+        "--build-arg",
+        f"BASE_IMAGE={image_name(engine)}",
+        "--build-arg",
+        f"V8_VERSION={lkgr_branch(version)}",
+        "--build-arg",
+        f"V8_PLATFORMS={platform.name}",
+        "--file",
+        os.path.join(SCRIPT_DIR, engine.name, "Toolchains.Dockerfile"),
+        os.path.join(source, "tools"),
+    ])
+    return name
+
+
 def build_v8(
     platform, source, workspace, architectures, configurations, library_type,
     memory, jobs, prepare, git_cache,
-    archive_dir=None, version="13.6"
+    archive_dir=None, version=DEFAULT_VERSION, storage="bind", tmpfs_size="64g",
+    image=None, runner=None, container_name=None, toolchain_cache=None,
+    pch=False, static_forms=None, sysroot=None, external_startup_data=False,
+    optimize_startup=False, symbol_ordering_file=None, history_dir=None,
+    watch=False
 ):
     required_os = docker_platform(platform)
     active_os = docker_os()
@@ -95,9 +319,7 @@ def build_v8(
             f"switch Docker to {required_os.value} containers first."
         )
 
-    container_workspace = (
-        "C:/workspace" if required_os == Platform.Windows else "/workspace"
-    )
+    container_workspace = container_workspace_dir(platform)
     command = [
         "python" if required_os == Platform.Windows else "python3",
         "-m",
@@ -112,19 +334,71 @@ def build_v8(
     command.append("--config")
     command.extend(configurations)
     command.extend(["--library-type", library_type])
+    if pch:
+        command.append("--pch")
+    if static_forms:
+        command.append("--static-forms")
+        command.extend(static_forms)
+    if sysroot:
+        command.extend(["--sysroot", "/sysroot"])
+    if external_startup_data:
+        command.append("--external-startup-data")
+    if optimize_startup:
+        command.append("--optimize-startup")
+    if symbol_ordering_file:
+        command.extend(["--symbol-ordering-file", "/symbol-ordering.txt"])
     if archive_dir:
         command.append("--archive")
-    volumes = [
-        (workspace, container_workspace, False),
+    if watch:
+        command.append("--watch")
+    container_history_dir = (
+        "C:/history" if required_os == Platform.Windows else "/history"
+    )
+    if history_dir:
+        # One record file per container; parallel containers never share a
+        # SQLite file over the bind mount.
+        record_name = container_name or f"{platform.value}-{os.getpid()}"
+        command.extend([
+            "--history-record",
+            f"{container_history_dir}/{record_name}-{time.time_ns()}.json",
+        ])
+    else:
+        command.append("--no-history")
+    volumes = []
+    if storage == "bind":
+        volumes.append((workspace, container_workspace, False))
+    else:
+        # Keep the checkout and out.gn inside the Docker engine and only
+        # expose dist/ on the host.
+        dist_dir = os.path.join(workspace, "dist")
+        os.makedirs(dist_dir, exist_ok=True)
+        volumes.extend([
+            (workspace_volume(platform, version), container_workspace, False),
+            (dist_dir, f"{container_workspace}/dist", False),
+        ])
+    container_toolchain_cache = (
+        "C:/toolchain-cache" if required_os == Platform.Windows
+        else "/toolchain-cache"
+    )
+    if toolchain_cache:
+        volumes.append((toolchain_cache, container_toolchain_cache, False))
+    volumes.extend([
         (git_cache, "C:/git-cache" if required_os == Platform.Windows
          else "/git-cache", False),
         (os.path.join(source, "patches"), f"{container_workspace}/patches", True),
         (os.path.join(source, "tools"), f"{container_workspace}/tools", True),
-    ]
+    ])
     if archive_dir:
         volumes.append(
             (archive_dir, f"{container_workspace}/archive", False)
         )
+    if sysroot:
+        volumes.append((sysroot, "/sysroot", True))
+    if symbol_ordering_file:
+        volumes.append((symbol_ordering_file, "/symbol-ordering.txt", True))
+    if history_dir:
+        os.makedirs(history_dir, exist_ok=True)
+        volumes.append((history_dir, container_history_dir, False))
     docker_command = [
         "docker",
         "run",
@@ -132,6 +406,8 @@ def build_v8(
         "--memory",
         memory,
     ]
+    if container_name:
+        docker_command.extend(["--name", container_name])
     if required_os == Platform.Windows:
         docker_command.extend(["--cpu-count", "16"])
     docker_command.extend([
@@ -143,20 +419,35 @@ def build_v8(
         "--env",
         f"V8_PACKAGER_JOBS={jobs}",
     ])
+    if toolchain_cache:
+        # Downloaded binaries and toolchains are shared between workspaces
+        # whose DEPS pin the same revisions.
+        docker_command.extend([
+            "--env",
+            f"V8_PACKAGER_TOOLCHAIN_CACHE={container_toolchain_cache}",
+        ])
     for host_path, container_path, read_only in volumes:
         volume = f"{host_path}:{container_path}"
         if read_only:
             volume += ":ro"
         docker_command.extend(["--volume", volume])
+    if storage == "tmpfs":
+        docker_command.extend([
+            "--tmpfs",
+            f"{container_workspace}/v8/out.gn:rw,exec,size={tmpfs_size}",
+        ])
     docker_command.extend([
-        "--workdir", container_workspace, image_name(platform), *command,
+        "--workdir", container_workspace, image or image_name(platform), *command,
     ])
-    run(docker_command)
+    if runner:
+        runner(docker_command)
+    else:
+        run(docker_command)
 
 
-def prepare_workspace(source, platform):
+def prepare_workspace(source, platform, version):
     source = os.path.abspath(source)
-    workspace = os.path.join(source, ".docker", f"workspace-{platform.value}")
+    workspace = os.path.join(source, ".docker", workspace_name(platform, version))
     os.makedirs(workspace, exist_ok=True)
     print(f"Using {platform.value} build workspace: {workspace}")
     return workspace
@@ -189,7 +480,6 @@ def export_artifacts(workspace, destination):
     source = os.path.join(workspace, "dist")
     if not os.path.isdir(source):
         raise RuntimeError("The temporary workspace did not produce a dist directory.")
-    destination = os.path.join(destination, "dist")
     os.makedirs(destination, exist_ok=True)
     for name in os.listdir(source):
         source_path = os.path.join(source, name)
@@ -211,8 +501,9 @@ def main():
         help="Build one or more Docker images",
     )
     parser.add_argument(
-        "--build", choices=[platform.value for platform in Platform],
-        help="Build V8 for this platform",
+        "--build", nargs="+", choices=[platform.value for platform in Platform],
+        help="Build V8 for these platforms; platforms that share a Docker "
+        "engine build concurrently",
     )
     parser.add_argument(
         "--workspace",
@@ -236,6 +527,48 @@ def main():
         choices=["Shared", "Static"],
         default="Static",
     )
+    parser.add_argument(
+        "--pch",
+        action="store_true",
+        help="Package a prefix header for v8.h and libplatform.h to precompile",
+    )
+    parser.add_argument(
+        "--static-forms",
+        nargs="+",
+        choices=["prelinked", "components", "thin"],
+        help="Extra forms of static libraries to package",
+    )
+    parser.add_argument(
+        "--external-startup-data",
+        action="store_true",
+        help="Package the snapshot as an external snapshot_blob.bin",
+    )
+    parser.add_argument(
+        "--optimize-startup",
+        action="store_true",
+        help="Relink shared libraries for startup with code folding, "
+        "section GC and symbol ordering",
+    )
+    parser.add_argument(
+        "--symbol-ordering-file",
+        help="Host symbol ordering file for --optimize-startup",
+    )
+    parser.add_argument(
+        "--sysroot",
+        help="Host directory with a Linux Arm64 sysroot to cross-compile "
+        "against instead of the Debian sysroot pinned by V8",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the container running, reapply patches edited on the host "
+        "and rebuild the selected configs incrementally until interrupted",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not record builds in the host build history database",
+    )
     parser.add_argument("--memory", default="24g")
     parser.add_argument(
         "--jobs",
@@ -243,64 +576,205 @@ def main():
         default=16,
         help="Maximum parallel Ninja jobs",
     )
-    parser.add_argument("--version", default="13.6")
+    parser.add_argument(
+        "--version",
+        nargs="+",
+        default=[DEFAULT_VERSION],
+        help="V8 versions to build; several versions build one after another "
+        "in per-version workspaces that share the git and toolchain caches",
+    )
     parser.add_argument(
         "--archive",
         action="store_true",
         help="Archive build outputs into the host archive directory",
     )
+    parser.add_argument(
+        "--prebaked",
+        action="store_true",
+        help="Bake the toolchains pinned by --version into a versioned image "
+        "and build with it",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_MODES,
+        default="bind",
+        help="Where the V8 checkout lives: 'bind' uses the host workspace, "
+        "'volume' keeps it on a named Docker volume, and 'tmpfs' also "
+        "places out.gn in container memory",
+    )
+    parser.add_argument(
+        "--tmpfs-size",
+        default="64g",
+        help="Size limit of the out.gn tmpfs when --storage tmpfs is used",
+    )
     args = parser.parse_args()
 
     if not args.image and not args.build:
         parser.error("at least one of --image or --build is required")
     if args.archive and not args.build:
         parser.error("--archive requires --build")
+    if args.watch and (
+        not args.build or len(args.build) != 1 or len(set(args.version)) != 1
+    ):
+        parser.error("--watch requires exactly one --build platform and version")
+    if args.watch and args.archive:
+        parser.error("--watch cannot be combined with --archive")
     if args.jobs < 1:
         parser.error("--jobs must be at least 1")
+    if args.storage == "tmpfs" and any(
+        docker_platform(Platform(platform)) == Platform.Windows
+        for platform in args.build or []
+    ):
+        parser.error("--storage tmpfs is only supported for Linux containers")
+    if args.sysroot and not os.path.isdir(args.sysroot):
+        parser.error(f"--sysroot {args.sysroot} is not a directory")
+    if args.symbol_ordering_file and not args.optimize_startup:
+        parser.error("--symbol-ordering-file requires --optimize-startup")
+    if args.symbol_ordering_file and not os.path.isfile(args.symbol_ordering_file):
+        parser.error(f"--symbol-ordering-file {args.symbol_ordering_file} does not exist")
+    versions = list(dict.fromkeys(args.version))
     for platform in args.image or []:
         build_image(Platform(platform))
-    if args.build:
-        source_workspace = os.path.abspath(args.workspace)
-        requested_platform = Platform(args.build)
-        required_os = docker_platform(requested_platform)
-        active_platform = docker_os()
-        if active_platform != required_os:
-            raise RuntimeError(
-                f"Docker is running {active_platform.value} containers; "
-                f"switch Docker to {required_os.value} containers first."
-            )
-        build_workspace = prepare_workspace(
-            source_workspace, requested_platform
+        if args.prebaked:
+            for requested_platform in Platform:
+                if docker_platform(requested_platform) == Platform(platform):
+                    for version in versions:
+                        build_toolchain_image(
+                            requested_platform,
+                            os.path.abspath(args.workspace),
+                            version,
+                        )
+    if not args.build:
+        return
+
+    platforms = list(dict.fromkeys(Platform(platform) for platform in args.build))
+    engines = {docker_platform(platform) for platform in platforms}
+    if len(engines) > 1:
+        raise RuntimeError(
+            "Platforms built together must share a Docker engine; "
+            "build Windows and Linux/Android in separate invocations."
+        )
+    required_os = engines.pop()
+    active_platform = docker_os()
+    if active_platform != required_os:
+        raise RuntimeError(
+            f"Docker is running {active_platform.value} containers; "
+            f"switch Docker to {required_os.value} containers first."
         )
-        git_cache = os.path.join(source_workspace, ".docker", "git-cache")
-        os.makedirs(git_cache, exist_ok=True)
+    source_workspace = os.path.abspath(args.workspace)
+    git_cache = os.path.join(source_workspace, ".docker", "git-cache")
+    os.makedirs(git_cache, exist_ok=True)
+    toolchain_cache = os.path.join(
+        source_workspace, ".docker", f"toolchain-cache-{required_os.value}"
+    )
+    os.makedirs(toolchain_cache, exist_ok=True)
+
+    def build_platform(
+        platform, version, memory, jobs, runner=None, container_name=None
+    ):
+        # A batch of versions keeps each version's outputs apart.
+        output_suffix = [lkgr_branch(version)] if len(versions) > 1 else []
         archive_dir = None
         if args.archive:
-            archive_dir = os.path.join(source_workspace, "archive")
+            archive_dir = os.path.join(source_workspace, "archive", *output_suffix)
             os.makedirs(archive_dir, exist_ok=True)
-        architectures = args.arch or SUPPORTED_ARCHITECTURES[requested_platform]
-        configurations = args.config or BUILD_CONFIGURATIONS
-        prepare = (
-            "reset"
-            if has_valid_checkout(build_workspace)
-            else "fetch"
-        )
+        build_workspace = prepare_workspace(source_workspace, platform, version)
+        if args.storage == "bind":
+            valid_checkout = has_valid_checkout(build_workspace)
+        else:
+            valid_checkout = volume_has_valid_checkout(
+                platform, workspace_volume(platform, version)
+            )
+        prepare = "reset" if valid_checkout else "fetch"
+        if args.watch and valid_checkout:
+            # Keep out.gn for incremental rebuilds; the watcher reapplies
+            # only the patches that changed.
+            prepare = None
+            print(
+                "Watching patches; rebuilt packages are written to "
+                f"{os.path.join(build_workspace, 'dist')}"
+            )
+        image = None
+        if args.prebaked:
+            image = build_toolchain_image(platform, source_workspace, version)
         build_v8(
-            requested_platform,
+            platform,
             source_workspace,
             build_workspace,
-            architectures,
-            configurations,
+            args.arch or SUPPORTED_ARCHITECTURES[platform],
+            args.config or BUILD_CONFIGURATIONS,
             args.library_type,
-            args.memory,
-            args.jobs,
+            memory,
+            jobs,
             prepare=prepare,
             git_cache=git_cache,
             archive_dir=archive_dir,
-            version=args.version,
+            version=version,
+            storage=args.storage,
+            tmpfs_size=args.tmpfs_size,
+            image=image,
+            runner=runner,
+            container_name=container_name,
+            toolchain_cache=toolchain_cache,
+            pch=args.pch,
+            static_forms=args.static_forms,
+            sysroot=os.path.abspath(args.sysroot) if args.sysroot else None,
+            external_startup_data=args.external_startup_data,
+            optimize_startup=args.optimize_startup,
+            # Containers leave record files that the host database, the one
+            # tools.history reads by default, imports when it is opened next.
+            history_dir=(
+                None if args.no_history
+                else os.path.join(
+                    source_workspace, ".v8-packager", "history-records"
+                )
+            ),
+            watch=args.watch,
+            symbol_ordering_file=(
+                os.path.abspath(args.symbol_ordering_file)
+                if args.symbol_ordering_file else None
+            ),
         )
-        export_artifacts(build_workspace, source_workspace)
+        export_artifacts(
+            build_workspace, os.path.join(source_workspace, "dist", *output_suffix)
+        )
+
+    # Versions build one after another so later versions reuse the git
+    # objects and toolchains fetched by earlier ones.
+    for version in versions:
+        if len(versions) > 1:
+            print(f"Building V8 {version}")
+        if len(platforms) == 1:
+            build_platform(platforms[0], version, args.memory, args.jobs)
+            continue
+
+        # Platforms sharing an engine build concurrently and split the
+        # container resources between them.
+        memory, jobs = split_resources(args.memory, args.jobs, len(platforms))
+        runner = ParallelRunner()
+        tasks = []
+        for platform in platforms:
+            container_name = f"{IMAGE_PREFIX}-build-{platform.value}-{os.getpid()}"
+
+            def task(platform=platform, container_name=container_name):
+                runner.log(
+                    platform.value,
+                    f"Building with --memory {memory} and --jobs {jobs}",
+                )
+                build_platform(
+                    platform,
+                    version,
+                    memory,
+                    jobs,
+                    runner=lambda command: runner.run(
+                        command, platform.value, container_name
+                    ),
+                    container_name=container_name,
+                )
 
+            tasks.append((platform.value, task))
+        runner.run_all(tasks)
+        print(f"Built {', '.join(platform.value for platform in platforms)}")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,479 @@
+import argparse
+import hashlib
+import json
+import os
+import stat
+import struct
+import sys
+import tempfile
+import zipfile
+from typing import Dict, List, Tuple
+
+# Entries get fixed metadata so identical inputs give identical archives.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+MANIFEST_NAME = 'manifest.json'
+COMMON_ARCHIVE = 'common.zip'
+DELTA_NAME = 'delta.json'
+BLOCK_SIZE = 1024 * 1024
+# Files consumers mmap straight from the archive are stored uncompressed with
+# their data aligned to a page, like zipalign does for Android packages.
+MAPPED_NAMES = {'snapshot_blob.bin'}
+PAGE_SIZE = 4096
+_ALIGNMENT_EXTRA_ID = 0xD935
+
+
+def _fileMode(path: str) -> int:
+	return 0o755 if os.stat(path).st_mode & stat.S_IXUSR else 0o644
+
+
+def _zipInfo(arcname: str, mode: int) -> zipfile.ZipInfo:
+	info = zipfile.ZipInfo(arcname, ZIP_DATE_TIME)
+	info.compress_type = zipfile.ZIP_DEFLATED
+	info.create_system = 3
+	info.external_attr = (stat.S_IFREG | mode) << 16
+	return info
+
+
+def manifestId(manifest: dict) -> str:
+	"""Content address of a package: the hash of its canonical manifest."""
+	encoded = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class PackageArchive:
+	"""Zip archive of one platform/arch package, written incrementally.
+
+	Files are hashed while they are compressed into a staging archive in the
+	order packaging finishes. Closing adds a manifest.json with per-file
+	hashes and copies the compressed entries sorted by name into the final
+	archive, which is only moved into place then. Entries have fixed
+	timestamps and permissions, so identical files give identical archives
+	whatever order they were added in.
+	"""
+
+	def __init__(self, archiveFile: str, rootDir: str):
+		self.archiveFile = archiveFile
+		self._rootDir = rootDir
+		self._stagingFile = archiveFile + '.staging'
+		self._partialFile = archiveFile + '.partial'
+		self._zip = zipfile.ZipFile(
+			self._stagingFile,
+			'w',
+			compression=zipfile.ZIP_DEFLATED,
+			compresslevel=6,
+		)
+		self.hashes = dict()
+		self.manifest = {'format': 1, 'files': dict()}
+
+	def addFile(self, path: str, arcname: str = None):
+		if arcname is None:
+			arcname = os.path.relpath(path, self._rootDir).replace(os.sep, '/')
+		if arcname in self.hashes:
+			return
+		with open(path, 'rb') as source:
+			self.addStream(source, arcname, _fileMode(path))
+
+	def addStream(self, source, arcname: str, mode: int = 0o644):
+		digest = hashlib.sha256()
+		size = 0
+		info = _zipInfo(arcname, mode)
+		if arcname.rsplit('/', 1)[-1] in MAPPED_NAMES:
+			# Aligned when the entries are copied into place.
+			info.compress_type = zipfile.ZIP_STORED
+		with self._zip.open(info, 'w', force_zip64=True) as target:
+			while True:
+				chunk = source.read(BLOCK_SIZE)
+				if not chunk:
+					break
+				digest.update(chunk)
+				size += len(chunk)
+				target.write(chunk)
+		self.hashes[arcname] = digest.hexdigest()
+		self.manifest['files'][arcname] = {'sha256': digest.hexdigest(), 'size': size, 'mode': mode}
+
+	def addTree(self, path: str):
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			for file in sorted(files):
+				self.addFile(os.path.join(root, file))
+
+	def close(self):
+		manifest = json.dumps(self.manifest, indent=1, sort_keys=True).encode('utf-8')
+		self._zip.writestr(_zipInfo(MANIFEST_NAME, 0o644), manifest)
+		self._zip.close()
+		try:
+			_copySorted(self._stagingFile, self._partialFile)
+		finally:
+			os.remove(self._stagingFile)
+		os.replace(self._partialFile, self.archiveFile)
+		# Per-file checksums in sha256sum format, next to the archive.
+		with open(self.archiveFile + '.sha256', 'w', newline='\n') as file:
+			for arcname, digest in sorted(self.hashes.items()):
+				file.write(f'{digest}  {arcname}\n')
+		return manifestId(self.manifest)
+
+	def discard(self):
+		self._zip.close()
+		for path in (self._stagingFile, self._partialFile):
+			if os.path.isfile(path):
+				os.remove(path)
+
+
+def _alignmentExtra(headerOffset: int, arcname: str) -> bytes:
+	"""Local extra field that pads the data of an entry to a page boundary.
+
+	The layout is zipalign's: the id, the size, the alignment and the padding.
+	"""
+	# Local header: 30 fixed bytes, the name, this extra field without its
+	# padding and the zip64 extra.
+	offset = headerOffset + 30 + len(arcname.encode('utf-8')) + 6 + 20
+	padding = -offset % PAGE_SIZE
+	return struct.pack('<HHH', _ALIGNMENT_EXTRA_ID, 2 + padding, PAGE_SIZE) + bytes(padding)
+
+
+def _copySorted(stagingFile: str, outputFile: str):
+	"""Copy the compressed entries of stagingFile into outputFile, sorted by name."""
+	with zipfile.ZipFile(stagingFile) as staging, open(stagingFile, 'rb') as source, zipfile.ZipFile(outputFile, 'w') as output:
+		for entry in sorted(staging.infolist(), key=lambda entry: entry.filename):
+			source.seek(entry.header_offset + 26)
+			nameLength, extraLength = struct.unpack('<HH', source.read(4))
+			source.seek(entry.header_offset + 30 + nameLength + extraLength)
+			info = _zipInfo(entry.filename, (entry.external_attr >> 16) & 0o7777)
+			info.compress_type = entry.compress_type
+			info.CRC = entry.CRC
+			info.compress_size = entry.compress_size
+			info.file_size = entry.file_size
+			info.header_offset = output.fp.tell()
+			if entry.filename.rsplit('/', 1)[-1] in MAPPED_NAMES:
+				info.extra = _alignmentExtra(info.header_offset, entry.filename)
+			output.fp.write(info.FileHeader(zip64=True))
+			# The padding only matters in the local header.
+			info.extra = b''
+			remaining = entry.compress_size
+			while remaining:
+				chunk = source.read(min(remaining, BLOCK_SIZE))
+				if not chunk:
+					raise RuntimeError(f"'{stagingFile}' ends inside '{entry.filename}'")
+				output.fp.write(chunk)
+				remaining -= len(chunk)
+			output.filelist.append(info)
+			output.NameToInfo[info.filename] = info
+		output.start_dir = output.fp.tell()
+
+
+def writeArchive(archiveFile: str, sourceDir: str, rootDir: str):
+	archive = PackageArchive(archiveFile, rootDir)
+	try:
+		archive.addTree(sourceDir)
+	except BaseException:
+		archive.discard()
+		raise
+	archive.close()
+	return archive
+
+
+def _hashFile(path: str) -> str:
+	digest = hashlib.sha256()
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(BLOCK_SIZE), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def writeDeduplicatedArchives(archiveDir: str, buildDir: str, packageDirs: List[str]):
+	"""Archive packages with the content several of them share stored once in common.zip.
+
+	A file goes to common.zip when at least two packages have it with the same
+	content at the same path. Package manifests list such files under
+	'shared' together with the id of common.zip; extractPackage restores the
+	usual package layout from both archives.
+	"""
+	packages = dict()
+	for packageDir in packageDirs:
+		files = dict()
+		for root, dirs, names in os.walk(packageDir):
+			dirs.sort()
+			for name in sorted(names):
+				path = os.path.join(root, name)
+				files[os.path.relpath(path, packageDir).replace(os.sep, '/')] = (_hashFile(path), path)
+		packages[packageDir] = files
+
+	# The most common content of each path is shared if two packages have it.
+	counts = dict()
+	for files in packages.values():
+		for relativePath, (digest, _) in files.items():
+			counts.setdefault(relativePath, dict())
+			counts[relativePath][digest] = counts[relativePath].get(digest, 0) + 1
+	shared = dict()
+	for relativePath, digests in counts.items():
+		digest, count = max(sorted(digests.items()), key=lambda item: item[1])
+		if count > 1:
+			shared[relativePath] = digest
+
+	os.makedirs(archiveDir, exist_ok=True)
+	common = PackageArchive(os.path.join(archiveDir, COMMON_ARCHIVE), buildDir)
+	added = set()
+	try:
+		for packageDir in packageDirs:
+			for relativePath, (digest, path) in sorted(packages[packageDir].items()):
+				if shared.get(relativePath) == digest and relativePath not in added:
+					common.addFile(path, relativePath)
+					added.add(relativePath)
+	except BaseException:
+		common.discard()
+		raise
+	commonId = common.close()
+
+	savedBytes = 0
+	for packageDir in packageDirs:
+		prefix = os.path.relpath(packageDir, buildDir).replace(os.sep, '/')
+		archive = PackageArchive(os.path.join(archiveDir, prefix.replace('/', '-') + '.zip'), buildDir)
+		try:
+			for relativePath, (digest, path) in sorted(packages[packageDir].items()):
+				if shared.get(relativePath) == digest:
+					archive.manifest.setdefault('shared', dict())[relativePath] = common.manifest['files'][relativePath]
+					savedBytes += os.path.getsize(path)
+				else:
+					archive.addFile(path)
+			if 'shared' in archive.manifest:
+				archive.manifest['prefix'] = prefix
+				archive.manifest['common'] = commonId
+		except BaseException:
+			archive.discard()
+			raise
+		archive.close()
+	# The first copy of each shared file is still archived, in common.zip.
+	savedBytes -= sum(entry['size'] for entry in common.manifest['files'].values())
+	print(f"Archived {len(packageDirs)} package(s) with {len(added)} shared file(s) in '{COMMON_ARCHIVE}', {savedBytes} bytes deduplicated")
+
+
+def extractPackage(archiveFile: str, outputDir: str, commonFile: str = None):
+	"""Extract a package, restoring files deduplicated into common.zip."""
+	manifest = readManifest(archiveFile)
+	with zipfile.ZipFile(archiveFile) as archive:
+		for info in archive.infolist():
+			if info.filename != MANIFEST_NAME:
+				archive.extract(info, outputDir)
+				mode = manifest['files'].get(info.filename, dict()).get('mode')
+				if mode:
+					os.chmod(os.path.join(outputDir, info.filename), mode)
+	sharedFiles = manifest.get('shared')
+	if not sharedFiles:
+		return
+	commonFile = commonFile or os.path.join(os.path.dirname(os.path.abspath(archiveFile)), COMMON_ARCHIVE)
+	if manifestId(readManifest(commonFile)) != manifest['common']:
+		raise RuntimeError(f"'{commonFile}' is not the common archive '{archiveFile}' was created with")
+	with zipfile.ZipFile(commonFile) as common:
+		for relativePath, entry in sorted(sharedFiles.items()):
+			target = os.path.join(outputDir, manifest['prefix'], relativePath)
+			os.makedirs(os.path.dirname(target), exist_ok=True)
+			digest = hashlib.sha256()
+			with common.open(relativePath) as source, open(target, 'wb') as output:
+				for chunk in iter(lambda: source.read(BLOCK_SIZE), b''):
+					digest.update(chunk)
+					output.write(chunk)
+			if digest.hexdigest() != entry['sha256']:
+				raise RuntimeError(f"'{relativePath}' in '{commonFile}' does not match its manifest")
+			os.chmod(target, entry['mode'])
+
+
+def readManifest(archiveFile: str) -> dict:
+	with zipfile.ZipFile(archiveFile) as archive:
+		if MANIFEST_NAME not in archive.namelist():
+			raise RuntimeError(f"'{archiveFile}' has no {MANIFEST_NAME}; it predates content manifests")
+		return json.loads(archive.read(MANIFEST_NAME))
+
+
+def _segments(stream) -> List[Tuple[int, int]]:
+	"""(offset, length) segments of a file.
+
+	ar archives (static libraries) are split at member boundaries so a
+	changed object file does not shift every following block; other files
+	are split into fixed blocks.
+	"""
+	stream.seek(0, os.SEEK_END)
+	size = stream.tell()
+	stream.seek(0)
+	segments = []
+	if stream.read(8) == b'!<arch>\n':
+		segments.append((0, 8))
+		offset = 8
+		while offset + 60 <= size:
+			stream.seek(offset)
+			header = stream.read(60)
+			try:
+				memberSize = int(header[48:58].decode('ascii').strip())
+			except ValueError:
+				break
+			length = 60 + memberSize + (memberSize % 2)
+			length = min(length, size - offset)
+			# Very large members are split further.
+			for blockOffset in range(0, length, BLOCK_SIZE * 16):
+				segments.append((offset + blockOffset, min(BLOCK_SIZE * 16, length - blockOffset)))
+			offset += length
+		if offset < size:
+			segments.append((offset, size - offset))
+		return segments
+	return [(offset, min(BLOCK_SIZE, size - offset)) for offset in range(0, size, BLOCK_SIZE)]
+
+
+def _segmentHashes(path: str) -> List[Tuple[str, int, int]]:
+	with open(path, 'rb') as stream:
+		hashes = []
+		for offset, length in _segments(stream):
+			stream.seek(offset)
+			hashes.append((hashlib.sha256(stream.read(length)).hexdigest(), offset, length))
+		return hashes
+
+
+def _extract(archiveFile: str, targetDir: str) -> List[str]:
+	"""Extracts archiveFile and returns its entry names in write order."""
+	with zipfile.ZipFile(archiveFile) as archive:
+		infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+		for info in infos:
+			archive.extract(info, targetDir)
+		return [info.filename for info in infos]
+
+
+def createDelta(baseFile: str, targetFile: str, deltaFile: str):
+	"""Write a delta holding only the segments of targetFile missing from baseFile."""
+	baseManifest = readManifest(baseFile)
+	targetManifest = readManifest(targetFile)
+	with tempfile.TemporaryDirectory() as tempDir:
+		baseDir = os.path.join(tempDir, 'base')
+		targetDir = os.path.join(tempDir, 'target')
+		_extract(baseFile, baseDir)
+		order = _extract(targetFile, targetDir)
+
+		known = set()
+		for name in baseManifest['files']:
+			known.update(digest for digest, _, _ in _segmentHashes(os.path.join(baseDir, name)))
+
+		delta = {
+			'format': 1,
+			'base': manifestId(baseManifest),
+			'target': manifestId(targetManifest),
+			'order': order,
+			'files': dict(),
+		}
+		for key in ('shared', 'prefix', 'common'):
+			if key in targetManifest:
+				delta[key] = targetManifest[key]
+		added = 0
+		with zipfile.ZipFile(deltaFile + '.partial', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as output:
+			for name in order:
+				if name == MANIFEST_NAME:
+					continue
+				path = os.path.join(targetDir, name)
+				entry = targetManifest['files'].get(name, {'mode': 0o644})
+				segments = []
+				with open(path, 'rb') as stream:
+					for digest, offset, length in _segmentHashes(path):
+						segments.append([digest, length])
+						if digest in known:
+							continue
+						known.add(digest)
+						stream.seek(offset)
+						output.writestr(_zipInfo('segments/' + digest, 0o644), stream.read(length))
+						added += length
+				delta['files'][name] = {'mode': entry['mode'], 'segments': segments}
+			output.writestr(_zipInfo(DELTA_NAME, 0o644), json.dumps(delta, indent=1, sort_keys=True))
+		os.replace(deltaFile + '.partial', deltaFile)
+	print(f"Wrote '{deltaFile}' with {added} new bytes ({os.path.getsize(deltaFile)} bytes compressed)")
+
+
+def applyDelta(baseFile: str, deltaFile: str, outputFile: str):
+	"""Rebuild the target archive of a delta from its base archive."""
+	baseManifest = readManifest(baseFile)
+	with zipfile.ZipFile(deltaFile) as deltaArchive, tempfile.TemporaryDirectory() as tempDir:
+		delta = json.loads(deltaArchive.read(DELTA_NAME))
+		if delta['base'] != manifestId(baseManifest):
+			raise RuntimeError(f"'{deltaFile}' was not created from '{baseFile}'")
+
+		baseDir = os.path.join(tempDir, 'base')
+		_extract(baseFile, baseDir)
+		baseSegments: Dict[str, Tuple[str, int, int]] = dict()
+		for name in baseManifest['files']:
+			path = os.path.join(baseDir, name)
+			for digest, offset, length in _segmentHashes(path):
+				baseSegments.setdefault(digest, (path, offset, length))
+
+		def _readSegment(digest: str) -> bytes:
+			if digest in baseSegments:
+				path, offset, length = baseSegments[digest]
+				with open(path, 'rb') as stream:
+					stream.seek(offset)
+					return stream.read(length)
+			return deltaArchive.read('segments/' + digest)
+
+		archive = PackageArchive(outputFile, tempDir)
+		for key in ('shared', 'prefix', 'common'):
+			if key in delta:
+				archive.manifest[key] = delta[key]
+		try:
+			for name in delta['order']:
+				if name == MANIFEST_NAME:
+					continue
+				entry = delta['files'][name]
+				path = os.path.join(tempDir, 'target.tmp')
+				with open(path, 'wb') as target:
+					for digest, _ in entry['segments']:
+						target.write(_readSegment(digest))
+				with open(path, 'rb') as source:
+					archive.addStream(source, name, entry['mode'])
+		except BaseException:
+			archive.discard()
+			raise
+		if manifestId(archive.manifest) != delta['target']:
+			archive.discard()
+			raise RuntimeError(f"Applying '{deltaFile}' did not reproduce the target package")
+		archive.close()
+	print(f"Wrote '{outputFile}' ({delta['target']})")
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Inspect package archives and create or apply deltas between them',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	subParsers = argParser.add_subparsers(dest='command')
+	subParsers.required = True
+	manifestParser = subParsers.add_parser('manifest', help='Print the content id and manifest of an archive')
+	manifestParser.add_argument('archive')
+	deltaParser = subParsers.add_parser('delta', help='Create a delta from a base archive to a target archive')
+	deltaParser.add_argument('--base', required=True, help='Archive consumers already have')
+	deltaParser.add_argument('--target', required=True, help='New archive')
+	deltaParser.add_argument('--output', required=True, help='Delta file to write')
+	applyParser = subParsers.add_parser('apply', help='Rebuild a target archive from its base and a delta')
+	applyParser.add_argument('--base', required=True, help='Archive the delta was created from')
+	applyParser.add_argument('--delta', required=True, help='Delta file')
+	applyParser.add_argument('--output', required=True, help='Archive to write')
+	extractParser = subParsers.add_parser('extract', help='Extract a package, restoring content deduplicated into common.zip')
+	extractParser.add_argument('archive')
+	extractParser.add_argument('--output', required=True, help='Directory to extract into')
+	extractParser.add_argument('--common', help=f'Common archive; defaults to {COMMON_ARCHIVE} next to the package')
+	return argParser.parse_args()
+
+
+def main():
+	args = parseArgs()
+	if args.command == 'manifest':
+		manifest = readManifest(args.archive)
+		print(manifestId(manifest))
+		json.dump(manifest, sys.stdout, indent=1, sort_keys=True)
+		print('')
+	elif args.command == 'delta':
+		createDelta(args.base, args.target, args.output)
+	elif args.command == 'apply':
+		applyDelta(args.base, args.delta, args.output)
+	elif args.command == 'extract':
+		extractPackage(args.archive, args.output, args.common)
+	return 0
+
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except RuntimeError as error:
+		print(f"Error: {error}")
+		sys.exit(1)
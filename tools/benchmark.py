@@ -0,0 +1,426 @@
+import argparse
+import contextlib
+import functools
+import importlib.util
+import io
+import json
+import os
+import platform as sysPlatform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from typing import Callable, Dict
+
+from tools.cache import formatSize, parseSize
+from tools.types import BuildConfig, PlatformType
+from tools.v8 import NINJA_VERSION, V8
+
+V8_BRANCH = '13.6-lkgr'
+GN_VERSION = 'git_revision:0000000000000000000000000000000000000000'
+NDK_PACKAGE = 'android/ndk'
+NDK_VERSION = 'benchmark'
+DEPS = [
+	'build',
+	'buildtools',
+	'base/trace_event/common',
+	'third_party/abseil-cpp',
+	'third_party/icu',
+	'third_party/zlib',
+	'third_party/perfetto',
+	'tools/clang',
+]
+SCENARIOS = ['cold', 'warm']
+
+
+def _git(args, cwd):
+	subprocess.check_call(
+		['git', '-c', 'user.name=benchmark', '-c', 'user.email=benchmark@localhost', *args],
+		cwd=cwd,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+	)
+
+
+def _writeData(path: str, size: int):
+	"""Write size bytes that compress roughly like object code."""
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	block = os.urandom(64 * 1024) + bytes(128 * 1024)
+	with open(path, 'wb') as file:
+		written = 0
+		while written < size:
+			chunk = block[:size - written]
+			file.write(chunk)
+			written += len(chunk)
+
+
+def _writeTree(root: str, files: int, fileSize: int, extension: str):
+	for index in range(files):
+		_writeData(os.path.join(root, f'dir{index % 16}', f'file{index}{extension}'), fileSize)
+
+
+def _createRepository(remoteDir: str, name: str, populate: Callable[[str], None], branch: str = None):
+	"""Create a bare repository with one commit and return (url, sha)."""
+	workDir = os.path.join(remoteDir, 'work', name)
+	os.makedirs(workDir)
+	_git(['init', '--quiet'], workDir)
+	populate(workDir)
+	_git(['add', '-A'], workDir)
+	_git(['commit', '--quiet', '-m', name], workDir)
+	if branch:
+		_git(['branch', '-M', branch], workDir)
+	bareDir = os.path.join(remoteDir, name.replace('/', '_') + '.git')
+	_git(['clone', '--quiet', '--bare', workDir, bareDir], remoteDir)
+	_git(['config', 'uploadpack.allowAnySHA1InWant', 'true'], bareDir)
+	sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=workDir, text=True).strip()
+	shutil.rmtree(workDir)
+	return 'file://' + bareDir.replace(os.sep, '/'), sha
+
+
+def _zipBytes(files: Dict[str, bytes]) -> bytes:
+	buffer = io.BytesIO()
+	with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+		for name, content in files.items():
+			archive.writestr(name, content)
+	return buffer.getvalue()
+
+
+class Fixture:
+	"""Offline stand-ins for the V8 git hosts, the binary downloads and build outputs."""
+
+	def __init__(self, root: str, args):
+		self.root = root
+		self._args = args
+		self.remoteDir = os.path.join(root, 'remote')
+		self.downloadDir = os.path.join(root, 'downloads')
+		self.buildDir = os.path.join(root, 'build')
+		self._server = None
+
+	def create(self):
+		print('Creating fixture')
+		os.makedirs(self.remoteDir)
+		args = self._args
+		depsLines = []
+		for name in DEPS:
+			url, sha = _createRepository(
+				self.remoteDir,
+				name,
+				lambda workDir: _writeTree(workDir, args.dep_files, args.dep_file_size, '.cc'),
+			)
+			depsLines.append(f"  '{name}': '{url}@{sha}',")
+
+		def _populateV8(workDir):
+			includeDir = os.path.join(workDir, 'include')
+			_writeTree(includeDir, args.headers, args.header_size, '.h')
+			with open(os.path.join(includeDir, 'v8-version.h'), 'w') as file:
+				file.write(
+					'#define V8_MAJOR_VERSION 13\n#define V8_MINOR_VERSION 6\n'
+					'#define V8_BUILD_NUMBER 0\n#define V8_PATCH_LEVEL 0\n'
+				)
+			with open(os.path.join(workDir, 'LICENSE'), 'w') as file:
+				file.write('Benchmark license\n')
+			with open(os.path.join(workDir, 'DEPS'), 'w') as file:
+				file.write('\n'.join([
+					"vars = {",
+					f"  'gn_version': '{GN_VERSION}',",
+					"}",
+					"deps = {",
+					*depsLines,
+					"  'third_party/android_toolchain/ndk': {",
+					f"    'packages': [{{'package': '{NDK_PACKAGE}', 'version': '{NDK_VERSION}'}}],",
+					"    'dep_type': 'cipd',",
+					"  },",
+					"}",
+				]) + '\n')
+
+		self.repositoryUrl, _ = _createRepository(self.remoteDir, 'v8', _populateV8, V8_BRANCH)
+
+		# Downloads, laid out as the URLs V8 builds from NINJA_URL and CIPD_URL.
+		tool = b'#!/bin/sh\necho benchmark\n'
+		self._writeDownload(f'ninja/v{NINJA_VERSION}/ninja-linux.zip', _zipBytes({'ninja': tool}))
+		self._writeDownload(f'cipd/gn/gn/linux-amd64/+/{GN_VERSION}', _zipBytes({'gn': tool}))
+		ndkFile = self._downloadPath(f'cipd/{NDK_PACKAGE}/+/{NDK_VERSION}')
+		with zipfile.ZipFile(ndkFile, 'w', zipfile.ZIP_DEFLATED) as archive:
+			archive.writestr('source.properties', 'Pkg.Revision = 0.0.0\n')
+			for index in range(args.ndk_files):
+				archive.writestr(f'toolchains/file{index}', os.urandom(args.ndk_file_size // 4) + bytes(args.ndk_file_size * 3 // 4))
+
+		# Build outputs of one configuration, as ninja leaves them.
+		_writeData(os.path.join(self.buildDir, 'obj', 'libv8_monolith.a'), args.library_size)
+
+	def _downloadPath(self, path: str):
+		target = os.path.join(self.downloadDir, *path.split('/'))
+		os.makedirs(os.path.dirname(target), exist_ok=True)
+		return target
+
+	def _writeDownload(self, path: str, content: bytes):
+		with open(self._downloadPath(path), 'wb') as file:
+			file.write(content)
+
+	def serve(self):
+		handler = functools.partial(_QuietHandler, directory=self.downloadDir)
+		self._server = HTTPServer(('127.0.0.1', 0), handler)
+		threading.Thread(target=self._server.serve_forever, daemon=True).start()
+		baseUrl = f'http://127.0.0.1:{self._server.server_address[1]}'
+		V8.REPOSITORY_URL = self.repositoryUrl
+		V8.NINJA_URL = baseUrl + '/ninja'
+		V8.CIPD_URL = baseUrl + '/cipd'
+
+	def stop(self):
+		if self._server:
+			self._server.shutdown()
+			self._server.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+
+def _evictFromPageCache(path: str):
+	"""Drop a file from the page cache so the next read comes from disk."""
+	if not hasattr(os, 'posix_fadvise'):
+		return
+	for root, _, files in os.walk(path) if os.path.isdir(path) else [(os.path.dirname(path), [], [os.path.basename(path)])]:
+		for name in files:
+			fd = os.open(os.path.join(root, name), os.O_RDONLY)
+			try:
+				os.fsync(fd)
+				os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+			finally:
+				os.close(fd)
+
+
+def _treeSize(path: str):
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	return sum(
+		os.path.getsize(os.path.join(root, name))
+		for root, _, files in os.walk(path)
+		for name in files
+	)
+
+
+@contextlib.contextmanager
+def _quiet(logFile: str):
+	"""Send this process' and its children's output to logFile."""
+	sys.stdout.flush()
+	sys.stderr.flush()
+	savedOut, savedErr = os.dup(1), os.dup(2)
+	with open(logFile, 'a') as log:
+		os.dup2(log.fileno(), 1)
+		os.dup2(log.fileno(), 2)
+		try:
+			yield
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+			os.dup2(savedOut, 1)
+			os.dup2(savedErr, 2)
+			os.close(savedOut)
+			os.close(savedErr)
+
+
+@contextlib.contextmanager
+def _workingDirectory(path: str):
+	previous = os.getcwd()
+	os.makedirs(path, exist_ok=True)
+	os.chdir(path)
+	try:
+		yield
+	finally:
+		os.chdir(previous)
+
+
+def _loadDockerModule():
+	dockerScript = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker', 'docker.py')
+	spec = importlib.util.spec_from_file_location('v8_packager_docker', dockerScript)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+class Benchmark:
+	"""Times each packager phase cold (empty caches, evicted inputs) and warm."""
+
+	def __init__(self, root: str, fixture: Fixture):
+		self._root = root
+		self._fixture = fixture
+		self._logFile = os.path.join(root, 'benchmark.log')
+		self.results = dict()
+
+	def _time(self, phase: str, scenario: str, action: Callable, measured: str = None):
+		with _quiet(self._logFile):
+			start = time.perf_counter()
+			action()
+			elapsed = time.perf_counter() - start
+		result = self.results.setdefault(phase, dict())
+		result[scenario] = elapsed
+		if measured and os.path.exists(measured):
+			result['bytes'] = _treeSize(measured)
+		print(f'{phase:<26} {scenario:<5} {elapsed:9.3f}s')
+
+	def run(self):
+		gitCache = os.path.join(self._root, 'git-cache')
+		toolchainCache = os.path.join(self._root, 'toolchain-cache')
+		os.environ['V8_PACKAGER_GIT_CACHE'] = gitCache
+		os.environ['V8_PACKAGER_TOOLCHAIN_CACHE'] = toolchainCache
+		os.environ.pop('V8_PACKAGER_TOOLCHAIN_DIR', None)
+		docker = _loadDockerModule()
+
+		for scenario in SCENARIOS:
+			# Cold runs start without caches; warm runs use a fresh workspace
+			# with the caches the cold run populated.
+			workspace = os.path.join(self._root, 'workspace-' + scenario)
+			if scenario == 'cold':
+				for path in (gitCache, toolchainCache):
+					shutil.rmtree(path, ignore_errors=True)
+				_evictFromPageCache(self._fixture.remoteDir)
+				_evictFromPageCache(self._fixture.buildDir)
+			with _workingDirectory(workspace):
+				self._time('fetch.v8', scenario, lambda: V8.initializeRepository(V8.Version.fromString('13.6')), 'v8')
+				v8 = V8(workspace)
+				self._time('fetch.binaries', scenario, lambda: v8.fetchBinaryDependencies([PlatformType.Linux]), 'bin')
+				self._time('fetch.deps', scenario, lambda: v8.fetchProjectDependencies([PlatformType.Linux]), 'v8')
+				self._time('fetch.ndk', scenario, v8.fetchAndroidToolchain, os.path.join('v8', 'third_party', 'android_toolchain'))
+
+				distDir = os.path.join(workspace, 'dist')
+				packageDir = os.path.join(distDir, 'linux', 'x64')
+				libOutDir = os.path.join(packageDir, 'libs', 'release')
+				self._time(
+					'export.libs', scenario,
+					lambda: v8._exportLibs(self._fixture.buildDir, libOutDir, PlatformType.Linux, BuildConfig.Release, V8.LibraryType.Static),
+					libOutDir,
+				)
+				includeDir = os.path.join(packageDir, 'include')
+				if scenario == 'cold':
+					_evictFromPageCache(os.path.join(workspace, 'v8', 'include'))
+				self._time('export.includes', scenario, lambda: v8.exportIncludes(includeDir), includeDir)
+				archiveDir = os.path.join(workspace, 'archive')
+				if scenario == 'cold':
+					_evictFromPageCache(distDir)
+				self._time('archive', scenario, lambda: v8.archive(archiveDir, distDir), archiveDir)
+				destination = os.path.join(self._root, 'exported-' + scenario)
+				self._time('docker.export_artifacts', scenario, lambda: docker.export_artifacts(workspace, destination), destination)
+
+
+def _compare(results: dict, baselineFile: str):
+	with open(baselineFile) as file:
+		baseline = json.load(file)
+	print('')
+	print(f'Compared with {baselineFile}')
+	for phase, values in results['phases'].items():
+		for scenario in SCENARIOS:
+			previous = baseline.get('phases', dict()).get(phase, dict()).get(scenario)
+			current = values.get(scenario)
+			if previous and current is not None:
+				change = (current - previous) / previous
+				print(f'{phase:<26} {scenario:<5} {previous:9.3f}s -> {current:9.3f}s ({change:+.1%})')
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Benchmark the packager fetch, export and archive paths offline',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	argParser.add_argument('--output',
+		default='benchmark-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')),
+		help='Result file')
+	argParser.add_argument('--compare',
+		help='Earlier result file to compare with')
+	argParser.add_argument('--work-dir',
+		help='Directory for the fixture and workspaces; a temporary directory by default')
+	argParser.add_argument('--keep',
+		action='store_true',
+		help='Keep the work directory')
+	argParser.add_argument('--library-size',
+		type=parseSize,
+		default='2g',
+		help='Size of the synthetic static library')
+	argParser.add_argument('--headers',
+		type=int,
+		default=400,
+		help='Number of synthetic V8 headers')
+	argParser.add_argument('--header-size',
+		type=parseSize,
+		default='16k',
+		help='Size of each synthetic header')
+	argParser.add_argument('--dep-files',
+		type=int,
+		default=200,
+		help='Files in each synthetic DEPS repository')
+	argParser.add_argument('--dep-file-size',
+		type=parseSize,
+		default='32k',
+		help='Size of each file in the DEPS repositories')
+	argParser.add_argument('--ndk-files',
+		type=int,
+		default=64,
+		help='Files in the synthetic NDK package')
+	argParser.add_argument('--ndk-file-size',
+		type=parseSize,
+		default='1m',
+		help='Size of each NDK file')
+	return argParser.parse_args()
+
+
+def main():
+	args = parseArgs()
+	if sysPlatform.system() != 'Linux':
+		print('Error: The benchmark runs on Linux only.')
+		return 1
+	outputFile = os.path.abspath(args.output)
+	workDir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='v8-packager-benchmark-')
+	if os.path.isdir(workDir) and os.listdir(workDir):
+		print(f'Error: Work directory {workDir} is not empty.')
+		return 1
+	os.makedirs(workDir, exist_ok=True)
+
+	fixture = Fixture(workDir, args)
+	try:
+		fixture.create()
+		fixture.serve()
+		benchmark = Benchmark(workDir, fixture)
+		benchmark.run()
+	finally:
+		fixture.stop()
+		if not args.keep:
+			shutil.rmtree(workDir, ignore_errors=True)
+
+	results = {
+		'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'host': {
+			'system': sysPlatform.platform(),
+			'python': sysPlatform.python_version(),
+			'cpus': os.cpu_count(),
+		},
+		'parameters': {
+			'librarySize': args.library_size,
+			'headers': args.headers,
+			'headerSize': args.header_size,
+			'deps': len(DEPS),
+			'depFiles': args.dep_files,
+			'depFileSize': args.dep_file_size,
+			'ndkFiles': args.ndk_files,
+			'ndkFileSize': args.ndk_file_size,
+		},
+		'phases': benchmark.results,
+	}
+	with open(outputFile, 'w') as file:
+		json.dump(results, file, indent=2, sort_keys=True)
+	print(f'Wrote {outputFile} (library {formatSize(args.library_size)})')
+	if args.compare:
+		_compare(results, args.compare)
+	return 0
+
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except RuntimeError as error:
+		print(f"Error: {error}")
+		sys.exit(1)
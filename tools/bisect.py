@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+from typing import List
+
+from tools.journal import Journal
+from tools.lock import fileLock, workspaceLockFile
+from tools.types import ArchType, BuildConfig, PlatformType
+from tools.v8 import V8
+
+
+def parseThreshold(value: str) -> float:
+	try:
+		if value.endswith('%'):
+			return float(value[:-1]) / 100
+		return float(value)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"invalid threshold: {value!r}")
+
+
+class History:
+	"""Commit graph between two V8 revisions, fetched without file contents."""
+
+	def __init__(self, root: str):
+		self._repository = os.path.join(root, '.v8-packager', 'bisect-history.git')
+
+	def _git(self, *args) -> str:
+		return subprocess.check_output(['git', *args], cwd=self._repository, text=True).strip()
+
+	def fetch(self, good: str, bad: str):
+		if not os.path.isfile(os.path.join(self._repository, 'HEAD')):
+			os.makedirs(self._repository, exist_ok=True)
+			subprocess.check_call(['git', 'init', '--bare', '--quiet'], cwd=self._repository)
+		print(f'Fetching history between {good} and {bad}')
+		self._git('fetch', '--quiet', '--depth=1', '--filter=blob:none', V8.REPOSITORY_URL, f'+{good}:refs/bisect/good')
+		goodTime = int(self._git('log', '-1', '--format=%ct', 'refs/bisect/good'))
+		# Everything committed after the good revision, a day of clock skew included.
+		self._git(
+			'fetch', '--quiet', '--filter=blob:none', f'--shallow-since={goodTime - 86400}',
+			V8.REPOSITORY_URL, f'+{bad}:refs/bisect/bad',
+		)
+
+	def commits(self) -> List[str]:
+		"""First-parent commits from good to bad, oldest first, both included."""
+		good = self._git('rev-parse', 'refs/bisect/good^{commit}')
+		bad = self._git('rev-parse', 'refs/bisect/bad^{commit}')
+		between = self._git('rev-list', '--first-parent', '--ancestry-path', '--reverse', f'{good}..{bad}').split()
+		if not between or between[-1] != bad:
+			raise RuntimeError(f"Good revision {good} is not an ancestor of bad revision {bad}")
+		return [good] + between
+
+	def describe(self, commit: str) -> str:
+		return self._git('log', '-1', '--format=%h %s (%an, %cs)', commit)
+
+
+class Bisect:
+	"""Builds V8 commits and benchmarks the package to find the first regressing one.
+
+	Results are recorded per commit in .v8-packager/bisect.json, so an
+	interrupted bisect resumes without rebuilding measured commits.
+	"""
+
+	def __init__(self, root: str, args):
+		self._root = os.path.abspath(root)
+		self._args = args
+		self._buildSettings = V8.BuildSettings(PlatformType[args.platform], ArchType[args.arch], BuildConfig[args.config])
+		self._outDir = os.path.join(self._root, 'bisect', 'dist')
+		self._resultsFile = os.path.join(self._root, '.v8-packager', 'bisect.json')
+		self._key = Journal.fingerprint(
+			args.command, args.metric, args.platform, args.arch, args.config, args.library_type, args.ccache,
+		)
+		self._results = dict()
+		if os.path.isfile(self._resultsFile):
+			with open(self._resultsFile) as file:
+				stored = json.load(file)
+			if stored.get('key') == self._key:
+				self._results = stored.get('results', dict())
+
+	def _save(self):
+		os.makedirs(os.path.dirname(self._resultsFile), exist_ok=True)
+		stagingFile = self._resultsFile + '.tmp'
+		with open(stagingFile, 'w') as file:
+			json.dump({'key': self._key, 'results': self._results}, file, indent=1, sort_keys=True)
+		os.replace(stagingFile, self._resultsFile)
+
+	def _projectSettings(self) -> V8.ProjectSettings:
+		projectSettings = V8.ProjectSettings(V8.LibraryType(self._args.library_type))
+		if self._args.ccache:
+			if shutil.which('ccache') is None:
+				raise RuntimeError("--ccache requires ccache on PATH")
+			projectSettings.defaultArgs['cc_wrapper'] = 'ccache'
+		return projectSettings
+
+	def _build(self, commit: str) -> str:
+		v8 = V8.checkoutRevision(self._root, commit)
+		platforms = [self._buildSettings.platform]
+		v8.fetchBinaryDependencies(platforms)
+		v8.fetchProjectDependencies(platforms)
+		v8.applyPatches()
+		shutil.rmtree(self._outDir, ignore_errors=True)
+		v8.build(self._outDir, self._projectSettings(), [self._buildSettings])
+		packageDir = os.path.join(self._outDir, self._buildSettings.platform.value.lower(), self._buildSettings.arch.value.lower())
+		if not os.path.isdir(packageDir):
+			raise RuntimeError(f"Build of {commit} did not produce {packageDir}")
+		return packageDir
+
+	def _benchmark(self, commit: str, packageDir: str) -> float:
+		env = os.environ.copy()
+		env['V8_PACKAGE_DIR'] = packageDir
+		env['V8_REVISION'] = commit
+		values = []
+		for _ in range(self._args.runs):
+			result = subprocess.run(self._args.command, shell=True, env=env, capture_output=True, text=True)
+			if result.returncode != 0:
+				raise RuntimeError(f"Benchmark failed with exit code {result.returncode}:\n{result.stdout}{result.stderr}")
+			matches = re.findall(self._args.metric, result.stdout)
+			if not matches:
+				raise RuntimeError(f"Benchmark output did not match '{self._args.metric}':\n{result.stdout}")
+			match = matches[-1]
+			values.append(float(match if isinstance(match, str) else match[0]))
+		return statistics.median(values)
+
+	def measure(self, commit: str):
+		"""Median benchmark value of commit, or None when it cannot be built."""
+		if commit in self._results:
+			return self._results[commit].get('value')
+		print(f'Measuring {commit}')
+		try:
+			packageDir = self._build(commit)
+		except (RuntimeError, subprocess.CalledProcessError) as error:
+			print(f'Skipping {commit}: {error}')
+			self._results[commit] = {'value': None, 'error': str(error)}
+			self._save()
+			return None
+		value = self._benchmark(commit, packageDir)
+		print(f'\t- {commit}: {value}')
+		self._results[commit] = {'value': value}
+		self._save()
+		return value
+
+	def run(self, commits: List[str]):
+		"""Returns (last good index, first bad index) into commits."""
+		baseline = self.measure(commits[0])
+		if baseline is None:
+			raise RuntimeError(f"Good revision {commits[0]} could not be built")
+		threshold = self._args.threshold
+
+		def _regressed(value):
+			if self._args.higher_is_better:
+				return value < baseline * (1 - threshold)
+			return value > baseline * (1 + threshold)
+
+		badValue = self.measure(commits[-1])
+		if badValue is None:
+			raise RuntimeError(f"Bad revision {commits[-1]} could not be built")
+		if not _regressed(badValue):
+			raise RuntimeError(f"Bad revision {commits[-1]} ({badValue}) is within {threshold:.1%} of good ({baseline})")
+
+		low, high = 0, len(commits) - 1
+		skipped = set()
+		while high - low > 1:
+			candidates = [index for index in range(low + 1, high) if index not in skipped]
+			if not candidates:
+				break
+			middle = (low + high) // 2
+			index = min(candidates, key=lambda candidate: abs(candidate - middle))
+			value = self.measure(commits[index])
+			if value is None:
+				skipped.add(index)
+			elif _regressed(value):
+				high = index
+			else:
+				low = index
+		return low, high
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Find the first V8 commit whose package regresses a benchmark',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	argParser.add_argument('--good',
+		required=True,
+		help='Revision (commit, tag or branch) without the regression')
+	argParser.add_argument('--bad',
+		required=True,
+		help='Revision with the regression')
+	argParser.add_argument('--command',
+		required=True,
+		help='Benchmark shell command; V8_PACKAGE_DIR points at the package and V8_REVISION names the commit')
+	argParser.add_argument('--metric',
+		default=r'(-?\d+(?:\.\d+)?)',
+		help='Regular expression whose last match in the benchmark output is the measured value')
+	argParser.add_argument('--threshold',
+		type=parseThreshold,
+		default='5%',
+		help='Relative change from the good revision that counts as a regression')
+	argParser.add_argument('--higher-is-better',
+		action='store_true',
+		help='Treat lower values as regressions, e.g. for throughput')
+	argParser.add_argument('--runs',
+		type=int,
+		default=3,
+		help='Benchmark runs per commit; the median is compared')
+	argParser.add_argument('--platform',
+		choices=[platform.value for platform in PlatformType],
+		default=PlatformType.Linux.value,
+		help='Target platform')
+	argParser.add_argument('--arch',
+		choices=[arch.value for arch in ArchType],
+		default=ArchType.x64.value,
+		help='Target architecture')
+	argParser.add_argument('--config',
+		choices=[config.value for config in BuildConfig],
+		default=BuildConfig.Release.value,
+		help='Target configuration')
+	argParser.add_argument('--library-type',
+		choices=[libraryType.value for libraryType in V8.LibraryType],
+		default=V8.LibraryType.Static.value,
+		help='Library output type')
+	argParser.add_argument('--ccache',
+		action='store_true',
+		help='Compile through ccache so commits share unchanged objects')
+	args = argParser.parse_args()
+	if args.runs < 1:
+		argParser.error('--runs must be at least 1')
+	return args
+
+
+def main():
+	args = parseArgs()
+	root = os.getcwd()
+	if not os.path.isdir(os.path.join(root, 'v8', '.git')):
+		print("Error: Expected a fetched V8 checkout; run 'python -m tools.run --fetch' first.")
+		return 1
+
+	history = History(root)
+	history.fetch(args.good, args.bad)
+	commits = history.commits()
+	print(f'Bisecting {len(commits)} commits')
+
+	bisect = Bisect(root, args)
+	low, high = bisect.run(commits)
+	print('')
+	print(f'Last good: {history.describe(commits[low])} -> {bisect.measure(commits[low])}')
+	if high - low > 1:
+		print(f'{high - low - 1} commit(s) in between could not be built')
+	print(f'First bad: {history.describe(commits[high])} -> {bisect.measure(commits[high])}')
+	return 0
+
+
+if __name__ == '__main__':
+	try:
+		with fileLock(workspaceLockFile(os.getcwd()), shared=True):
+			sys.exit(main())
+	except RuntimeError as error:
+		print(f"Error: {error}")
+		sys.exit(1)
@@ -0,0 +1,329 @@
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from tools.lock import fileLock, workspaceLockFile
+
+
+class CacheEntry:
+	def __init__(self, kind: str, path: str, size: int, lastUsed: float, label: str):
+		self.kind = kind
+		self.path = path
+		self.size = size
+		self.lastUsed = lastUsed
+		self.label = label
+		self.repository = None
+		self.refKey = None
+		self.workspace = None
+
+
+def parseSize(value: str) -> int:
+	units = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+	match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', value.lower())
+	if not match:
+		raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+	return int(float(match.group(1)) * units[match.group(2)])
+
+
+def formatSize(size: int) -> str:
+	for unit in ['B', 'KiB', 'MiB', 'GiB']:
+		if size < 1024:
+			return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+		size /= 1024
+	return f'{size:.1f} TiB'
+
+
+def _directorySize(path: str, exclude: List[str] = None) -> int:
+	exclude = [os.path.abspath(item) for item in exclude or []]
+	total = 0
+	for root, dirs, files in os.walk(path):
+		dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) not in exclude]
+		for name in files:
+			try:
+				total += os.lstat(os.path.join(root, name)).st_blocks * 512
+			except (OSError, AttributeError):
+				try:
+					total += os.lstat(os.path.join(root, name)).st_size
+				except OSError:
+					pass
+	return total
+
+
+def _mtime(*paths) -> float:
+	times = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+	return max(times) if times else 0.0
+
+
+def _readV8Version(v8Dir: str):
+	versionFile = os.path.join(v8Dir, 'include', 'v8-version.h')
+	if not os.path.isfile(versionFile):
+		return 'unknown'
+	with open(versionFile) as file:
+		content = file.read()
+	parts = [
+		re.search(rf'V8_{name} (\d+)', content)
+		for name in ('MAJOR_VERSION', 'MINOR_VERSION', 'BUILD_NUMBER', 'PATCH_LEVEL')
+	]
+	return '.'.join(part.group(1) for part in parts if part)
+
+
+def _gitCacheEntries(gitCache: str) -> List[CacheEntry]:
+	entries = []
+	for repository in sorted(glob.glob(os.path.join(gitCache, '*.git'))):
+		usageDir = os.path.join(repository, 'v8-packager')
+		usages = []
+		if os.path.isdir(usageDir):
+			for name in os.listdir(usageDir):
+				if not name.endswith('.json'):
+					continue
+				usageFile = os.path.join(usageDir, name)
+				try:
+					with open(usageFile) as file:
+						usage = json.load(file)
+				except (OSError, ValueError):
+					continue
+				usages.append((name[:-len('.json')], usage, os.path.getmtime(usageFile)))
+		# Shallow refs rarely share objects, so split the repository size
+		# evenly between its refs.
+		repositorySize = _directorySize(repository)
+		share = repositorySize // max(len(usages), 1)
+		for refKey, usage, lastUsed in usages:
+			entry = CacheEntry(
+				'git-ref',
+				repository,
+				share,
+				lastUsed,
+				'{}@{}'.format(usage.get('url'), usage.get('ref')),
+			)
+			entry.repository = repository
+			entry.refKey = refKey
+			entries.append(entry)
+		if not usages:
+			entry = CacheEntry('git-repository', repository, repositorySize, _mtime(repository), repository)
+			entry.repository = repository
+			entries.append(entry)
+	return entries
+
+
+def _workspaceEntries(workspace: str) -> List[CacheEntry]:
+	v8Dir = os.path.join(workspace, 'v8')
+	outRoot = os.path.join(v8Dir, 'out.gn')
+	version = _readV8Version(v8Dir)
+	entries = []
+	for buildDir in sorted(glob.glob(os.path.join(outRoot, '*', '*', '*'))):
+		if not os.path.isdir(buildDir) or os.path.islink(buildDir):
+			continue
+		lastUsed = _mtime(
+			buildDir,
+			os.path.join(buildDir, '.ninja_log'),
+			os.path.join(buildDir, 'build.ninja'),
+		)
+		entry = CacheEntry(
+			'out.gn',
+			buildDir,
+			_directorySize(buildDir),
+			lastUsed,
+			f'v8 {version} {os.path.relpath(buildDir, outRoot)}',
+		)
+		entry.workspace = workspace
+		entries.append(entry)
+	lastUsed = max(
+		[_mtime(os.path.join(v8Dir, '.git', 'index'), os.path.join(v8Dir, '.git', 'HEAD'))]
+		+ [entry.lastUsed for entry in entries]
+	)
+	checkout = CacheEntry(
+		'workspace',
+		workspace,
+		_directorySize(workspace, exclude=[outRoot]),
+		lastUsed,
+		f'v8 {version} {os.path.basename(workspace)}',
+	)
+	checkout.workspace = workspace
+	entries.append(checkout)
+	return entries
+
+
+def collectEntries(gitCache: str, workspaces: List[str]) -> List[CacheEntry]:
+	entries = []
+	if gitCache and os.path.isdir(gitCache):
+		entries.extend(_gitCacheEntries(gitCache))
+	for workspace in workspaces:
+		if os.path.isdir(workspace):
+			entries.extend(_workspaceEntries(workspace))
+	return entries
+
+
+def report(entries: List[CacheEntry]):
+	byVersion: Dict[str, int] = dict()
+	total = 0
+	for entry in entries:
+		total += entry.size
+		if entry.kind in ('out.gn', 'workspace'):
+			version = entry.label.split(' ')[1]
+			byVersion[version] = byVersion.get(version, 0) + entry.size
+		else:
+			byVersion['git cache'] = byVersion.get('git cache', 0) + entry.size
+
+	print('Space by V8 version')
+	print('-------------------')
+	for version, size in sorted(byVersion.items()):
+		print(f'{version:<20} {formatSize(size):>12}')
+	print(f'{"total":<20} {formatSize(total):>12}')
+	print('')
+	print('Entries (least recently used first)')
+	print('-----------------------------------')
+	for entry in sorted(entries, key=lambda entry: entry.lastUsed):
+		lastUsed = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.lastUsed)) if entry.lastUsed else 'never'
+		print(f'{lastUsed:<17} {formatSize(entry.size):>12}  {entry.kind:<14} {entry.label}')
+
+
+def _evictWorkspace(entry: CacheEntry, dryRun: bool):
+	# Never delete a workspace or build tree that a running build holds. The
+	# lock stays held while deleting so no build can start in between.
+	lockFile = workspaceLockFile(entry.workspace)
+
+	def _keepLock(function, path, excInfo):
+		# Windows cannot delete the open lock file or the directories holding it.
+		path = os.path.abspath(path)
+		if os.path.commonpath([path, os.path.abspath(lockFile)]) != path:
+			raise excInfo[1]
+
+	try:
+		with fileLock(lockFile, blocking=False):
+			print(f'Evict {entry.kind} {entry.label} ({formatSize(entry.size)})')
+			if not dryRun:
+				shutil.rmtree(entry.path, onerror=_keepLock)
+	except BlockingIOError:
+		print(f'Skip {entry.label}: workspace is in use')
+		return False
+	if not dryRun and os.path.isdir(entry.path):
+		shutil.rmtree(entry.path, ignore_errors=True)
+	return True
+
+
+def _evictGitRef(entry: CacheEntry, dryRun: bool):
+	print(f'Evict {entry.kind} {entry.label} ({formatSize(entry.size)})')
+	if dryRun:
+		return True
+	with fileLock(entry.repository + '.lock'):
+		if entry.refKey is None:
+			shutil.rmtree(entry.repository)
+			return True
+		subprocess.run(
+			['git', 'update-ref', '-d', 'refs/v8-packager/' + entry.refKey],
+			cwd=entry.repository,
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
+		)
+		usageFile = os.path.join(entry.repository, 'v8-packager', entry.refKey + '.json')
+		if os.path.isfile(usageFile):
+			os.remove(usageFile)
+	return True
+
+
+def enforceBudget(entries: List[CacheEntry], budget: int, dryRun: bool = False):
+	"""Evict least recently used entries until the total size fits the budget."""
+	total = sum(entry.size for entry in entries)
+	evicted = set()
+	for entry in sorted(entries, key=lambda entry: entry.lastUsed):
+		if total <= budget:
+			break
+		if id(entry) in evicted:
+			continue
+		if entry.kind in ('git-ref', 'git-repository'):
+			removed = _evictGitRef(entry, dryRun)
+		else:
+			removed = _evictWorkspace(entry, dryRun)
+		if not removed:
+			continue
+		evicted.add(id(entry))
+		total -= entry.size
+		if entry.kind == 'workspace':
+			# Removing a workspace also removes its build trees.
+			for other in entries:
+				if other.kind == 'out.gn' and other.workspace == entry.workspace and id(other) not in evicted:
+					evicted.add(id(other))
+					total -= other.size
+	print(f'Cache size after eviction: {formatSize(max(total, 0))} (budget {formatSize(budget)})')
+
+
+def maintainGitCache(gitCache: str):
+	"""Drop unreachable objects and write lookup indexes for each cache repository."""
+	for repository in sorted(glob.glob(os.path.join(gitCache, '*.git'))):
+		with fileLock(repository + '.lock'):
+			refs = subprocess.run(
+				['git', 'for-each-ref', '--format=%(refname)', 'refs/v8-packager/'],
+				cwd=repository,
+				capture_output=True,
+				text=True,
+			).stdout.split()
+			if not refs:
+				print(f'Remove unused cache repository {repository}')
+				shutil.rmtree(repository)
+				continue
+			print(f'Maintain {repository}')
+			for command in [
+				['git', 'pack-refs', '--all', '--prune'],
+				['git', 'repack', '-a', '-d', '-q', '--write-midx'],
+				['git', 'prune', '--expire=now'],
+				['git', 'commit-graph', 'write', '--reachable'],
+				['git', 'multi-pack-index', 'write'],
+			]:
+				result = subprocess.run(command, cwd=repository, capture_output=True, text=True)
+				if result.returncode != 0:
+					print(f"\t- '{' '.join(command[1:3])}' failed: {(result.stderr or result.stdout).strip()}")
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Report, maintain and garbage collect V8 packager caches',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	argParser.add_argument('--git-cache',
+		default=os.environ.get('V8_PACKAGER_GIT_CACHE', os.path.join('.docker', 'git-cache')),
+		help='Shared git cache directory')
+	argParser.add_argument('--workspace',
+		nargs='*',
+		default=None,
+		help='Build workspaces; defaults to .docker/workspace-*')
+	argParser.add_argument('--budget',
+		type=parseSize,
+		help='Disk budget, e.g. 200g; least recently used entries are evicted to fit')
+	argParser.add_argument('--gc',
+		action='store_true',
+		help='Repack the git cache and write commit-graph and multi-pack-index files')
+	argParser.add_argument('--dry-run',
+		action='store_true',
+		help='Only print what would be evicted')
+	return argParser.parse_args()
+
+
+def main():
+	args = parseArgs()
+	workspaces = args.workspace
+	if workspaces is None:
+		workspaces = sorted(glob.glob(os.path.join('.docker', 'workspace-*')))
+
+	entries = collectEntries(args.git_cache, workspaces)
+	if args.budget is not None:
+		enforceBudget(entries, args.budget, args.dry_run)
+	if (args.gc or args.budget is not None) and not args.dry_run and os.path.isdir(args.git_cache):
+		maintainGitCache(args.git_cache)
+		entries = collectEntries(args.git_cache, workspaces)
+	report(entries)
+	return 0
+
+
+if __name__ == '__main__':
+	try:
+		sys.exit(main())
+	except RuntimeError as error:
+		print(f"Error: {error}")
+		sys.exit(1)
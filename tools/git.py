@@ -1,33 +1,84 @@
+import contextlib
 import hashlib
+import json
 import os
+import re
 import shutil
 import subprocess
+import time
 
+from tools.lock import fileLock
 
+
+def _isCommitHash(ref):
+	return re.fullmatch(r'[0-9a-f]{40}|[0-9a-f]{64}', ref) is not None
+
+
+def _recordUse(cacheRepository, refKey, url, ref):
+	# Last-use markers drive LRU eviction in tools.cache.
+	usageDir = os.path.join(cacheRepository, 'v8-packager')
+	os.makedirs(usageDir, exist_ok=True)
+	usageFile = os.path.join(usageDir, refKey + '.json')
+	stagingFile = '{}.{}.tmp'.format(usageFile, os.getpid())
+	with open(stagingFile, 'w') as file:
+		json.dump({'url': url, 'ref': ref, 'lastUsed': time.time()}, file)
+	os.replace(stagingFile, usageFile)
+
+
+def _hasRef(repository, ref):
+	if not os.path.isfile(os.path.join(repository, 'HEAD')):
+		return False
+	result = subprocess.run(
+		['git', 'rev-parse', '--verify', '--quiet', ref + '^{commit}'],
+		cwd=repository,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+	)
+	return result.returncode == 0
+
+
+@contextlib.contextmanager
 def _cachedSource(url, ref):
 	cacheRoot = os.environ.get('V8_PACKAGER_GIT_CACHE')
 	if not cacheRoot:
-		return url, ref
+		yield url, ref
+		return
 
 	repositoryKey = hashlib.sha256(url.encode('utf-8')).hexdigest()
 	refKey = hashlib.sha256(ref.encode('utf-8')).hexdigest()
 	cacheRepository = os.path.join(cacheRoot, repositoryKey + '.git')
 	cacheRef = 'refs/v8-packager/' + refKey
-	os.makedirs(cacheRepository, exist_ok=True)
-	if not os.path.isfile(os.path.join(cacheRepository, 'HEAD')):
+	# Readers hold a shared lock while fetching from the cache; updates of a
+	# cache repository are exclusive. Each repository has its own lock.
+	lockFile = cacheRepository + '.lock'
+
+	# Pinned commits never move, so a cached one is used without updating.
+	with fileLock(lockFile, shared=True):
+		if _isCommitHash(ref) and _hasRef(cacheRepository, cacheRef):
+			print('Cache hit {}@{} in {}'.format(url, ref, cacheRepository))
+			_recordUse(cacheRepository, refKey, url, ref)
+			yield cacheRepository, cacheRef
+			return
+
+	with fileLock(lockFile):
+		os.makedirs(cacheRepository, exist_ok=True)
+		if not os.path.isfile(os.path.join(cacheRepository, 'HEAD')):
+			subprocess.check_call([
+				'git', 'init', '--bare', '--quiet',
+				'--initial-branch=v8-packager'
+			], cwd=cacheRepository)
+
+		print('Cache {}@{} in {}'.format(url, ref, cacheRepository))
+		# Fetch straight into the cache ref instead of going through the
+		# shared FETCH_HEAD so the ref update is atomic.
 		subprocess.check_call([
-			'git', 'init', '--bare', '--quiet',
-			'--initial-branch=v8-packager'
+			'git', 'fetch', '--depth=1', '--force', '--no-tags',
+			'--no-write-fetch-head', url, '+{}:{}'.format(ref, cacheRef)
 		], cwd=cacheRepository)
 
-	print('Cache {}@{} in {}'.format(url, ref, cacheRepository))
-	subprocess.check_call([
-		'git', 'fetch', '--depth=1', '--force', '--no-tags', url, ref
-	], cwd=cacheRepository)
-	subprocess.check_call([
-		'git', 'update-ref', cacheRef, 'FETCH_HEAD'
-	], cwd=cacheRepository)
-	return cacheRepository, cacheRef
+	with fileLock(lockFile, shared=True):
+		_recordUse(cacheRepository, refKey, url, ref)
+		yield cacheRepository, cacheRef
 
 
 def fetch(url, target):
@@ -49,60 +100,168 @@ def fetch(url, target):
 		os.makedirs(target)
 
 	print('Fetch {}@{} into {}'.format(url, ref, target))
-	fetchUrl, fetchRef = _cachedSource(url, ref)
-
-	if not os.path.isdir(os.path.join(target, '.git')):
-		subprocess.check_call([
-			'git', 'init', '--quiet', '--initial-branch=v8-packager'
-		], cwd=target)
-	fetch_args = [
-		'git', 'fetch', '--depth=1', '--update-shallow', '--update-head-ok',
-		'--verbose', fetchUrl, fetchRef
-	]
-	if subprocess.call(fetch_args, cwd=target) != 0:
-		print('RETRY: {}'.format(target))
-		shutil.rmtree(target, ignore_errors=True)
-		subprocess.check_call([
-			'git', 'init', '--quiet', '--initial-branch=v8-packager'
-		], cwd=target)
-		subprocess.check_call(fetch_args, cwd=target)
+	with _cachedSource(url, ref) as (fetchUrl, fetchRef):
+		if not os.path.isdir(os.path.join(target, '.git')):
+			subprocess.check_call([
+				'git', 'init', '--quiet', '--initial-branch=v8-packager'
+			], cwd=target)
+		fetch_args = [
+			'git', 'fetch', '--depth=1', '--update-shallow', '--update-head-ok',
+			'--verbose', fetchUrl, fetchRef
+		]
+		if subprocess.call(fetch_args, cwd=target) != 0:
+			print('RETRY: {}'.format(target))
+			shutil.rmtree(target, ignore_errors=True)
+			os.makedirs(target)
+			subprocess.check_call([
+				'git', 'init', '--quiet', '--initial-branch=v8-packager'
+			], cwd=target)
+			subprocess.check_call(fetch_args, cwd=target)
 	subprocess.check_call(['git', 'checkout', '-f', '-B', 'Branch_'+ref, 'FETCH_HEAD'], cwd=target)
+	_clearPatchStamp(target)
+
+def _gitDir(target):
+	gitDir = os.path.join(target, '.git')
+	if os.path.isfile(gitDir):
+		with open(gitDir) as file:
+			content = file.read().strip()
+		if content.startswith('gitdir: '):
+			gitDir = os.path.join(target, content[len('gitdir: '):])
+	return gitDir
+
+
+def readHead(target):
+	"""Resolve HEAD from the repository files without running git."""
+	gitDir = _gitDir(target)
+	try:
+		with open(os.path.join(gitDir, 'HEAD')) as file:
+			head = file.read().strip()
+	except OSError:
+		return None
+	if not head.startswith('ref: '):
+		return head
+	ref = head[len('ref: '):]
+	refFile = os.path.join(gitDir, *ref.split('/'))
+	if os.path.isfile(refFile):
+		with open(refFile) as file:
+			return file.read().strip()
+	packedRefs = os.path.join(gitDir, 'packed-refs')
+	if os.path.isfile(packedRefs):
+		with open(packedRefs) as file:
+			for line in file:
+				if line and line[0] not in '#^' and line.rstrip().endswith(' ' + ref):
+					return line.split(' ', 1)[0]
+	return None
+
+
+def _patchStampFile(target):
+	return os.path.join(_gitDir(target), 'v8-packager-patches.json')
+
+
+def _readPatchStamp(target):
+	try:
+		with open(_patchStampFile(target)) as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+
+def _writePatchStamp(target, stamp):
+	with open(_patchStampFile(target), 'w') as file:
+		json.dump(stamp, file, indent=1)
+
 
-def applyPatch(patchFile, target):
-	check = subprocess.run(
-		['git', 'apply', '--ignore-space-change', '--check', patchFile],
+def getPatchStamp(target):
+	return _readPatchStamp(target)
+
+
+def _clearPatchStamp(target):
+	stampFile = _patchStampFile(target)
+	if os.path.isfile(stampFile):
+		os.remove(stampFile)
+
+
+def _runApply(args, patchFile, target):
+	return subprocess.run(
+		['git', 'apply', '--ignore-space-change', *args, patchFile],
 		cwd=target,
 		capture_output=True,
 		text=True,
 	)
-	if check.returncode == 0:
-		subprocess.check_call(
-			['git', 'apply', '--ignore-space-change', patchFile],
-			cwd=target,
+
+
+def computePatchStamp(patchFiles, target):
+	"""Stamp of target at HEAD with patchFiles applied in order."""
+	patches = []
+	for patchFile in patchFiles:
+		with open(patchFile, 'rb') as file:
+			patches.append([os.path.basename(patchFile), hashlib.sha256(file.read()).hexdigest()])
+	return {'head': readHead(target), 'patches': patches}
+
+
+def isPatched(patchFiles, target):
+	return _readPatchStamp(target) == computePatchStamp(patchFiles, target)
+
+
+def markPatched(patchFiles, target):
+	"""Record that exactly patchFiles are applied to target."""
+	_writePatchStamp(target, computePatchStamp(patchFiles, target))
+
+
+def applyPatches(patchFiles, target):
+	"""Apply patch files to target in order, as a single transaction.
+
+	A stamp of the applied patch hashes makes re-runs no-ops without running
+	git. If a patch fails, the patches applied by this call are rolled back.
+	Returns the patch files this call applied, in order; patches that were
+	already applied are not included.
+	"""
+	stamp = computePatchStamp(patchFiles, target)
+	if _readPatchStamp(target) == stamp:
+		print(f"Patches for '{target}' are up to date.")
+		return []
+	_clearPatchStamp(target)
+
+	# A single git apply checks all hunks before writing, so each patch
+	# applies completely or not at all. Checking a whole series in one git
+	# apply call is not reliable when several patches touch the same file.
+	applied = []
+	for patchFile in patchFiles:
+		result = _runApply([], patchFile, target)
+		if result.returncode == 0:
+			print(f"Patch '{patchFile}' applied successfully.")
+			applied.append(patchFile)
+			continue
+
+		if _runApply(['--reverse', '--check'], patchFile, target).returncode == 0:
+			print(f"Patch '{patchFile}' has already been applied.")
+			continue
+
+		if applied:
+			revertPatches(applied, target)
+		error = (result.stderr or result.stdout).strip()
+		raise RuntimeError(
+			f"Failed to apply patch '{patchFile}' in '{target}':"
+			+ (f"\n{error}" if error else " unknown git apply error")
 		)
-		print(f"Patch '{patchFile}' applied successfully.")
-		return
 
-	reverseCheck = subprocess.run(
-		[
-			'git', 'apply', '--ignore-space-change', '--reverse', '--check',
-			patchFile,
-		],
-		cwd=target,
-		capture_output=True,
-		text=True,
-	)
-	if reverseCheck.returncode == 0:
-		print(f"Patch '{patchFile}' has already been applied.")
-		return
+	_writePatchStamp(target, stamp)
+	return applied
+
+
+def revertPatches(patchFiles, target):
+	"""Reverse-apply patch files that were applied in the given order."""
+	_clearPatchStamp(target)
+	for patchFile in reversed(patchFiles):
+		result = _runApply(['--reverse'], patchFile, target)
+		if result.returncode != 0:
+			raise RuntimeError(
+				f"Failed to roll back patch '{patchFile}' in '{target}':\n"
+				+ (result.stderr or result.stdout).strip()
+			)
+	print(f"Rolled back {len(patchFiles)} patch(es) in '{target}'.")
 
-	error = (check.stderr or check.stdout).strip()
-	if not error:
-		error = (reverseCheck.stderr or reverseCheck.stdout).strip()
-	raise RuntimeError(
-		f"Failed to apply patch '{patchFile}' in '{target}':"
-		+ (f"\n{error}" if error else " unknown git apply error")
-	)
 
 def reset(target):
 	subprocess.check_call(['git', 'reset', '--hard', 'HEAD'], cwd=target)
+	_clearPatchStamp(target)
@@ -0,0 +1,455 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from tools.progress import formatDuration
+from tools.v8 import V8, getBuildName, getPathSize
+
+try:
+	import resource
+except ImportError:
+	# Not available on Windows; child resource usage is not recorded there.
+	resource = None
+
+HISTORY_FILE = os.path.join('.v8-packager', 'history.sqlite')
+# Next to the database; containers write their runs here instead of into SQLite.
+RECORD_DIR = 'history-records'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	started REAL NOT NULL,
+	seconds REAL NOT NULL,
+	success INTEGER NOT NULL,
+	command TEXT,
+	host TEXT,
+	cpus INTEGER,
+	memoryBytes INTEGER,
+	diskFreeBytes INTEGER,
+	loadAverage REAL,
+	childCpuSeconds REAL,
+	childPeakMemoryKiB INTEGER,
+	v8Version TEXT,
+	revision TEXT,
+	patches TEXT,
+	libraryType TEXT,
+	projectSettings TEXT
+);
+CREATE TABLE IF NOT EXISTS builds (
+	runId INTEGER NOT NULL REFERENCES runs(id),
+	name TEXT NOT NULL,
+	platform TEXT NOT NULL,
+	arch TEXT NOT NULL,
+	config TEXT NOT NULL,
+	seconds REAL NOT NULL,
+	cachedSteps INTEGER NOT NULL,
+	steps INTEGER NOT NULL,
+	edges INTEGER,
+	totalEdges INTEGER,
+	ninjaSeconds REAL,
+	artifactBytes INTEGER,
+	buildArgs TEXT,
+	cacheKey TEXT
+);
+CREATE TABLE IF NOT EXISTS steps (
+	runId INTEGER NOT NULL REFERENCES runs(id),
+	phase TEXT NOT NULL,
+	target TEXT NOT NULL,
+	seconds REAL NOT NULL,
+	cached INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buildsByName ON builds(name, runId);
+CREATE INDEX IF NOT EXISTS stepsByPhase ON steps(phase, target, runId);
+'''
+
+
+def parseThreshold(value: str) -> float:
+	try:
+		if value.endswith('%'):
+			return float(value[:-1]) / 100
+		return float(value)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"invalid threshold: {value!r}")
+
+
+def _getHostResources(root: str) -> dict:
+	host = {
+		'host': socket.gethostname(),
+		'cpus': os.cpu_count(),
+		'memoryBytes': None,
+		'diskFreeBytes': shutil.disk_usage(root).free,
+		'loadAverage': os.getloadavg()[0] if hasattr(os, 'getloadavg') else None,
+		'childCpuSeconds': None,
+		'childPeakMemoryKiB': None,
+	}
+	if hasattr(os, 'sysconf') and 'SC_PHYS_PAGES' in os.sysconf_names:
+		host['memoryBytes'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+	if resource is not None:
+		usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+		host['childCpuSeconds'] = usage.ru_utime + usage.ru_stime
+		host['childPeakMemoryKiB'] = usage.ru_maxrss
+	return host
+
+
+def collectRun(
+	v8: V8,
+	projectSettings: V8.ProjectSettings,
+	buildSettingsList: List[V8.BuildSettings],
+	distDir: str,
+	started: float,
+	success: bool,
+	command: str = None,
+) -> dict:
+	"""The run, the steps this process ran and the builds it packaged, as one JSON record."""
+	events = v8.journal.getEvents()
+	host = _getHostResources(distDir if os.path.isdir(distDir) else os.getcwd())
+	builds = []
+	for buildSettings in buildSettingsList:
+		name = getBuildName(buildSettings)
+		buildEvents = [event for event in events if event['name'].partition('/')[2] == name]
+		if not buildEvents:
+			# Skipped, e.g. a platform this host cannot build.
+			continue
+		ninja = v8.ninjaStats.get(name) or dict()
+		libDir = os.path.join(distDir, buildSettings.platform.value.lower(), buildSettings.arch.value.lower(), 'libs', buildSettings.config.value.lower())
+		builds.append({
+			'name': name,
+			'platform': buildSettings.platform.value,
+			'arch': buildSettings.arch.value,
+			'config': buildSettings.config.value,
+			'seconds': sum(event['seconds'] for event in buildEvents),
+			'cachedSteps': sum(1 for event in buildEvents if event['cached']),
+			'steps': len(buildEvents),
+			'edges': ninja.get('edges'),
+			'totalEdges': ninja.get('totalEdges'),
+			'ninjaSeconds': ninja.get('seconds'),
+			'artifactBytes': getPathSize(libDir) if os.path.isdir(libDir) else None,
+			'buildArgs': json.dumps(projectSettings.getBuildArgs(buildSettings), sort_keys=True),
+			'cacheKey': v8.getCacheKey(projectSettings, buildSettings.platform, buildSettings.arch, [buildSettings.config]),
+		})
+	return {
+		'run': {
+			'started': started,
+			'seconds': time.time() - started,
+			'success': int(success),
+			'command': command,
+			**host,
+			'v8Version': v8.version.toString(),
+			'revision': v8.getRevision(),
+			'patches': v8.getPatchFingerprint(),
+			'libraryType': projectSettings.libraryType.value,
+			'projectSettings': json.dumps(projectSettings.toJson(), sort_keys=True),
+		},
+		'steps': [
+			{
+				'phase': event['name'].partition('/')[0],
+				'target': event['name'].partition('/')[2],
+				'seconds': event['seconds'],
+				'cached': int(event['cached']),
+			}
+			for event in events
+		],
+		'builds': builds,
+	}
+
+
+def writeRecord(recordFile: str, record: dict):
+	"""Write a run for a later import, e.g. from a container into a mounted directory."""
+	os.makedirs(os.path.dirname(os.path.abspath(recordFile)), exist_ok=True)
+	stagingFile = recordFile + '.tmp'
+	with open(stagingFile, 'w', encoding='utf-8') as file:
+		json.dump(record, file, indent=1, sort_keys=True)
+	os.replace(stagingFile, recordFile)
+
+
+def getRecordDir(databaseFile: str) -> str:
+	"""Directory of run records waiting to be imported into databaseFile."""
+	return os.path.join(os.path.dirname(os.path.abspath(databaseFile)), RECORD_DIR)
+
+
+class BuildHistory:
+	"""SQLite record of packager runs, their builds and step timings.
+
+	Every run appends one row to runs, one row per configuration to builds and
+	one row per journal step, run or skipped, to steps. Containers do not open
+	the database; they write record files that are imported when it is opened
+	next, so SQLite never runs over a bind mount.
+	"""
+
+	def __init__(self, databaseFile: str):
+		os.makedirs(os.path.dirname(os.path.abspath(databaseFile)), exist_ok=True)
+		# Concurrent host runs may share a database; wait for their writes.
+		self._connection = sqlite3.connect(databaseFile, timeout=60)
+		self._connection.row_factory = sqlite3.Row
+		self._connection.executescript(_SCHEMA)
+		self.importRecords(getRecordDir(databaseFile))
+
+	def close(self):
+		self._connection.close()
+
+	def query(self, sql: str, parameters=()) -> List[sqlite3.Row]:
+		return self._connection.execute(sql, parameters).fetchall()
+
+	def insertRecord(self, record: dict) -> int:
+		"""Append a record of collectRun and return its run id."""
+		def insert(table: str, row: dict):
+			columns = sorted(row)
+			return self._connection.execute(
+				f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+				[row[column] for column in columns],
+			)
+
+		with self._connection:
+			runId = insert('runs', record['run']).lastrowid
+			for step in record['steps']:
+				insert('steps', {'runId': runId, **step})
+			for build in record['builds']:
+				insert('builds', {'runId': runId, **build})
+		return runId
+
+	def importRecords(self, recordDir: str) -> int:
+		"""Append the record files in recordDir and remove them; returns how many were imported."""
+		if not os.path.isdir(recordDir):
+			return 0
+		imported = 0
+		for name in sorted(os.listdir(recordDir)):
+			if not name.endswith('.json'):
+				continue
+			recordFile = os.path.join(recordDir, name)
+			try:
+				with open(recordFile, encoding='utf-8') as file:
+					record = json.load(file)
+			except (OSError, ValueError) as error:
+				print(f"Warning: Skipping the unreadable history record '{recordFile}': {error}")
+				continue
+			self.insertRecord(record)
+			os.remove(recordFile)
+			imported += 1
+		return imported
+
+	def recordRun(
+		self,
+		v8: V8,
+		projectSettings: V8.ProjectSettings,
+		buildSettingsList: List[V8.BuildSettings],
+		distDir: str,
+		started: float,
+		success: bool,
+		command: str = None,
+	) -> int:
+		"""Append the steps this process ran and the builds it packaged."""
+		return self.insertRecord(collectRun(v8, projectSettings, buildSettingsList, distDir, started, success, command))
+
+
+def _percentile(values: List[float], percent: float) -> float:
+	ordered = sorted(values)
+	position = (len(ordered) - 1) * percent / 100
+	lower = int(position)
+	upper = min(lower + 1, len(ordered) - 1)
+	return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _versionKey(version: str):
+	return tuple(int(part) if part.isdigit() else 0 for part in (version or '').split('.'))
+
+
+def _formatSeconds(seconds) -> str:
+	return '-' if seconds is None else formatDuration(seconds, precise=True)
+
+
+def _printTable(header: List[str], rows: List[List[str]]):
+	if not rows:
+		print('No matching builds in the history')
+		return
+	widths = [max(len(str(row[index])) for row in [header, *rows]) for index in range(len(header))]
+	for row in [header, *rows]:
+		print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def _buildFilter(args) -> tuple:
+	if args.build:
+		return ' AND builds.name LIKE ?', (args.build.lower().replace('*', '%'),)
+	return '', ()
+
+
+def showTrends(history: BuildHistory, args):
+	"""Median build time, ninja rate, cache hits and artifact size per V8 version."""
+	where, parameters = _buildFilter(args)
+	rows = history.query(
+		'SELECT runs.v8Version, builds.name, builds.seconds, builds.cachedSteps, builds.steps, builds.edges, '
+		'builds.ninjaSeconds, builds.artifactBytes FROM builds JOIN runs ON runs.id = builds.runId '
+		'WHERE runs.success = 1' + where,
+		parameters,
+	)
+	grouped: Dict[tuple, List[sqlite3.Row]] = dict()
+	for row in rows:
+		grouped.setdefault((row['v8Version'], row['name']), []).append(row)
+	table = []
+	for (version, name), builds in sorted(grouped.items(), key=lambda item: (item[0][1], _versionKey(item[0][0]))):
+		compiled = [build for build in builds if build['edges']]
+		rates = [build['edges'] / build['ninjaSeconds'] for build in compiled if build['ninjaSeconds']]
+		sizes = [build['artifactBytes'] for build in builds if build['artifactBytes']]
+		table.append([
+			name, version, len(builds),
+			_formatSeconds(statistics.median(build['seconds'] for build in builds)),
+			_formatSeconds(statistics.median(build['ninjaSeconds'] for build in compiled)) if compiled else '-',
+			f'{statistics.median(rates):.1f}' if rates else '-',
+			f'{sum(build["cachedSteps"] for build in builds) / max(1, sum(build["steps"] for build in builds)):.0%}',
+			f'{statistics.median(sizes) / (1024 * 1024):.1f} MiB' if sizes else '-',
+		])
+	_printTable(['build', 'version', 'runs', 'median', 'median compile', 'edges/s', 'cache hits', 'artifacts'], table)
+
+
+def showPercentiles(history: BuildHistory, args):
+	"""Percentile durations of each phase per configuration; cached steps are left out."""
+	parameters = []
+	where = ''
+	if args.build:
+		where += ' AND steps.target LIKE ?'
+		parameters.append(args.build.lower().replace('*', '%'))
+	if args.phase:
+		where += ' AND steps.phase = ?'
+		parameters.append(args.phase)
+	rows = history.query(
+		'SELECT steps.phase, steps.target, steps.seconds FROM steps JOIN runs ON runs.id = steps.runId '
+		'WHERE steps.cached = 0 AND runs.success = 1' + where,
+		parameters,
+	)
+	grouped: Dict[tuple, List[float]] = dict()
+	for row in rows:
+		grouped.setdefault((row['phase'], row['target']), []).append(row['seconds'])
+	table = [
+		[phase, target or '-', len(values), *[_formatSeconds(_percentile(values, percent)) for percent in (50, 90, 95)], _formatSeconds(max(values))]
+		for (phase, target), values in sorted(grouped.items())
+	]
+	_printTable(['phase', 'target', 'count', 'p50', 'p90', 'p95', 'max'], table)
+
+
+def findRegressions(history: BuildHistory, threshold: float, window: int, build: str = None) -> List[dict]:
+	"""Steps whose latest uncached duration exceeds the median of the previous window by threshold."""
+	parameters = []
+	where = ''
+	if build:
+		where = ' AND steps.target LIKE ?'
+		parameters.append(build.lower().replace('*', '%'))
+	rows = history.query(
+		'SELECT steps.runId, steps.phase, steps.target, steps.seconds, runs.v8Version, runs.started FROM steps '
+		'JOIN runs ON runs.id = steps.runId WHERE steps.cached = 0 AND runs.success = 1' + where + ' ORDER BY steps.runId',
+		parameters,
+	)
+	grouped: Dict[tuple, List[sqlite3.Row]] = dict()
+	for row in rows:
+		grouped.setdefault((row['phase'], row['target']), []).append(row)
+	regressions = []
+	for (phase, target), steps in sorted(grouped.items()):
+		if len(steps) < 2:
+			continue
+		latest = steps[-1]
+		baseline = statistics.median(step['seconds'] for step in steps[-window - 1:-1])
+		# Sub-second steps are dominated by noise.
+		if baseline >= 1.0 and latest['seconds'] > baseline * (1 + threshold):
+			regressions.append({
+				'phase': phase,
+				'target': target,
+				'seconds': latest['seconds'],
+				'baseline': baseline,
+				'change': latest['seconds'] / baseline - 1,
+				'v8Version': latest['v8Version'],
+				'runId': latest['runId'],
+			})
+	return regressions
+
+
+def showRegressions(history: BuildHistory, args) -> int:
+	regressions = findRegressions(history, args.threshold, args.window, args.build)
+	table = [
+		[
+			regression['phase'], regression['target'] or '-', regression['v8Version'], regression['runId'],
+			_formatSeconds(regression['baseline']), _formatSeconds(regression['seconds']), f'+{regression["change"]:.0%}',
+		]
+		for regression in regressions
+	]
+	if not table:
+		print(f'No step regressed by more than {args.threshold:.0%} against the median of its last {args.window} runs')
+		return 0
+	_printTable(['phase', 'target', 'version', 'run', 'baseline', 'latest', 'change'], table)
+	return 2
+
+
+def showCache(history: BuildHistory, args):
+	"""Share of steps skipped as up to date, per phase."""
+	where, parameters = '', ()
+	if args.build:
+		where, parameters = ' WHERE target LIKE ?', (args.build.lower().replace('*', '%'),)
+	rows = history.query(
+		'SELECT phase, COUNT(*) AS total, SUM(cached) AS hits FROM steps' + where + ' GROUP BY phase ORDER BY phase',
+		parameters,
+	)
+	table = [[row['phase'], row['total'], row['hits'], f'{row["hits"] / row["total"]:.0%}'] for row in rows]
+	total = sum(row['total'] for row in rows)
+	if total:
+		hits = sum(row['hits'] for row in rows)
+		table.append(['all', total, hits, f'{hits / total:.0%}'])
+	_printTable(['phase', 'steps', 'cached', 'hit rate'], table)
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Query the build history recorded by tools.run',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	argParser.add_argument('--database',
+		default=os.path.join(os.getcwd(), HISTORY_FILE),
+		help='History database')
+	argParser.add_argument('--build',
+		help="Only builds matching platform/arch/config, '*' matches anything, e.g. 'linux/*/release'")
+	subParsers = argParser.add_subparsers(dest='command')
+	subParsers.required = True
+	subParsers.add_parser('trends', help='Median build time, compile rate, cache hits and artifact size per V8 version')
+	percentilesParser = subParsers.add_parser('percentiles', help='p50/p90/p95 duration of each phase per configuration')
+	percentilesParser.add_argument('--phase', help='Only this phase, e.g. compile')
+	regressionsParser = subParsers.add_parser('regressions', help='Steps whose latest run is slower than their recent median')
+	regressionsParser.add_argument('--threshold',
+		type=parseThreshold,
+		default='10%',
+		help='Relative slowdown that counts as a regression')
+	regressionsParser.add_argument('--window',
+		type=int,
+		default=10,
+		help='Previous runs the latest run is compared with')
+	subParsers.add_parser('cache', help='Share of steps that were up to date, per phase')
+	args = argParser.parse_args()
+	if getattr(args, 'window', 1) < 1:
+		argParser.error('--window must be at least 1')
+	return args
+
+
+def main():
+	args = parseArgs()
+	if not os.path.isfile(args.database) and not os.path.isdir(getRecordDir(args.database)):
+		print(f"Error: No build history at '{args.database}'")
+		return 1
+	history = BuildHistory(args.database)
+	try:
+		if args.command == 'trends':
+			showTrends(history, args)
+		elif args.command == 'percentiles':
+			showPercentiles(history, args)
+		elif args.command == 'regressions':
+			return showRegressions(history, args)
+		elif args.command == 'cache':
+			showCache(history, args)
+	finally:
+		history.close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
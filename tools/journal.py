@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, List
+
+
+class Journal:
+	"""Persistent record of completed fetch and build steps in a workspace.
+
+	Each step is stored with a fingerprint of its inputs. A step is only
+	skipped when it completed with the same fingerprint, so a failed or
+	interrupted run resumes at the first stale or incomplete step.
+	"""
+
+	def __init__(self, root: str):
+		self._file = os.path.join(root, '.v8-packager', 'journal.json')
+		self._lock = threading.Lock()
+		self._steps = dict()
+		# Steps of this process in order, run or skipped.
+		self._events = []
+		if os.path.isfile(self._file):
+			try:
+				with open(self._file) as file:
+					self._steps = json.load(file).get('steps', dict())
+			except (OSError, ValueError):
+				self._steps = dict()
+
+	@staticmethod
+	def fingerprint(*inputs) -> str:
+		encoded = json.dumps(inputs, sort_keys=True, default=str)
+		return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+	def getFingerprint(self, name: str):
+		with self._lock:
+			return self._steps.get(name, dict()).get('fingerprint')
+
+	def getDuration(self, name: str):
+		with self._lock:
+			return self._steps.get(name, dict()).get('duration')
+
+	def getEvents(self) -> List[dict]:
+		with self._lock:
+			return list(self._events)
+
+	def isComplete(self, name: str, fingerprint: str) -> bool:
+		return self.getFingerprint(name) == fingerprint
+
+	def complete(self, name: str, fingerprint: str, duration: float = None):
+		with self._lock:
+			self._steps[name] = {
+				'fingerprint': fingerprint,
+				'completed': time.time(),
+				'duration': duration,
+			}
+			self._save()
+
+	def invalidate(self, prefix: str):
+		with self._lock:
+			names = [name for name in self._steps if name.startswith(prefix)]
+			for name in names:
+				del self._steps[name]
+			if names:
+				self._save()
+
+	def run(self, name: str, fingerprint: str, action: Callable, outputs: List[str] = None) -> bool:
+		"""Run action unless the step is complete and its outputs exist."""
+		if self.isComplete(name, fingerprint) and all(os.path.exists(output) for output in outputs or []):
+			print(f'Skipping {name}: up to date')
+			with self._lock:
+				self._events.append({'name': name, 'seconds': 0.0, 'cached': True})
+			return False
+		start = time.monotonic()
+		action()
+		duration = time.monotonic() - start
+		self.complete(name, fingerprint, duration)
+		with self._lock:
+			self._events.append({'name': name, 'seconds': duration, 'cached': False})
+		return True
+
+	def _save(self):
+		os.makedirs(os.path.dirname(self._file), exist_ok=True)
+		stagingFile = self._file + '.tmp'
+		with open(stagingFile, 'w') as file:
+			json.dump({'steps': self._steps}, file, indent=1, sort_keys=True)
+		os.replace(stagingFile, self._file)
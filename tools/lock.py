@@ -0,0 +1,50 @@
+import contextlib
+import os
+import time
+
+if os.name == 'nt':
+	import msvcrt
+else:
+	import fcntl
+
+
+def workspaceLockFile(root: str):
+	"""Lock file held by builds running in a workspace."""
+	return os.path.join(root, '.v8-packager', 'workspace.lock')
+
+
+@contextlib.contextmanager
+def fileLock(path: str, shared: bool = False, blocking: bool = True):
+	"""Hold an advisory lock on path while the context is active.
+
+	Shared locks allow concurrent readers and exclude writers. Windows has no
+	shared byte-range locks, so shared locks are exclusive there. Without
+	blocking, BlockingIOError is raised when the lock is held elsewhere.
+	"""
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	with open(path, 'a+') as file:
+		if os.name == 'nt':
+			file.seek(0)
+			while True:
+				try:
+					msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+					break
+				except OSError:
+					if not blocking:
+						raise BlockingIOError(f"Lock is held: {path}")
+					# LK_LOCK gives up after ten seconds; keep waiting.
+					time.sleep(1)
+			try:
+				yield
+			finally:
+				file.seek(0)
+				msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+		else:
+			operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+			if not blocking:
+				operation |= fcntl.LOCK_NB
+			fcntl.flock(file.fileno(), operation)
+			try:
+				yield
+			finally:
+				fcntl.flock(file.fileno(), fcntl.LOCK_UN)
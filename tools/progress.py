@@ -0,0 +1,141 @@
+import collections
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Callable, List
+
+from tools.types import EnvVars
+
+# Ninja prints this before every edge: finished/total edges and overall rate.
+# The rate is not numeric ('inf', '?') for the first edges.
+NINJA_STATUS = '[v8-packager %f/%t %o] '
+_STATUS_PATTERN = re.compile(r'^\[v8-packager (\d+)/(\d+) (\S+)\] ')
+
+
+def logDirectory(root: str):
+	return os.path.join(root, '.v8-packager', 'logs')
+
+
+def formatDuration(seconds: float, precise: bool = False):
+	"""Compact duration; precise keeps tenths of a second below a minute."""
+	if precise and seconds < 60:
+		return f'{seconds:.1f}s'
+	seconds = int(seconds)
+	if seconds >= 3600:
+		return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+	if seconds >= 60:
+		return f'{seconds // 60}m{seconds % 60:02d}s'
+	return f'{seconds}s'
+
+
+def runLogged(args: List[str], cwd: str, env: EnvVars, logFile: str, onLine: Callable[[str], bool] = None, tailLines: int = 200):
+	"""Run a command with its output in a gzip log; the tail is printed only on failure.
+
+	Lines for which onLine returns True are progress and are left out of the
+	printed tail. Returns the exit code.
+	"""
+	os.makedirs(os.path.dirname(logFile), exist_ok=True)
+	tail = collections.deque(maxlen=tailLines)
+	with gzip.open(logFile, 'wt', encoding='utf-8', errors='replace', compresslevel=6) as log:
+		log.write('$ ' + ' '.join(args) + '\n')
+		process = subprocess.Popen(
+			args,
+			cwd=cwd,
+			env=env,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT,
+			text=True,
+			errors='replace',
+		)
+		try:
+			for line in process.stdout:
+				log.write(line)
+				if not (onLine and onLine(line)):
+					tail.append(line)
+		finally:
+			returncode = process.wait()
+	if returncode != 0:
+		sys.stdout.write(''.join(tail))
+		print(f'Full output: {logFile}')
+	return returncode
+
+
+class NinjaProgress:
+	"""Compact ninja progress with an ETA from the rate of previous runs.
+
+	On a terminal the progress line is redrawn in place; otherwise it is
+	printed at most every interval seconds.
+	"""
+
+	def __init__(self, name: str, historyFile: str, interval: float = 30.0):
+		self._name = name
+		self._historyFile = historyFile
+		self._interval = interval
+		self._interactive = sys.stdout.isatty()
+		self._started = time.monotonic()
+		self._lastPrinted = 0.0
+		self._finished = 0
+		self._total = 0
+		self._history = dict()
+		if os.path.isfile(historyFile):
+			try:
+				with open(historyFile) as file:
+					self._history = json.load(file)
+			except (OSError, ValueError):
+				self._history = dict()
+
+	def _previousRate(self):
+		previous = self._history.get(self._name)
+		if previous and previous.get('seconds'):
+			return previous['edges'] / previous['seconds']
+		return None
+
+	def feed(self, line: str) -> bool:
+		"""Consume a line of ninja output; returns True for status lines."""
+		match = _STATUS_PATTERN.match(line)
+		if not match:
+			return False
+		self._finished, self._total = int(match.group(1)), int(match.group(2))
+		now = time.monotonic()
+		if now - self._lastPrinted >= (0.5 if self._interactive else self._interval) or self._finished == self._total:
+			self._lastPrinted = now
+			self._print(now - self._started)
+		return True
+
+	def _print(self, elapsed: float):
+		rate = self._finished / elapsed if elapsed > 0 else 0.0
+		# Early in a build the rate is dominated by startup; trust history.
+		previousRate = self._previousRate()
+		estimateRate = previousRate if previousRate and self._finished < 100 else rate
+		remaining = self._total - self._finished
+		eta = formatDuration(remaining / estimateRate) if estimateRate > 0 else '?'
+		percent = 100 * self._finished // self._total if self._total else 100
+		status = f'\t- {self._name}: {self._finished}/{self._total} ({percent}%) {rate:.1f} edges/s, ETA {eta}'
+		if self._interactive:
+			sys.stdout.write('\r' + status + '\x1b[K')
+		else:
+			sys.stdout.write(status + '\n')
+		sys.stdout.flush()
+
+	def getStats(self):
+		return {'edges': self._finished, 'totalEdges': self._total, 'seconds': time.monotonic() - self._started}
+
+	def finish(self, success: bool):
+		elapsed = time.monotonic() - self._started
+		if self._interactive and self._lastPrinted:
+			sys.stdout.write('\n')
+		if not success:
+			return
+		print(f'\t- {self._name}: {self._finished} edges in {formatDuration(elapsed)}')
+		# Only builds with real work say something about the rate.
+		if self._finished >= 100:
+			self._history[self._name] = {'edges': self._finished, 'seconds': elapsed}
+			os.makedirs(os.path.dirname(self._historyFile), exist_ok=True)
+			stagingFile = self._historyFile + '.tmp'
+			with open(stagingFile, 'w') as file:
+				json.dump(self._history, file, indent=1, sort_keys=True)
+			os.replace(stagingFile, self._historyFile)
@@ -1,10 +1,17 @@
 
 import os
 import argparse
+import shutil
 import sys
+import time
 from typing import List
 
-from tools.v8 import V8
+from tools.history import HISTORY_FILE, BuildHistory, collectRun, writeRecord
+from tools.lock import fileLock, workspaceLockFile
+import tools.shard as shard
+import tools.staticlib as staticlib
+from tools.v8 import V8, getBuildName
+from tools.watch import PatchWatcher
 from tools.types import PlatformType, ArchType, BuildConfig 
 
 if sys.version_info < (3, 6):
@@ -25,6 +32,16 @@ def parseArgs():
     argParser.add_argument('--archive',
                             action='store_true',
                             help='Archive V8')
+    argParser.add_argument('--provision',
+                            action='store_true',
+                            help='Fetch V8 and download only the toolchains of the target platforms')
+    argParser.add_argument('--dedupe',
+                            action='store_true',
+                            help='With --archive, store content shared by packages once in common.zip')
+    argParser.add_argument('--merge',
+                            nargs='+',
+                            metavar='SHARD_DIST',
+                            help='Merge the partial dist directories of all shards into --dist')
 
     # Fetch Args
     argParser.add_argument('--version',
@@ -55,8 +72,63 @@ def parseArgs():
         choices=[libraryType.value for libraryType in V8.LibraryType],
         default=V8.LibraryType.Static.value,
         help='Library output type')
+    argParser.add_argument('--pch',
+        action='store_true',
+        help='Package a prefix header for v8.h and libplatform.h and the flags to precompile it with, per configuration')
+    argParser.add_argument('--static-forms',
+        nargs='+',
+        choices=staticlib.FORMS,
+        default=[],
+        help='Extra forms of static libraries: a prelinked object, per-component archives and an indexed thin archive, which copies every object of the monolithic archive')
+    argParser.add_argument('--external-startup-data',
+        action='store_true',
+        help='Build with the snapshot in an external snapshot_blob.bin that processes can share by mapping it')
+    argParser.add_argument('--optimize-startup',
+        action='store_true',
+        help='Relink shared libraries with identical code folding, section GC and a symbol ordering file')
+    argParser.add_argument('--symbol-ordering-file',
+        help='Symbol ordering file for --optimize-startup; generated from a perf profile of a minimal embedder if omitted')
+    argParser.add_argument('--shard',
+        help='Build only shard i/N of the platform, arch and config matrix into a partial --dist')
+    argParser.add_argument('--shard-costs',
+        help='build-costs.json of an earlier merge, used to balance shards by build time')
+    argParser.add_argument('--dist',
+        default=os.path.join(os.getcwd(), 'dist'),
+        help='Output directory of packaged builds')
+    argParser.add_argument('--sysroot',
+        help='Sysroot for Linux Arm64 cross builds; defaults to the Debian sysroot pinned by V8')
+    argParser.add_argument('--history',
+        default=os.path.join(os.getcwd(), HISTORY_FILE),
+        help='SQLite database each build appends its timings, cache hits and sizes to; query it with tools.history')
+    argParser.add_argument('--no-history',
+        action='store_true',
+        help='Do not record this build in the history database')
+    argParser.add_argument('--history-record',
+        help='Write the history of this build to a JSON file instead of the database; the database imports it when opened next from the same directory')
+    argParser.add_argument('--watch',
+        action='store_true',
+        help='After the build, reapply changed patches and rebuild the selected configs incrementally until interrupted')
+    argParser.add_argument('--watch-interval',
+        type=float,
+        default=1.0,
+        help='Seconds between polls of the patch directory in --watch mode')
     
-    return argParser.parse_args()
+    args = argParser.parse_args()
+    if args.symbol_ordering_file and not args.optimize_startup:
+        argParser.error('--symbol-ordering-file requires --optimize-startup')
+    if args.symbol_ordering_file and not os.path.isfile(args.symbol_ordering_file):
+        argParser.error(f'--symbol-ordering-file {args.symbol_ordering_file} does not exist')
+    if args.watch_interval <= 0:
+        argParser.error('--watch-interval must be positive')
+    if args.watch and not args.build:
+        argParser.error('--watch requires --build')
+    if args.watch and (args.shard or args.merge or args.archive):
+        argParser.error('--watch rebuilds the local dist; it cannot be combined with --shard, --merge or --archive')
+    if args.shard and args.archive:
+        argParser.error('--archive packages complete builds; archive after --merge instead')
+    if args.shard and args.merge:
+        argParser.error('--shard and --merge run on different machines')
+    return args
 
 
 def getBuildSettingsFromArgs(args) -> List[V8.BuildSettings]:
@@ -70,17 +142,39 @@ def getBuildSettingsFromArgs(args) -> List[V8.BuildSettings]:
 
     return buildSettingsList
 
+def recordHistory(databaseFile: str, recordFile: str, v8: V8, projectSettings: V8.ProjectSettings, buildSettingsList: List[V8.BuildSettings], buildDir: str, started: float, success: bool):
+    # A history failure must not fail or hide the outcome of the build.
+    try:
+        record = collectRun(v8, projectSettings, buildSettingsList, buildDir, started, success, ' '.join(sys.argv[1:]))
+        if recordFile:
+            writeRecord(recordFile, record)
+            return
+        history = BuildHistory(databaseFile)
+        try:
+            history.insertRecord(record)
+        finally:
+            history.close()
+    except Exception as error:
+        print(f"Warning: Unable to record the build in '{recordFile or databaseFile}': {error}")
+
 # =============== Main ======================
 
 def main():
-    buildDir = os.path.join(os.getcwd(), 'dist')
     archiveDir = os.path.join(os.getcwd(), 'archive')
 
     args = parseArgs()
-    if not args.fetch and not args.reset and not args.build and not args.archive:
+    buildDir = os.path.abspath(args.dist)
+    archivedPackages = set()
+    if not args.fetch and not args.reset and not args.build and not args.archive and not args.provision and not args.merge:
         print("Error: Expected to have an action to run.")
         return 1
 
+    if args.provision:
+        version = V8.Version.fromString(args.version)
+        v8 = V8.initializeRepository(version)
+        requestedPlatforms = [PlatformType[platform] for platform in args.PLATFORMS]
+        v8.fetchBinaryDependencies(requestedPlatforms)
+        v8.provisionToolchains(requestedPlatforms)
     if args.fetch:
         version = V8.Version.fromString(args.version)
         v8 = V8.initializeRepository(version)
@@ -93,6 +187,8 @@ def main():
         v8.resetRepository()
         requestedPlatforms = [PlatformType[platform] for platform in args.PLATFORMS]
         v8.fetchBinaryDependencies(requestedPlatforms)
+        # Completed dependency fetches are skipped through the step journal.
+        v8.fetchProjectDependencies(requestedPlatforms)
         v8.applyPatches()
     if args.build:
         buildSettingsList = getBuildSettingsFromArgs(args)
@@ -101,18 +197,60 @@ def main():
             return 1
 
         v8 = V8(os.getcwd())
+        if args.shard:
+            shardIndex, shardCount = shard.parseShard(args.shard)
+            estimates = shard.estimateCosts(buildSettingsList, shard.readCosts(args.shard_costs))
+            buildSettingsList = shard.assignShards(buildSettingsList, estimates, shardCount)[shardIndex - 1]
+            print(f"Shard {shardIndex}/{shardCount}: {', '.join(getBuildName(buildSettings) for buildSettings in buildSettingsList) or 'nothing to build'}")
+            # A partial dist only holds this shard's builds.
+            shutil.rmtree(buildDir, ignore_errors=True)
         libraryType = V8.LibraryType(args.library_type)
-        v8.build(buildDir, V8.ProjectSettings(libraryType), buildSettingsList)
+        projectSettings = V8.ProjectSettings(libraryType)
+        projectSettings.precompiledHeaders = args.pch
+        projectSettings.staticForms = args.static_forms
+        projectSettings.externalStartupData = args.external_startup_data
+        projectSettings.startupOptimization = args.optimize_startup
+        projectSettings.symbolOrderingFile = os.path.abspath(args.symbol_ordering_file) if args.symbol_ordering_file else None
+        projectSettings.linuxSysroot = os.path.abspath(args.sysroot) if args.sysroot else None
+        watcher = None
+        if args.watch:
+            # Patches edited since the last run are reapplied before the first build.
+            watcher = PatchWatcher(v8, os.getcwd())
+            watcher.start()
+        started = time.time()
+        success = False
+        try:
+            # With --archive, packages are archived while the next config compiles.
+            archivedPackages = v8.build(
+                buildDir,
+                projectSettings,
+                buildSettingsList,
+                # Deduplication needs every package, so it archives after the build.
+                archiveDir=archiveDir if args.archive and not args.dedupe else None,
+            )
+            success = True
+        finally:
+            if not args.no_history:
+                recordHistory(args.history, args.history_record, v8, projectSettings, buildSettingsList, buildDir, started, success)
+        if args.shard:
+            shard.writeManifest(v8, buildDir, (shardIndex, shardCount), projectSettings, buildSettingsList)
+        if watcher:
+            watcher.watch(buildDir, projectSettings, buildSettingsList, args.watch_interval)
+    if args.merge:
+        v8 = V8(os.getcwd())
+        shard.mergeShards(v8, [os.path.abspath(shardDir) for shardDir in args.merge], buildDir)
     if args.archive:
         v8 = V8(os.getcwd())
-        v8.archive(archiveDir, buildDir)
+        v8.archive(archiveDir, buildDir, exclude=archivedPackages, deduplicate=args.dedupe)
 
     return 0
 
 
 if __name__ == '__main__':
     try:
-        sys.exit(main())
+        # Keeps cache maintenance from evicting this workspace mid-build.
+        with fileLock(workspaceLockFile(os.getcwd()), shared=True):
+            sys.exit(main())
     except RuntimeError as error:
         print(f"Error: {error}")
         sys.exit(1)
@@ -0,0 +1,498 @@
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import tools.git as git
+from tools.types import ArchType, BuildConfig, PlatformType
+from tools.v8 import V8
+from tools.watch import PatchWatcher
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = ['default', 'external-startup-data']
+# Job and artifact ids are truncated sha256 digests.
+ID_PATTERN = re.compile(r'[0-9a-f]{24}')
+
+
+def _getPatchFingerprint(patchDir: str, version: str) -> str:
+	"""Digest of the patch files that apply to a V8 version, by path and content."""
+	major, minor = version.split('.')[:2]
+	digest = hashlib.sha256()
+	for versionDir in (major, f'{major}.{minor}'):
+		for root, _, names in sorted(os.walk(os.path.join(patchDir, versionDir))):
+			for name in sorted(names):
+				path = os.path.join(root, name)
+				digest.update(os.path.relpath(path, patchDir).replace(os.sep, '/').encode('utf-8') + b'\0')
+				with open(path, 'rb') as file:
+					digest.update(hashlib.sha256(file.read()).digest())
+	return digest.hexdigest()
+
+
+class BuildRequest:
+	"""One package request: a single V8 version, platform, arch, config and library type."""
+
+	def __init__(self, version: str, platform: str, arch: str, config: str, libraryType: str, variant: str):
+		self.version = version
+		self.platform = platform
+		self.arch = arch
+		self.config = config
+		self.libraryType = libraryType
+		self.variant = variant
+
+	@staticmethod
+	def fromJson(data: dict) -> 'BuildRequest':
+		def _choice(name: str, choices, default=None):
+			value = data.get(name, default)
+			for choice in choices:
+				if isinstance(value, str) and value.lower() == choice.lower():
+					return choice
+			raise ValueError(f"'{name}' must be one of {', '.join(choices)}")
+
+		version = data.get('version')
+		if not isinstance(version, str) or not re.fullmatch(r'\d+\.\d+(\.\d+){0,2}', version):
+			raise ValueError("'version' must look like '13.6'")
+		return BuildRequest(
+			version,
+			_choice('platform', [platform.value for platform in PlatformType]),
+			_choice('arch', [arch.value for arch in ArchType]),
+			_choice('config', [config.value for config in BuildConfig], BuildConfig.Release.value),
+			_choice('libraryType', [libraryType.value for libraryType in V8.LibraryType], V8.LibraryType.Static.value),
+			_choice('variant', VARIANTS, VARIANTS[0]),
+		)
+
+	def toJson(self) -> dict:
+		return {
+			'version': self.version,
+			'platform': self.platform,
+			'arch': self.arch,
+			'config': self.config,
+			'libraryType': self.libraryType,
+			'variant': self.variant,
+		}
+
+	@property
+	def key(self) -> str:
+		"""Job id; identical requests share it whatever revision they build."""
+		encoded = json.dumps(self.toJson(), sort_keys=True)
+		return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:24]
+
+	def getArtifactKey(self, revision: str, patchFingerprint: str) -> str:
+		"""Artifact id of this request built from a V8 revision with a set of patches."""
+		encoded = json.dumps({'request': self.toJson(), 'revision': revision, 'patches': patchFingerprint}, sort_keys=True)
+		return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:24]
+
+	@property
+	def packageName(self) -> str:
+		return f'{self.platform}-{self.arch}'.lower()
+
+
+class Job:
+	def __init__(self, request: BuildRequest, priority: int, refresh: bool = False):
+		self.request = request
+		self.priority = priority
+		self.refresh = refresh
+		self.state = 'queued'
+		self.submitted = time.time()
+		self.started = None
+		self.finished = None
+		self.error = None
+		self.requests = 1
+		self.artifact = None
+		self.cached = False
+
+	def toJson(self) -> dict:
+		return {
+			'id': self.request.key,
+			'request': self.request.toJson(),
+			'priority': self.priority,
+			'state': self.state,
+			'submitted': self.submitted,
+			'started': self.started,
+			'finished': self.finished,
+			'error': self.error,
+			'requests': self.requests,
+			'artifact': self.artifact,
+			'cached': self.cached,
+		}
+
+
+class ArtifactStore:
+	"""Finished packages, stored by artifact key as <root>/<key>/package.zip."""
+
+	def __init__(self, root: str):
+		self.root = os.path.abspath(root)
+		os.makedirs(self.root, exist_ok=True)
+
+	def packageFile(self, key: str) -> str:
+		return os.path.join(self.root, key, 'package.zip')
+
+	def has(self, key: str) -> bool:
+		return os.path.isfile(self.packageFile(key))
+
+	def metadata(self, key: str):
+		metadataFile = os.path.join(self.root, key, 'artifact.json')
+		if not os.path.isfile(metadataFile):
+			return None
+		with open(metadataFile) as file:
+			return json.load(file)
+
+	def publish(self, key: str, archiveFile: str, metadata: dict):
+		staging = os.path.join(self.root, key + '.partial')
+		shutil.rmtree(staging, ignore_errors=True)
+		os.makedirs(staging)
+		shutil.copy2(archiveFile, os.path.join(staging, 'package.zip'))
+		if os.path.isfile(archiveFile + '.sha256'):
+			shutil.copy2(archiveFile + '.sha256', os.path.join(staging, 'package.zip.sha256'))
+		with open(os.path.join(staging, 'artifact.json'), 'w') as file:
+			json.dump(metadata, file, indent=2, sort_keys=True)
+		target = os.path.join(self.root, key)
+		shutil.rmtree(target, ignore_errors=True)
+		os.replace(staging, target)
+
+
+class BuildService:
+	"""Priority queue of build requests executed by tools.run in per-version workspaces.
+
+	Identical requests share one job while it is queued or running. A
+	package is stored under the request, the V8 revision and the patches it
+	was built from, so it is only served while the workspace still has that
+	revision and the patch files are unchanged. Workspaces keep their checkout
+	and out.gn between jobs: changed patches are reapplied in place and the
+	checkout only moves to the latest lkgr when a request asks to refresh.
+	"""
+
+	def __init__(self, workspaceRoot: str, store: ArtifactStore, workers: int = 1):
+		self._workspaceRoot = os.path.abspath(workspaceRoot)
+		self._store = store
+		self._logDir = os.path.join(store.root, 'logs')
+		self._lock = threading.Condition()
+		self._queue = []
+		self._sequence = itertools.count()
+		self._jobs = dict()
+		self._workspaceLocks = dict()
+		self._metrics = {
+			'submitted': 0,
+			'deduplicated': 0,
+			'cacheHits': 0,
+			'completed': 0,
+			'failed': 0,
+			'buildSeconds': 0.0,
+			'lastBuildSeconds': None,
+		}
+		os.makedirs(self._logDir, exist_ok=True)
+		for _ in range(max(workers, 1)):
+			threading.Thread(target=self._work, daemon=True).start()
+
+	def submit(self, request: BuildRequest, priority: int = 0, refresh: bool = False):
+		"""Returns (job json, True when a new job was queued)."""
+		key = request.key
+		# Refreshing may move the checkout, so its package is not known yet.
+		artifactKey = None if refresh else self._getArtifactKey(request)
+		with self._lock:
+			self._metrics['submitted'] += 1
+			job = self._jobs.get(key)
+			if job is not None and job.state in ('queued', 'running'):
+				self._metrics['deduplicated'] += 1
+				job.requests += 1
+				if job.state == 'queued':
+					job.refresh = job.refresh or refresh
+					if priority > job.priority:
+						job.priority = priority
+						heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+				return job.toJson(), False
+			if artifactKey is not None and self._store.has(artifactKey):
+				self._metrics['cacheHits'] += 1
+				job = Job(request, priority)
+				job.state = 'done'
+				job.finished = job.submitted
+				job.artifact = artifactKey
+				job.cached = True
+				self._jobs[key] = job
+				return job.toJson(), False
+			job = Job(request, priority, refresh)
+			self._jobs[key] = job
+			heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+			self._lock.notify()
+			return job.toJson(), True
+
+	def status(self, key: str):
+		"""Latest job of a job id, or the metadata of an artifact id."""
+		with self._lock:
+			job = self._jobs.get(key)
+			if job is not None:
+				return job.toJson()
+		if self._store.has(key):
+			return self._storedJson(key)
+		return None
+
+	def jobs(self):
+		with self._lock:
+			return [job.toJson() for job in sorted(self._jobs.values(), key=lambda job: job.submitted)]
+
+	def metrics(self):
+		with self._lock:
+			metrics = dict(self._metrics)
+			metrics['queueDepth'] = sum(1 for job in self._jobs.values() if job.state == 'queued')
+			metrics['running'] = sum(1 for job in self._jobs.values() if job.state == 'running')
+			builds = metrics['completed'] + metrics['failed']
+			metrics['averageBuildSeconds'] = metrics['buildSeconds'] / builds if builds else None
+			return metrics
+
+	def packageFile(self, key: str):
+		"""Package of an artifact id, or of the finished job with that id."""
+		with self._lock:
+			job = self._jobs.get(key)
+			if job is not None and job.artifact:
+				key = job.artifact
+		return self._store.packageFile(key) if self._store.has(key) else None
+
+	def logFile(self, key: str):
+		logFile = os.path.join(self._logDir, key + '.log')
+		return logFile if os.path.isfile(logFile) else None
+
+	def _storedJson(self, key: str):
+		metadata = self._store.metadata(key) or dict()
+		return {
+			'id': key,
+			'request': metadata.get('request'),
+			'state': 'done',
+			'finished': metadata.get('finished'),
+			'revision': metadata.get('revision'),
+			'cacheKey': metadata.get('cacheKey'),
+			'artifact': key,
+			'cached': True,
+		}
+
+	def _next(self) -> Job:
+		with self._lock:
+			while True:
+				while self._queue:
+					negativePriority, _, job = heapq.heappop(self._queue)
+					# Raised priorities leave stale entries behind; skip them.
+					if job.state == 'queued' and -negativePriority == job.priority:
+						job.state = 'running'
+						job.started = time.time()
+						return job
+				self._lock.wait()
+
+	def _work(self):
+		while True:
+			job = self._next()
+			try:
+				artifactKey, cacheKey = self._build(job.request, job.refresh)
+				state, error = 'done', None
+			except Exception as exception:
+				artifactKey, cacheKey, state, error = None, None, 'failed', str(exception)
+			with self._lock:
+				job.state = state
+				job.artifact = artifactKey
+				job.error = error
+				job.finished = time.time()
+				duration = job.finished - job.started
+				self._metrics['completed' if state == 'done' else 'failed'] += 1
+				self._metrics['buildSeconds'] += duration
+				self._metrics['lastBuildSeconds'] = duration
+			print(f"{job.request.key} {state} in {duration:.0f}s{': ' + error if error else ''}")
+			if cacheKey:
+				print(f'\t- cache key {cacheKey}')
+
+	def _workspaceLock(self, workspace: str):
+		with self._lock:
+			return self._workspaceLocks.setdefault(workspace, threading.Lock())
+
+	def _getWorkspace(self, request: BuildRequest) -> str:
+		return os.path.join(self._workspaceRoot, f'workspace-{request.version}')
+
+	def _getArtifactKey(self, request: BuildRequest):
+		"""Artifact key a job would produce now, or None before the workspace is fetched."""
+		revision = git.readHead(os.path.join(self._getWorkspace(request), 'v8'))
+		if revision is None:
+			return None
+		return request.getArtifactKey(revision, _getPatchFingerprint(os.path.join(REPOSITORY_DIR, 'patches'), request.version))
+
+	def _build(self, request: BuildRequest, refresh: bool):
+		workspace = self._getWorkspace(request)
+		with self._workspaceLock(workspace):
+			os.makedirs(workspace, exist_ok=True)
+			# Patches are read from the workspace; refresh them for every job.
+			patchDir = os.path.join(workspace, 'patches')
+			shutil.rmtree(patchDir, ignore_errors=True)
+			shutil.copytree(os.path.join(REPOSITORY_DIR, 'patches'), patchDir)
+			# dist and archive only hold the package of this request.
+			for outputDir in ('dist', 'archive'):
+				shutil.rmtree(os.path.join(workspace, outputDir), ignore_errors=True)
+
+			command = [sys.executable, '-m', 'tools.run']
+			fetch = refresh or not os.path.isdir(os.path.join(workspace, 'v8', '.git'))
+			if not fetch:
+				# Reapply only the changed patches so ninja rebuilds incrementally.
+				try:
+					PatchWatcher(V8(workspace), workspace).start()
+				except RuntimeError as error:
+					print(f"{request.key}: {error}\n\t- checking out the latest lkgr again")
+					fetch = True
+			if fetch:
+				# Fetching an existing checkout moves it to the latest lkgr and
+				# discards local edits, but keeps out.gn.
+				command.extend(['--fetch', '--version', request.version])
+			command.extend([
+				'--build',
+				'--archive',
+				'--platform', request.platform,
+				'--arch', request.arch,
+				'--config', request.config,
+				'--library-type', request.libraryType,
+			])
+			if request.variant == 'external-startup-data':
+				command.append('--external-startup-data')
+			env = os.environ.copy()
+			env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPOSITORY_DIR, env.get('PYTHONPATH')]))
+			logFile = os.path.join(self._logDir, request.key + '.log')
+			with open(logFile, 'w') as log:
+				result = subprocess.run(command, cwd=workspace, env=env, stdout=log, stderr=subprocess.STDOUT)
+			if result.returncode != 0:
+				raise RuntimeError(f"build failed with exit code {result.returncode}, see {logFile}")
+
+			archiveFile = os.path.join(workspace, 'archive', request.packageName + '.zip')
+			if not os.path.isfile(archiveFile):
+				raise RuntimeError(f"expected package '{archiveFile}' was not produced")
+			cacheKey = None
+			infoFile = os.path.join(workspace, 'dist', request.platform.lower(), request.arch.lower(), 'info.json')
+			if os.path.isfile(infoFile):
+				with open(infoFile) as file:
+					cacheKey = json.load(file).get('cacheKey')
+			revision = git.readHead(os.path.join(workspace, 'v8'))
+			artifactKey = request.getArtifactKey(revision, _getPatchFingerprint(patchDir, request.version))
+			self._store.publish(artifactKey, archiveFile, {
+				'request': request.toJson(),
+				'finished': time.time(),
+				'revision': revision,
+				'cacheKey': cacheKey,
+			})
+			return artifactKey, cacheKey
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+def _makeHandler(service: BuildService):
+	class Handler(BaseHTTPRequestHandler):
+		def _sendJson(self, status: int, data):
+			body = json.dumps(data, indent=2).encode('utf-8')
+			self.send_response(status)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def _sendFile(self, path: str, contentType: str):
+			self.send_response(200)
+			self.send_header('Content-Type', contentType)
+			self.send_header('Content-Length', str(os.path.getsize(path)))
+			self.end_headers()
+			with open(path, 'rb') as file:
+				shutil.copyfileobj(file, self.wfile)
+
+		def do_GET(self):
+			parts = [part for part in self.path.split('?')[0].split('/') if part]
+			if parts == ['metrics']:
+				return self._sendJson(200, service.metrics())
+			if parts == ['builds']:
+				return self._sendJson(200, service.jobs())
+			if len(parts) in (2, 3) and parts[0] in ('builds', 'artifacts') and not ID_PATTERN.fullmatch(parts[1]):
+				return self._sendJson(404, {'error': 'invalid id'})
+			if len(parts) == 2 and parts[0] == 'builds':
+				status = service.status(parts[1])
+				if status is None:
+					return self._sendJson(404, {'error': 'unknown build'})
+				return self._sendJson(200, status)
+			if len(parts) == 3 and parts[0] == 'builds' and parts[2] == 'log':
+				logFile = service.logFile(parts[1])
+				if logFile is None:
+					return self._sendJson(404, {'error': 'no log for build'})
+				return self._sendFile(logFile, 'text/plain; charset=utf-8')
+			if len(parts) == 2 and parts[0] == 'artifacts':
+				packageFile = service.packageFile(parts[1])
+				if packageFile is None:
+					return self._sendJson(404, {'error': 'package is not available'})
+				return self._sendFile(packageFile, 'application/zip')
+			self._sendJson(404, {'error': 'not found'})
+
+		def do_POST(self):
+			if self.path.split('?')[0].rstrip('/') != '/builds':
+				return self._sendJson(404, {'error': 'not found'})
+			try:
+				length = int(self.headers.get('Content-Length', 0))
+				data = json.loads(self.rfile.read(length) or b'{}')
+				if not isinstance(data, dict):
+					raise ValueError('expected a JSON object')
+				priority = data.get('priority', 0)
+				if not isinstance(priority, int) or isinstance(priority, bool):
+					raise ValueError("'priority' must be an integer")
+				refresh = data.get('refresh', False)
+				if not isinstance(refresh, bool):
+					raise ValueError("'refresh' must be true or false")
+				request = BuildRequest.fromJson(data)
+			except ValueError as error:
+				return self._sendJson(400, {'error': str(error)})
+			job, queued = service.submit(request, priority, refresh)
+			self._sendJson(202 if queued or job['state'] != 'done' else 200, job)
+
+		def log_message(self, format, *args):
+			pass
+
+	return Handler
+
+
+def parseArgs():
+	argParser = argparse.ArgumentParser(
+		description='Local V8 packager build service',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	argParser.add_argument('--host',
+		default='127.0.0.1',
+		help='Address to listen on')
+	argParser.add_argument('--port',
+		type=int,
+		default=8420,
+		help='Port to listen on')
+	argParser.add_argument('--workspace-root',
+		default=os.path.join('.service', 'workspaces'),
+		help='Directory holding one build workspace per V8 version')
+	argParser.add_argument('--store',
+		default=os.path.join('.service', 'artifacts'),
+		help='Artifact store for finished packages')
+	argParser.add_argument('--workers',
+		type=int,
+		default=1,
+		help='Builds to run concurrently; builds of the same V8 version always run one at a time')
+	return argParser.parse_args()
+
+
+def main():
+	args = parseArgs()
+	service = BuildService(args.workspace_root, ArtifactStore(args.store), args.workers)
+	server = _Server((args.host, args.port), _makeHandler(service))
+	print(f'Listening on http://{args.host}:{server.server_address[1]}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,197 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import statistics
+from typing import Dict, List, Tuple
+
+from tools.types import ArchType, BuildConfig, PlatformType
+from tools.v8 import V8, getBuildName
+
+COSTS_FILE = 'build-costs.json'
+# Relative cost of configurations without recorded timings.
+_DEFAULT_CONFIG_COST = {BuildConfig.Debug: 1.25, BuildConfig.Release: 1.0}
+
+
+def parseShard(value: str) -> Tuple[int, int]:
+	"""Parses 'i/N' with 1 <= i <= N."""
+	try:
+		index, count = (int(part) for part in value.split('/'))
+	except ValueError:
+		raise RuntimeError(f"Expected --shard as i/N, got '{value}'")
+	if count < 1 or not 1 <= index <= count:
+		raise RuntimeError(f"Shard {value} is out of range")
+	return index, count
+
+
+def readCosts(costsFile: str) -> Dict[str, float]:
+	if not costsFile:
+		return dict()
+	if not os.path.isfile(costsFile):
+		raise RuntimeError(f"Build cost file '{costsFile}' does not exist")
+	with open(costsFile) as file:
+		return json.load(file)
+
+
+def estimateCosts(buildSettingsList: List[V8.BuildSettings], costs: Dict[str, float]) -> Dict[str, float]:
+	"""Seconds per build from earlier timings; unknown builds are scaled from the known ones.
+
+	Every shard must compute the same estimates, so only the shared cost file
+	is used and never the timings of the local workspace.
+	"""
+	scale = statistics.median(costs.values()) if costs else 1.0
+	estimates = dict()
+	for buildSettings in buildSettingsList:
+		name = getBuildName(buildSettings)
+		estimates[name] = costs.get(name, scale * _DEFAULT_CONFIG_COST.get(buildSettings.config, 1.0))
+	return estimates
+
+
+def assignShards(buildSettingsList: List[V8.BuildSettings], estimates: Dict[str, float], count: int) -> List[List[V8.BuildSettings]]:
+	"""Longest processing time first: each build goes to the least loaded shard."""
+	shards = [[] for _ in range(count)]
+	loads = [0.0] * count
+	ordered = sorted(buildSettingsList, key=lambda buildSettings: (-estimates[getBuildName(buildSettings)], getBuildName(buildSettings)))
+	for buildSettings in ordered:
+		shard = min(range(count), key=lambda index: (loads[index], index))
+		shards[shard].append(buildSettings)
+		loads[shard] += estimates[getBuildName(buildSettings)]
+	# Keep the configured build order within a shard.
+	position = {getBuildName(buildSettings): index for index, buildSettings in enumerate(buildSettingsList)}
+	return [sorted(shard, key=lambda buildSettings: position[getBuildName(buildSettings)]) for shard in shards]
+
+
+def _hashFile(path: str) -> str:
+	digest = hashlib.sha256()
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(1024 * 1024), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _listFiles(distDir: str) -> Dict[str, str]:
+	files = dict()
+	for root, dirs, names in os.walk(distDir):
+		dirs.sort()
+		for name in sorted(names):
+			path = os.path.join(root, name)
+			relativePath = os.path.relpath(path, distDir).replace(os.sep, '/')
+			if '/' in relativePath:
+				files[relativePath] = _hashFile(path)
+	return files
+
+
+def _getPortableSettings(projectSettings: dict) -> dict:
+	"""Project settings without host paths; a symbol ordering file is compared by hash."""
+	return {key: value for key, value in projectSettings.items() if key not in ('linuxSysroot', 'symbolOrderingFile')}
+
+
+def writeManifest(v8: V8, distDir: str, shard: Tuple[int, int], projectSettings: V8.ProjectSettings, buildSettingsList: List[V8.BuildSettings]):
+	"""Describe the partial dist of one shard for mergeShards."""
+	index, count = shard
+	os.makedirs(distDir, exist_ok=True)
+	builds = []
+	for buildSettings in buildSettingsList:
+		name = getBuildName(buildSettings)
+		libDir = os.path.join(distDir, buildSettings.platform.value.lower(), buildSettings.arch.value.lower(), 'libs', buildSettings.config.value.lower())
+		if not os.path.isdir(libDir):
+			# Skipped, e.g. a platform this host cannot build.
+			continue
+		builds.append({
+			'platform': buildSettings.platform.value,
+			'arch': buildSettings.arch.value,
+			'config': buildSettings.config.value,
+			'seconds': v8.journal.getDuration('compile/' + name),
+		})
+	manifest = {
+		'shard': index,
+		'count': count,
+		'v8Version': v8.version.toString(),
+		'revision': v8.getRevision(),
+		'patches': v8.getPatchFingerprint(),
+		'projectSettings': projectSettings.toJson(),
+		'requested': [getBuildName(buildSettings) for buildSettings in buildSettingsList],
+		'builds': builds,
+		'files': _listFiles(distDir),
+	}
+	manifestFile = os.path.join(distDir, f'shard-{index}-of-{count}.json')
+	with open(manifestFile, 'w') as file:
+		json.dump(manifest, file, indent=1, sort_keys=True)
+	print(f"Wrote shard manifest '{manifestFile}' for {len(builds)} build(s)")
+
+
+def mergeShards(v8: V8, shardDirs: List[str], distDir: str):
+	"""Combine the partial dists of all shards into distDir.
+
+	Shared files such as headers must be identical across shards. Package
+	info is regenerated for the combined configurations.
+	"""
+	manifests = []
+	for shardDir in shardDirs:
+		for manifestFile in sorted(glob.glob(os.path.join(shardDir, 'shard-*-of-*.json'))):
+			with open(manifestFile) as file:
+				manifests.append((shardDir, json.load(file)))
+	if not manifests:
+		raise RuntimeError("No shard manifests were found")
+
+	first = manifests[0][1]
+	count = first['count']
+	indices = sorted(manifest['shard'] for _, manifest in manifests)
+	if indices != list(range(1, count + 1)):
+		raise RuntimeError(f"Expected shards 1 to {count}, found {indices}")
+	for key in ('count', 'revision', 'patches'):
+		if any(manifest[key] != first[key] for _, manifest in manifests):
+			raise RuntimeError(f"Shards disagree on {key}; they must build the same checkout with the same settings")
+	if any(_getPortableSettings(manifest['projectSettings']) != _getPortableSettings(first['projectSettings']) for _, manifest in manifests):
+		raise RuntimeError("Shards disagree on projectSettings; they must build the same checkout with the same settings")
+	if v8.getRevision() != first['revision']:
+		raise RuntimeError(f"This checkout is not at the shards' revision {first['revision']}")
+	# A shard skips builds its host cannot run; the merged dist must still be complete.
+	requested = {name for _, manifest in manifests for name in manifest['requested']}
+	built = {
+		'/'.join([build['platform'], build['arch'], build['config']]).lower()
+		for _, manifest in manifests for build in manifest['builds']
+	}
+	missing = sorted(requested - built)
+	if missing:
+		raise RuntimeError(f"Requested builds are missing from the shards: {', '.join(missing)}")
+
+	if any(os.path.abspath(shardDir) == os.path.abspath(distDir) for shardDir in shardDirs):
+		raise RuntimeError("Merge shards into a directory other than the shard outputs")
+	if os.path.isdir(distDir):
+		shutil.rmtree(distDir)
+	merged = dict()
+	packages = dict()
+	costs = dict()
+	for shardDir, manifest in manifests:
+		for relativePath, digest in manifest['files'].items():
+			if os.path.basename(relativePath) in ('info.txt', 'info.json'):
+				continue
+			if relativePath in merged:
+				if merged[relativePath] != digest:
+					raise RuntimeError(f"'{relativePath}' differs between shards")
+				continue
+			merged[relativePath] = digest
+			target = os.path.join(distDir, relativePath)
+			os.makedirs(os.path.dirname(target), exist_ok=True)
+			shutil.copy2(os.path.join(shardDir, relativePath), target)
+		for build in manifest['builds']:
+			buildSettings = V8.BuildSettings(PlatformType[build['platform']], ArchType[build['arch']], BuildConfig[build['config']])
+			name = getBuildName(buildSettings)
+			if name in costs:
+				raise RuntimeError(f"{name} was built by more than one shard")
+			costs[name] = build['seconds']
+			packages.setdefault((buildSettings.platform, buildSettings.arch), []).append(buildSettings.config)
+
+	projectSettings = V8.ProjectSettings.fromJson(first['projectSettings'])
+	for (platform, arch), configs in packages.items():
+		buildOutDir = os.path.join(distDir, platform.value.lower(), arch.value.lower())
+		configs = [config for config in BuildConfig if config in configs]
+		# The cache key names the patches the shards built with, not this checkout's.
+		v8.exportBuildInfo(buildOutDir, projectSettings, platform, arch, configs, first['patches'])
+
+	# Timings of this release balance the shards of the next one.
+	with open(os.path.join(distDir, COSTS_FILE), 'w') as file:
+		json.dump({name: seconds for name, seconds in costs.items() if seconds}, file, indent=1, sort_keys=True)
+	print(f"Merged {count} shard(s) with {len(costs)} build(s) into '{distDir}'")
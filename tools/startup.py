@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import shutil
+import statistics
+import struct
+import subprocess
+from typing import Dict, List
+
+from tools.staticlib import CONSUMER_SOURCE, runMeasured
+
+REPORT_FILE = 'startup.json'
+ORDERING_FILE = 'v8.orderfile'
+# Shared libraries of a component build that packages export.
+SHARED_LIBRARY_PATTERN = re.compile(r'^lib(v8|v8_libbase|v8_libplatform|chrome_zlib)(\.cr)?\.so$')
+OPTIMIZATION_FLAGS = ['-Wl,--icf=all', '-Wl,--gc-sections']
+
+
+def findSharedLibraries(projectPath: str) -> List[str]:
+	return sorted(name for name in os.listdir(projectPath) if SHARED_LIBRARY_PATTERN.match(name))
+
+
+def readTextSize(path: str) -> int:
+	"""Size of the .text section of an ELF64 little-endian shared library."""
+	with open(path, 'rb') as file:
+		header = file.read(64)
+		if header[:4] != b'\x7fELF' or header[4] != 2 or header[5] != 1:
+			raise RuntimeError(f"'{path}' is not a 64-bit little-endian ELF file")
+		sectionOffset, = struct.unpack_from('<Q', header, 0x28)
+		sectionSize, sectionCount, namesIndex = struct.unpack_from('<HHH', header, 0x3A)
+		file.seek(sectionOffset)
+		sections = [struct.unpack('<IIQQQQIIQQ', file.read(sectionSize)[:64]) for _ in range(sectionCount)]
+		namesSection = sections[namesIndex]
+		file.seek(namesSection[4])
+		names = file.read(namesSection[5])
+	for section in sections:
+		name = names[section[0]:names.index(b'\0', section[0])]
+		if name == b'.text':
+			return section[5]
+	return 0
+
+
+def getLinkCommand(ninja: str, projectPath: str, output: str) -> str:
+	"""The command ninja links output with; its dependencies come first."""
+	result = subprocess.run([ninja, '-C', projectPath, '-t', 'commands', output], capture_output=True, text=True)
+	commands = result.stdout.strip().splitlines()
+	if result.returncode != 0 or not commands:
+		raise RuntimeError(f"Unable to read the link command of {output}:\n{result.stderr}")
+	return commands[-1]
+
+
+def buildEmbedder(compiler: str, compileFlags: List[str], linkFlags: List[str], projectPath: str, workDir: str) -> str:
+	"""Link the minimal embedder against the shared libraries in projectPath."""
+	os.makedirs(workDir, exist_ok=True)
+	sourceFile = os.path.join(workDir, 'embedder.cc')
+	executable = os.path.join(workDir, 'embedder')
+	with open(sourceFile, 'w', newline='\n') as file:
+		file.write(CONSUMER_SOURCE)
+	args = [
+		compiler, *compileFlags, *linkFlags, sourceFile,
+		'-L' + projectPath, '-lv8', '-lv8_libplatform', '-lv8_libbase',
+		'-Wl,-rpath,' + projectPath, '-o', executable,
+	]
+	result = subprocess.run(args, capture_output=True, text=True)
+	if result.returncode != 0:
+		raise RuntimeError(f"Unable to build the startup embedder:\n{result.stderr}")
+	return executable
+
+
+def _evict(paths: List[str]):
+	if not hasattr(os, 'posix_fadvise'):
+		return
+	for path in paths:
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+		finally:
+			os.close(fd)
+
+
+def measureStartup(command: List[str], libraries: List[str], runs: int = 5) -> dict:
+	"""Median page faults and wall time of command with libraries evicted from the page cache."""
+	minorFaults, majorFaults, seconds = [], [], []
+	for _ in range(runs):
+		_evict(libraries)
+		elapsed, usage, returncode, output = runMeasured(command, os.path.dirname(command[0]))
+		if returncode != 0:
+			raise RuntimeError(f"Startup benchmark failed with exit code {returncode}:\n{output}")
+		minorFaults.append(usage.ru_minflt)
+		majorFaults.append(usage.ru_majflt)
+		seconds.append(elapsed)
+	return {
+		'minorFaults': int(statistics.median(minorFaults)),
+		'majorFaults': int(statistics.median(majorFaults)),
+		'seconds': round(statistics.median(seconds), 4),
+	}
+
+
+def profileOrdering(command: List[str], libraries: List[str], orderingFile: str, runs: int = 5):
+	"""Write the symbols of libraries in the order a perf profile of command first hits them.
+
+	Returns the number of symbols, or None when perf is unavailable or fails.
+	"""
+	perf = shutil.which('perf')
+	if perf is None:
+		return None
+	libraryNames = {os.path.basename(library) for library in libraries}
+	workDir = os.path.dirname(orderingFile)
+	dataFile = os.path.join(workDir, 'perf.data')
+	ordered = dict()
+	try:
+		for _ in range(runs):
+			record = subprocess.run(
+				[perf, 'record', '-q', '-F', 'max', '-e', 'cycles:u', '-o', dataFile, '--', *command],
+				cwd=workDir, capture_output=True, text=True,
+			)
+			if record.returncode != 0:
+				print(f'\t- perf record failed, not generating a symbol ordering file:\n{record.stderr.strip()}')
+				return None
+			script = subprocess.run(
+				[perf, 'script', '-i', dataFile, '-F', 'sym,dso', '--no-demangle'],
+				cwd=workDir, capture_output=True, text=True,
+			)
+			for line in script.stdout.splitlines():
+				match = re.match(r'^\s*(\S+)\s+\((.+)\)\s*$', line)
+				if match and os.path.basename(match.group(2)) in libraryNames and match.group(1) != '[unknown]':
+					ordered.setdefault(match.group(1), None)
+	finally:
+		if os.path.isfile(dataFile):
+			os.remove(dataFile)
+	with open(orderingFile, 'w', newline='\n') as file:
+		file.write('\n'.join(ordered) + '\n')
+	return len(ordered)
+
+
+def readReport(libDir: str) -> dict:
+	reportFile = os.path.join(libDir, REPORT_FILE)
+	if not os.path.isfile(reportFile):
+		return dict()
+	with open(reportFile) as file:
+		return json.load(file)
+
+
+def writeReport(directory: str, report: dict):
+	with open(os.path.join(directory, REPORT_FILE), 'w', encoding='utf-8') as file:
+		json.dump(report, file, indent=2, sort_keys=True)
+		file.write('\n')
+
+
+def getTextSizes(projectPath: str, libraries: List[str]) -> Dict[str, int]:
+	return {library: readTextSize(os.path.join(projectPath, library)) for library in libraries}
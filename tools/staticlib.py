@@ -0,0 +1,320 @@
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import time
+from typing import Dict, List
+
+# Packaging forms of a static V8 build besides the monolithic archive.
+FORMS = ['prelinked', 'components', 'thin']
+FORMS_FILE = 'forms.json'
+# Consumer link measurements, written after every configuration has compiled.
+LINKS_FILE = 'links.json'
+
+# Objects are assigned to components by the GN target that compiled them,
+# the last directory of their path under obj/.
+COMPONENTS = ['snapshot', 'core', 'compiler', 'platform', 'base', 'third_party']
+
+CONSUMER_SOURCE = '''#include <libplatform/libplatform.h>
+#include <v8.h>
+
+int main() {
+	std::unique_ptr<v8::Platform> platform = v8::platform::NewDefaultPlatform();
+	v8::V8::InitializePlatform(platform.get());
+	v8::V8::Initialize();
+	v8::Isolate::CreateParams params;
+	params.array_buffer_allocator = v8::ArrayBuffer::Allocator::NewDefaultAllocator();
+	v8::Isolate* isolate = v8::Isolate::New(params);
+	isolate->Dispose();
+	v8::V8::Dispose();
+	v8::V8::DisposePlatform();
+	delete params.array_buffer_allocator;
+	return 0;
+}
+'''
+
+
+def _queryInputs(ninja: str, projectPath: str, target: str) -> List[str]:
+	result = subprocess.run([ninja, '-C', projectPath, '-t', 'query', target], capture_output=True, text=True)
+	if result.returncode != 0:
+		raise RuntimeError(f"Unable to query the inputs of {target}:\n{result.stdout}{result.stderr}")
+	inputs = []
+	inInputs = False
+	for line in result.stdout.splitlines():
+		stripped = line.strip()
+		if stripped.startswith('input:'):
+			inInputs = True
+		elif stripped.startswith('outputs:'):
+			inInputs = False
+		elif inInputs and stripped and not stripped.startswith('|'):
+			inputs.append(stripped)
+	return inputs
+
+
+def readArchiveObjects(ninja: str, projectPath: str, archive: str) -> List[str]:
+	"""Objects linked into archive, relative to projectPath, in link order.
+
+	Static libraries among the inputs, such as v8_libbase and v8_libplatform,
+	are expanded to their own objects.
+	"""
+	objects = []
+	visited = set()
+
+	def _expand(target: str):
+		for path in _queryInputs(ninja, projectPath, target):
+			if path.endswith(('.o', '.obj')):
+				objects.append(path)
+			elif path.endswith(('.a', '.lib')) and path not in visited:
+				visited.add(path)
+				_expand(path)
+
+	_expand(archive)
+	if not objects:
+		raise RuntimeError(f"No objects were found for {archive} in {projectPath}")
+	# An object reached through several libraries is only archived once.
+	return list(dict.fromkeys(objects))
+
+
+def getComponent(objectPath: str) -> str:
+	parts = objectPath.replace('\\', '/').split('/')
+	if len(parts) > 1 and parts[1] == 'third_party':
+		return 'third_party'
+	target = parts[-2] if len(parts) > 2 else ''
+	if target.startswith('v8_libbase'):
+		return 'base'
+	if target.startswith('v8_libplatform'):
+		return 'platform'
+	if target.startswith('v8_snapshot'):
+		return 'snapshot'
+	if target.startswith('v8_base_without_compiler'):
+		return 'core'
+	if 'compiler' in target or 'turboshaft' in target:
+		return 'compiler'
+	return 'core'
+
+
+def _readSymbols(nm: str, archive: str, defined: bool) -> set:
+	args = [nm, '-g', '-P', '--defined-only' if defined else '--undefined-only', archive]
+	result = subprocess.run(args, capture_output=True, text=True)
+	if result.returncode != 0:
+		raise RuntimeError(f"Unable to read symbols of {archive}:\n{result.stderr}")
+	symbols = set()
+	for line in result.stdout.splitlines():
+		fields = line.split()
+		# Member headers look like "archive[member]:".
+		if len(fields) >= 2 and not fields[0].endswith(':'):
+			symbols.add(fields[0])
+	return symbols
+
+
+def getLinkOrder(nm: str, archives: Dict[str, str]) -> List[List[str]]:
+	"""Components grouped into mutually dependent sets, dependents first."""
+	definitions = dict()
+	for name in COMPONENTS:
+		if name in archives:
+			for symbol in _readSymbols(nm, archives[name], True):
+				definitions.setdefault(symbol, name)
+	edges = {name: set() for name in archives}
+	for name in edges:
+		for symbol in _readSymbols(nm, archives[name], False):
+			provider = definitions.get(symbol)
+			if provider and provider != name:
+				edges[name].add(provider)
+
+	# Tarjan's algorithm emits each group after the groups it depends on.
+	index = dict()
+	lowLink = dict()
+	stack = []
+	groups = []
+
+	def _visit(name):
+		index[name] = lowLink[name] = len(index)
+		stack.append(name)
+		for dependency in sorted(edges[name], key=COMPONENTS.index):
+			if dependency not in index:
+				_visit(dependency)
+				lowLink[name] = min(lowLink[name], lowLink[dependency])
+			elif dependency in stack:
+				lowLink[name] = min(lowLink[name], index[dependency])
+		if lowLink[name] == index[name]:
+			group = []
+			while True:
+				member = stack.pop()
+				group.append(member)
+				if member == name:
+					break
+			groups.append(sorted(group, key=COMPONENTS.index))
+
+	for name in sorted(edges, key=COMPONENTS.index):
+		if name not in index:
+			_visit(name)
+	return list(reversed(groups))
+
+
+def _runArchiver(ar: str, flags: str, archive: str, objects: List[str], cwd: str):
+	responseFile = archive + '.rsp'
+	with open(responseFile, 'w') as file:
+		file.write('\n'.join(objects) + '\n')
+	try:
+		if os.path.isfile(archive):
+			os.remove(archive)
+		result = subprocess.run([ar, flags, archive, '@' + responseFile], cwd=cwd, capture_output=True, text=True)
+		if result.returncode != 0:
+			raise RuntimeError(f"Unable to create {archive}:\n{result.stderr}")
+	finally:
+		os.remove(responseFile)
+
+
+def writeComponents(ar: str, nm: str, projectPath: str, objects: List[str], outDir: str) -> List[str]:
+	"""Per-component archives and a libv8.ld linker script listing them in link order."""
+	os.makedirs(outDir, exist_ok=True)
+	grouped = dict()
+	for objectPath in objects:
+		grouped.setdefault(getComponent(objectPath), []).append(objectPath)
+	archives = dict()
+	for name in COMPONENTS:
+		if name in grouped:
+			archives[name] = os.path.join(outDir, f'libv8_{name}.a')
+			_runArchiver(ar, 'rcsD', archives[name], grouped[name], projectPath)
+
+	lines = ['/* V8 components in link order; pass with -L<this directory>. */']
+	for group in getLinkOrder(nm, archives):
+		names = ' '.join(f'libv8_{name}.a' for name in group)
+		lines.append(f'GROUP ( {names} )' if len(group) > 1 else f'INPUT ( {names} )')
+	scriptFile = os.path.join(outDir, 'libv8.ld')
+	with open(scriptFile, 'w', newline='\n') as file:
+		file.write('\n'.join(lines) + '\n')
+	return [scriptFile, *archives.values()]
+
+
+def writeThin(ar: str, projectPath: str, objects: List[str], outDir: str) -> List[str]:
+	"""A thin archive with its symbol index next to the objects it references.
+
+	The objects are copies of the members of the monolithic archive, so this
+	form roughly doubles the size of the static library in the package.
+	"""
+	if os.path.isdir(outDir):
+		shutil.rmtree(outDir)
+	for objectPath in objects:
+		target = os.path.join(outDir, objectPath)
+		os.makedirs(os.path.dirname(target), exist_ok=True)
+		shutil.copy2(os.path.join(projectPath, objectPath), target)
+	archive = os.path.join(outDir, 'libv8.a')
+	_runArchiver(ar, 'rcsDT', archive, objects, outDir)
+	return [archive]
+
+
+def writePrelinked(linker: str, nm: str, archive: str, outFile: str, gcSections: bool) -> List[str]:
+	"""One relocatable object of the whole archive with duplicate COMDATs folded.
+
+	With gcSections, sections unreachable from the archive's global symbols
+	are dropped as well; GNU ld supports this for relocatable output, lld
+	does not.
+	"""
+	args = [linker, '-r', '-o', outFile]
+	rootsFile = outFile + '.roots'
+	if gcSections:
+		with open(rootsFile, 'w') as file:
+			for symbol in sorted(_readSymbols(nm, archive, True)):
+				file.write(f'-u {symbol}\n')
+		args.extend(['--gc-sections', '@' + rootsFile])
+	args.extend(['--whole-archive', archive, '--no-whole-archive'])
+	try:
+		result = subprocess.run(args, capture_output=True, text=True)
+	finally:
+		if os.path.isfile(rootsFile):
+			os.remove(rootsFile)
+	if result.returncode != 0:
+		raise RuntimeError(f"Unable to prelink {archive}:\n{result.stderr}")
+	return [outFile]
+
+
+def runMeasured(args: List[str], cwd: str, env=None):
+	"""Wall time in seconds, resource usage, exit code and output of a command and its children."""
+	start = time.perf_counter()
+	process = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = process.stdout.read()
+	process.stdout.close()
+	_, status, usage = os.wait4(process.pid, 0)
+	elapsed = time.perf_counter() - start
+	# Negative signal numbers like subprocess; os.waitstatus_to_exitcode needs Python 3.9.
+	process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+	return elapsed, usage, process.returncode, output.decode('utf-8', errors='replace')
+
+
+def measureLinks(compiler: str, compileFlags: List[str], linkFlags: List[str], libraries: Dict[str, List[str]], workDir: str, runs: int = 3):
+	"""Link a minimal embedder against each library form; returns results per form."""
+	os.makedirs(workDir, exist_ok=True)
+	sourceFile = os.path.join(workDir, 'consumer.cc')
+	objectFile = os.path.join(workDir, 'consumer.o')
+	with open(sourceFile, 'w', newline='\n') as file:
+		file.write(CONSUMER_SOURCE)
+	result = subprocess.run([compiler, *compileFlags, '-c', sourceFile, '-o', objectFile], capture_output=True, text=True)
+	if result.returncode != 0:
+		raise RuntimeError(f"Unable to compile the link benchmark:\n{result.stderr}")
+
+	results = dict()
+	for form, libraryArgs in libraries.items():
+		executable = os.path.join(workDir, 'consumer-' + form)
+		args = [compiler, *linkFlags, objectFile, *libraryArgs, '-o', executable]
+		seconds = []
+		peak = 0
+		error = None
+		for _ in range(runs):
+			elapsed, usage, returncode, output = runMeasured(args, workDir)
+			if returncode != 0:
+				error = output.strip().splitlines()[-1] if output.strip() else f'exit code {returncode}'
+				break
+			seconds.append(elapsed)
+			peak = max(peak, usage.ru_maxrss)
+		if error:
+			print(f'\t- Linking against {form} failed: {error}')
+			results[form] = {'error': error}
+		else:
+			results[form] = {'seconds': round(statistics.median(seconds), 3), 'peakMemoryKiB': peak}
+			print(f'\t- {form}: consumer link {statistics.median(seconds):.2f}s, peak {peak // 1024} MiB')
+	shutil.rmtree(workDir, ignore_errors=True)
+	return results
+
+
+def readForms(libDir: str) -> dict:
+	"""Forms of libDir with their consumer link measurements, when recorded."""
+	formsFile = os.path.join(libDir, FORMS_FILE)
+	if not os.path.isfile(formsFile):
+		return dict()
+	with open(formsFile) as file:
+		forms = json.load(file)
+	for form, link in readLinks(libDir).items():
+		if form in forms:
+			forms[form]['link'] = link
+	return forms
+
+
+def writeForms(libDir: str, forms: dict):
+	with open(os.path.join(libDir, FORMS_FILE), 'w', encoding='utf-8') as file:
+		json.dump(forms, file, indent=2, sort_keys=True)
+		file.write('\n')
+
+
+def getLinkArgs(libDir: str, form: str, entry: dict) -> List[str]:
+	"""Linker arguments of a form as recorded in forms.json."""
+	paths = [os.path.join(libDir, path) for path in entry['files']]
+	if form == 'components':
+		# The linker script names its archives relative to its directory.
+		return ['-L' + os.path.dirname(paths[0]), paths[0]]
+	return paths[:1]
+
+
+def readLinks(libDir: str) -> dict:
+	linksFile = os.path.join(libDir, LINKS_FILE)
+	if not os.path.isfile(linksFile):
+		return dict()
+	with open(linksFile) as file:
+		return json.load(file)
+
+
+def writeLinks(libDir: str, links: dict):
+	with open(os.path.join(libDir, LINKS_FILE), 'w', encoding='utf-8') as file:
+		json.dump(links, file, indent=2, sort_keys=True)
+		file.write('\n')
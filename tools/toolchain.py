@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import platform as sysPlatform
+
+from tools.lock import fileLock
+
+# Read-only toolchain stores, e.g. toolchains baked into a Docker image.
+TOOLCHAIN_DIR_ENV = 'V8_PACKAGER_TOOLCHAIN_DIR'
+# Writable toolchain store; freshly downloaded toolchains are moved here.
+TOOLCHAIN_CACHE_ENV = 'V8_PACKAGER_TOOLCHAIN_CACHE'
+
+
+_resolved = dict()
+_resolvedLock = threading.RLock()
+
+
+def resolveOnce(key, resolver):
+	"""Run resolver once per process for key and return its result afterwards."""
+	with _resolvedLock:
+		if key not in _resolved:
+			_resolved[key] = resolver()
+		return _resolved[key]
+
+
+def forgetResolved(v8Dir: str):
+	"""Drop results resolved for a checkout whose DEPS may have changed."""
+	with _resolvedLock:
+		for key in [key for key in _resolved if isinstance(key, tuple) and v8Dir in key]:
+			del _resolved[key]
+
+
+def _storeRoots():
+	roots = []
+	cacheRoot = os.environ.get(TOOLCHAIN_CACHE_ENV)
+	if cacheRoot:
+		roots.append(cacheRoot)
+	for root in os.environ.get(TOOLCHAIN_DIR_ENV, '').split(os.pathsep):
+		if root and root not in roots:
+			roots.append(root)
+	return roots
+
+
+def _storeKey(key: str):
+	return re.sub(r'[^A-Za-z0-9._-]', '_', key)
+
+
+def isLink(path: str):
+	if os.path.islink(path):
+		return True
+	isJunction = getattr(os.path, 'isjunction', None)
+	return bool(isJunction and isJunction(path))
+
+
+def removeTree(path: str):
+	if isLink(path):
+		if os.path.isdir(path) and sysPlatform.system() == 'Windows':
+			os.rmdir(path)
+		else:
+			os.unlink(path)
+	elif os.path.isdir(path):
+		shutil.rmtree(path)
+	elif os.path.exists(path):
+		os.remove(path)
+
+
+def _linkDirectory(source: str, target: str):
+	removeTree(target)
+	os.makedirs(os.path.dirname(target), exist_ok=True)
+	if sysPlatform.system() == 'Windows':
+		# Junctions do not require elevated privileges.
+		subprocess.check_call(
+			['cmd', '/c', 'mklink', '/J', target, source],
+			stdout=subprocess.DEVNULL,
+		)
+	else:
+		os.symlink(source, target, target_is_directory=True)
+
+
+def find(kind: str, key: str):
+	for root in _storeRoots():
+		path = os.path.join(root, kind, _storeKey(key))
+		if os.path.isdir(path):
+			return path
+	return None
+
+
+def restoreDirectory(kind: str, key: str, target: str):
+	"""Link a stored toolchain into the workspace. Returns True on success."""
+	if key is None:
+		return False
+	source = find(kind, key)
+	if source is None:
+		return False
+	if isLink(target) and os.path.realpath(target) == os.path.realpath(source):
+		return True
+	print(f'\t- Using provisioned {kind} toolchain {key}')
+	_linkDirectory(source, target)
+	return True
+
+
+def publishDirectory(kind: str, key: str, source: str):
+	"""Move a downloaded toolchain into the writable store and link it back."""
+	cacheRoot = os.environ.get(TOOLCHAIN_CACHE_ENV)
+	if not cacheRoot or key is None or isLink(source) or not os.path.isdir(source):
+		return
+	target = os.path.join(cacheRoot, kind, _storeKey(key))
+	os.makedirs(os.path.dirname(target), exist_ok=True)
+	with fileLock(target + '.lock'):
+		if os.path.isdir(target):
+			removeTree(source)
+		else:
+			staging = target + '.partial'
+			removeTree(staging)
+			shutil.move(source, staging)
+			os.replace(staging, target)
+			print(f'\t- Stored {kind} toolchain {key} in {cacheRoot}')
+	_linkDirectory(target, source)
+
+
+def restoreFile(kind: str, key: str, name: str, target: str):
+	source = find(kind, key)
+	if source is None or not os.path.isfile(os.path.join(source, name)):
+		return False
+	os.makedirs(os.path.dirname(target), exist_ok=True)
+	shutil.copy2(os.path.join(source, name), target)
+	return True
+
+
+def publishFile(kind: str, key: str, source: str):
+	cacheRoot = os.environ.get(TOOLCHAIN_CACHE_ENV)
+	if not cacheRoot or not os.path.isfile(source):
+		return
+	targetDir = os.path.join(cacheRoot, kind, _storeKey(key))
+	target = os.path.join(targetDir, os.path.basename(source))
+	if os.path.isfile(target):
+		return
+	os.makedirs(targetDir, exist_ok=True)
+	with fileLock(target + '.lock'):
+		if not os.path.isfile(target):
+			staging = target + '.partial'
+			shutil.copy2(source, staging)
+			os.replace(staging, target)
+
+
+def getClangRevision(v8Dir: str):
+	"""Clang package version pinned by tools/clang/scripts/update.py."""
+	updateScript = os.path.join(v8Dir, 'tools', 'clang', 'scripts', 'update.py')
+	if not os.path.isfile(updateScript):
+		return None
+	with open(updateScript, encoding='utf-8') as file:
+		content = file.read()
+	revision = re.search(r"^CLANG_REVISION = '([^']+)'", content, re.MULTILINE)
+	subRevision = re.search(r'^CLANG_SUB_REVISION = (\d+)', content, re.MULTILINE)
+	if not revision or not subRevision:
+		return None
+	return f'{revision.group(1)}-{subRevision.group(1)}'
+
+
+def getClangKey(v8Dir: str):
+	revision = getClangRevision(v8Dir)
+	if revision is None:
+		return None
+	return f'{sysPlatform.system().lower()}-{revision}'
+
+
+def getSysroot(v8Dir: str, arch: str):
+	"""Returns (directory, key) of the Debian sysroot install-sysroot.py uses for arch."""
+	scriptsDir = os.path.join(v8Dir, 'build', 'linux', 'sysroot_scripts')
+	sysrootsFile = os.path.join(scriptsDir, 'sysroots.json')
+	installScript = os.path.join(scriptsDir, 'install-sysroot.py')
+	if not os.path.isfile(sysrootsFile) or not os.path.isfile(installScript):
+		return None, None
+	with open(installScript, encoding='utf-8') as file:
+		match = re.search(r"^DEFAULT_TARGET_PLATFORM = '([^']+)'", file.read(), re.MULTILINE)
+	targetPlatform = match.group(1) if match else 'bullseye'
+	with open(sysrootsFile, encoding='utf-8') as file:
+		sysroots = json.load(file)
+	sysroot = sysroots.get(f'{targetPlatform}_{arch}')
+	if not sysroot:
+		return None, None
+	key = sysroot.get('Sha256Sum') or sysroot.get('Sha1Sum') or sysroot.get('Tarball')
+	return os.path.join(v8Dir, 'build', 'linux', sysroot['SysrootDir']), key
+
+
+def readClangStamp(clangDir: str):
+	"""Package version recorded by update.py, without its target OS suffix."""
+	stampFile = os.path.join(clangDir, 'cr_build_revision')
+	if not os.path.isfile(stampFile):
+		return None
+	with open(stampFile, encoding='utf-8') as file:
+		return file.read().strip().split(',')[0]
+
+
+def isSysrootInstalled(sysrootDir: str, key: str):
+	"""Whether install-sysroot.py already unpacked the pinned sysroot."""
+	stampFile = os.path.join(sysrootDir, '.stamp')
+	if key is None or not os.path.isfile(stampFile):
+		return False
+	with open(stampFile, encoding='utf-8') as file:
+		return key in file.read()
+
+
+class ToolchainManifest:
+	"""Versions of the compilers and build tools used by a workspace.
+
+	Each tool is probed at most once; info.txt, info.json and the artifact
+	cache key are all derived from the same values.
+	"""
+
+	def __init__(self, v8Dir: str, binDir: str):
+		self._v8Dir = v8Dir
+		self._binDir = binDir
+		self._clangDir = os.path.join(v8Dir, 'third_party', 'llvm-build', 'Release+Asserts')
+		self._probes = dict()
+		self._lock = threading.RLock()
+
+	def _probe(self, key, resolver):
+		with self._lock:
+			if key not in self._probes:
+				self._probes[key] = resolver()
+			return self._probes[key]
+
+	@staticmethod
+	def _readText(path: str):
+		if os.path.isfile(path):
+			with open(path, encoding='utf-8', errors='replace') as file:
+				return file.read().strip()
+		return None
+
+	@staticmethod
+	def _runVersion(executable: str):
+		if not os.path.isfile(executable):
+			return None
+		try:
+			output = subprocess.check_output([executable, '--version'], text=True, stderr=subprocess.STDOUT)
+			return output.splitlines()[0].strip()
+		except Exception:
+			return None
+
+	@staticmethod
+	def _executableSuffix(windows: bool):
+		return '.exe' if windows else ''
+
+	def clangRevision(self):
+		return self._probe('clang-revision', lambda: self._readText(os.path.join(self._clangDir, 'cr_build_revision')))
+
+	def clangVersion(self, windows: bool):
+		def _resolve():
+			compilerName = 'clang-cl.exe' if windows else 'clang'
+			firstLine = self._runVersion(os.path.join(self._clangDir, 'bin', compilerName))
+			if firstLine is None:
+				return None
+			match = re.search(r'clang version (\d+(?:\.\d+)+)', firstLine)
+			return match.group(1) if match else firstLine
+		return self._probe(('clang', windows), _resolve)
+
+	def gnVersion(self, windows: bool):
+		def _cleanVersion(version):
+			prefix = 'git_revision:'
+			return version[len(prefix):] if version.startswith(prefix) else version
+
+		def _resolve():
+			gnName = 'gn' + self._executableSuffix(windows)
+			version = self._readText(os.path.join(self._binDir, gnName + '.version'))
+			version = version or self._readText(os.path.join(self._binDir, 'gn.version'))
+			version = version or self._runVersion(os.path.join(self._binDir, gnName))
+			return _cleanVersion(version) if version else None
+		return self._probe(('gn', windows), _resolve)
+
+	def ninjaVersion(self, windows: bool):
+		def _resolve():
+			ninjaName = 'ninja' + self._executableSuffix(windows)
+			return (
+				self._readText(os.path.join(self._binDir, ninjaName + '.version'))
+				or self._runVersion(os.path.join(self._binDir, ninjaName))
+			)
+		return self._probe(('ninja', windows), _resolve)
+
+	def ndkRevision(self):
+		def _resolve():
+			propertiesFile = os.path.join(self._v8Dir, 'third_party', 'android_toolchain', 'ndk', 'source.properties')
+			if not os.path.isfile(propertiesFile):
+				return None
+			with open(propertiesFile, encoding='utf-8', errors='replace') as file:
+				for line in file:
+					key, separator, value = line.partition('=')
+					if separator and key.strip() == 'Pkg.Revision':
+						return value.strip()
+			return None
+		return self._probe('ndk', _resolve)
+
+	def toDict(self, platform: str):
+		"""Toolchain versions relevant to packages of platform (e.g. 'Windows')."""
+		windows = platform == 'Windows'
+		result = {
+			'compiler': 'clang-cl' if windows else 'clang',
+			'clangVersion': self.clangVersion(windows),
+			'clangRevision': self.clangRevision(),
+			'gnVersion': self.gnVersion(windows),
+			'ninjaVersion': self.ninjaVersion(windows),
+		}
+		if platform == 'Android':
+			result['ndkRevision'] = self.ndkRevision()
+		return result
+
+	def cacheKey(self, platform: str, *inputs):
+		"""Key identifying artifacts built from inputs with this toolchain."""
+		encoded = json.dumps([self.toDict(platform), inputs], sort_keys=True, default=str)
+		return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
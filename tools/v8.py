@@ -1,7 +1,11 @@
 
+import concurrent.futures
+import hashlib
 import io
+import json
 import os
 import re
+import shlex
 import shutil
 import stat
 import subprocess
@@ -13,9 +17,47 @@ from enum import Enum
 from typing import List
 
 import tools.git as git
+from tools.archive import PackageArchive, writeArchive, writeDeduplicatedArchives
+from tools.journal import Journal
+from tools.progress import NINJA_STATUS, NinjaProgress, logDirectory, runLogged
+import tools.staticlib as staticlib
+import tools.startup as startup
+import tools.toolchain as toolchain
 from tools.types import ArchType, EnvVars, PlatformType, BuildConfig
 
+NINJA_VERSION = '1.13.2'
+STARTUP_DATA_FILE = 'snapshot_blob.bin'
+
+def _sha256File(path: str):
+	digest = hashlib.sha256()
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(1024 * 1024), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def getBuildName(buildSettings: 'V8.BuildSettings') -> str:
+	"""platform/arch/config, lowercase; names journal steps, shard manifests and history rows."""
+	return '/'.join([buildSettings.platform.value, buildSettings.arch.value, buildSettings.config.value]).lower()
+
+
+def getPathSize(path: str) -> int:
+	"""Size of a file, or of all files below a directory."""
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	return sum(
+		os.path.getsize(os.path.join(root, name))
+		for root, _, names in os.walk(path)
+		for name in names
+	)
+
+
 class V8:
+	# Download locations; benchmarks and mirrors point these elsewhere.
+	REPOSITORY_URL = 'https://chromium.googlesource.com/v8/v8.git'
+	NINJA_URL = 'https://github.com/ninja-build/ninja/releases/download'
+	CIPD_URL = 'https://chrome-infra-packages.appspot.com/dl'
+
 	class LibraryType(Enum):
 		Shared = "Shared"
 		Static = "Static"
@@ -55,9 +97,49 @@ class V8:
 	class ProjectSettings:
 		def __init__(self, libraryType: 'V8.LibraryType' = None):
 			self.libraryType: 'V8.LibraryType' = libraryType if libraryType is not None else V8.LibraryType.Static
+			self.precompiledHeaders = False
+			self.staticForms: List[str] = []
+			self.externalStartupData = False
+			# Relink shared libraries for startup, ordered by symbolOrderingFile
+			# or a generated profile when None.
+			self.startupOptimization = False
+			self.symbolOrderingFile: str = None
+			# Hash of a symbol ordering file that lives on another host, from fromJson.
+			self._symbolOrderingHash: str = None
+			# Sysroot of Linux Arm64 cross builds; the pinned Debian sysroot when None.
+			self.linuxSysroot: str = None
 			self.defaultArgs = self._getDefaultArgs()
 			pass
 
+		def toJson(self) -> dict:
+			return {
+				'libraryType': self.libraryType.value,
+				'precompiledHeaders': self.precompiledHeaders,
+				'staticForms': sorted(self.staticForms),
+				'externalStartupData': self.externalStartupData,
+				'startupOptimization': self.startupOptimization,
+				'symbolOrderingFile': self.symbolOrderingFile,
+				'symbolOrderingHash': self.getSymbolOrderingHash(),
+				'linuxSysroot': self.linuxSysroot,
+			}
+
+		@staticmethod
+		def fromJson(data: dict) -> 'V8.ProjectSettings':
+			projectSettings = V8.ProjectSettings(V8.LibraryType(data['libraryType']))
+			projectSettings.precompiledHeaders = data.get('precompiledHeaders', False)
+			projectSettings.staticForms = list(data.get('staticForms', []))
+			projectSettings.externalStartupData = data.get('externalStartupData', False)
+			projectSettings.startupOptimization = data.get('startupOptimization', False)
+			projectSettings.symbolOrderingFile = data.get('symbolOrderingFile')
+			projectSettings._symbolOrderingHash = data.get('symbolOrderingHash')
+			projectSettings.linuxSysroot = data.get('linuxSysroot')
+			return projectSettings
+
+		def getSymbolOrderingHash(self):
+			if self.symbolOrderingFile and os.path.isfile(self.symbolOrderingFile):
+				return _sha256File(self.symbolOrderingFile)
+			return self._symbolOrderingHash
+
 		def _getDefaultArgs(self):
 			args = dict()
 			# General
@@ -96,7 +178,11 @@ class V8:
 				args['target_os'] = "win"
 			elif PlatformType.Linux == buildSettings.platform:
 				args['target_os'] = "linux"
-				args['use_sysroot'] = False
+				# x64 builds link against the container's libraries; Arm64 is
+				# cross-compiled against a Debian sysroot.
+				args['use_sysroot'] = ArchType.Arm64 == buildSettings.arch
+				if ArchType.Arm64 == buildSettings.arch and self.linuxSysroot:
+					args['target_sysroot'] = self.linuxSysroot
 				if self.libraryType == V8.LibraryType.Static:
 					args['v8_tls_used_in_library'] = True
 			elif PlatformType.Android == buildSettings.platform:
@@ -111,6 +197,9 @@ class V8:
 			else:
 				raise RuntimeError("Error: Unsupported CPU architecture")
 
+			if self.externalStartupData:
+				args['v8_use_external_startup_data'] = True
+
 			# Validation/Debugging
 			args['is_debug'] = buildSettings.config == BuildConfig.Debug
 			if buildSettings.config == BuildConfig.Debug:
@@ -156,13 +245,37 @@ class V8:
 		
 	@staticmethod
 	def initializeRepository(version: 'V8.Version'):
-		git.fetch('https://chromium.googlesource.com/v8/v8.git@' + f'{version.major}.{version.minor}-lkgr' , 'v8')
-		return V8(os.getcwd())
+		git.fetch(V8.REPOSITORY_URL + '@' + f'{version.major}.{version.minor}-lkgr' , 'v8')
+		toolchain.forgetResolved(os.path.abspath('v8'))
+		v8 = V8(os.getcwd())
+		v8.journal.complete('fetch/v8', Journal.fingerprint(version.toString(), git.readHead(v8._v8Dir)))
+		return v8
+
+	@staticmethod
+	def checkoutRevision(root: str, revision: str):
+		"""Switch an initialized checkout to a V8 commit, keeping out.gn for incremental builds."""
+		v8Dir = os.path.join(root, 'v8')
+		git.reset(v8Dir)
+		buildDir = os.path.join(v8Dir, 'build')
+		if os.path.isdir(os.path.join(buildDir, '.git')):
+			git.reset(buildDir)
+		git.fetch(V8.REPOSITORY_URL + '@' + revision, v8Dir)
+		# The new revision may pin a different NDK, sysroot, Clang or Windows SDK.
+		toolchain.forgetResolved(os.path.abspath(v8Dir))
+		v8 = V8(root)
+		v8.journal.invalidate('patches')
+		v8.journal.complete('fetch/v8', Journal.fingerprint(revision, git.readHead(v8Dir)))
+		return v8
 
 	def __init__(self, root):
+		self._root = os.path.abspath(root)
 		self._v8Dir = os.path.abspath(os.path.join(root, 'v8'))
 		if not os.path.exists(self._v8Dir):
 			raise RuntimeError("Error: Expected V8 project to have been initialized")
+		self.journal = Journal(self._root)
+		self._toolchainManifest = None
+		# Ninja edges and seconds of the builds compiled by this process.
+		self.ninjaStats = dict()
 
 		self._binDir = os.path.abspath(os.path.join(root, 'bin'))
 		self._patchDir = os.path.abspath(os.path.join(root, 'patches'))
@@ -183,19 +296,6 @@ class V8:
 				mode = os.stat(path).st_mode
 				os.chmod(path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
 
-		def _downloadBinaryFile(file, url, out):
-			outputFile = os.path.join(out, file)
-			if os.path.exists(outputFile):
-				_ensureExecutable(outputFile)
-				return
-			response = requests.get(url)
-			response.raise_for_status()
-			zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-			os.makedirs(out, exist_ok=True)
-			zip_file.extract(file, out)
-			_ensureExecutable(outputFile)
-			print(f"Downloaded '{file}'")
-
 		def _downloadVersionedBinaryFile(file, url, version, out):
 			stampFile = os.path.join(out, file + '.version')
 			outputFile = os.path.join(out, file)
@@ -204,31 +304,32 @@ class V8:
 					if f.read().strip() == version:
 						_ensureExecutable(outputFile)
 						return
-			response = requests.get(url)
-			response.raise_for_status()
-			zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-			os.makedirs(out, exist_ok=True)
-			zip_file.extract(file, out)
+			toolName = os.path.splitext(file)[0]
+			if toolchain.restoreFile(toolName, version, file, outputFile):
+				print(f"Using provisioned '{file}' {version}")
+			else:
+				response = requests.get(url)
+				response.raise_for_status()
+				zip_file = zipfile.ZipFile(io.BytesIO(response.content))
+				os.makedirs(out, exist_ok=True)
+				zip_file.extract(file, out)
+				toolchain.publishFile(toolName, version, outputFile)
+				print(f"Downloaded '{file}'")
 			_ensureExecutable(outputFile)
 			with open(stampFile, 'w') as f:
 				f.write(version)
-			print(f"Downloaded '{file}'")
 
 		# Read the GN version required by this V8 checkout from DEPS
-		namespace = {}
-		with open(os.path.join(self._v8Dir, 'DEPS')) as f:
-			exec('Var = lambda name: vars[name]; Str = str', namespace)
-			exec(f.read(), namespace)
-		gnVersion = namespace.get('vars', {}).get('gn_version', 'latest')
+		gnVersion = self._readDeps().get('vars', {}).get('gn_version', 'latest')
 
 		# We need prebuilt gn and ninja to compile the project
-		ninjaUrl = "https://github.com/ninja-build/ninja/releases/download/v1.13.2/ninja-{}.zip"
-		gnUrl = "https://chrome-infra-packages.appspot.com/dl/gn/gn/{}-amd64/+/" + gnVersion
+		ninjaUrl = f"{V8.NINJA_URL}/v{NINJA_VERSION}/ninja-{{}}.zip"
+		gnUrl = f"{V8.CIPD_URL}/gn/gn/{{}}-amd64/+/" + gnVersion
 		if PlatformType.Linux in platforms or PlatformType.Android in platforms:
-			_downloadBinaryFile('ninja', ninjaUrl.format('linux'), self._binDir)
+			_downloadVersionedBinaryFile('ninja', ninjaUrl.format('linux'), NINJA_VERSION, self._binDir)
 			_downloadVersionedBinaryFile('gn', gnUrl.format('linux'), gnVersion, self._binDir)
 		if PlatformType.Windows in platforms:
-			_downloadBinaryFile('ninja.exe', ninjaUrl.format('win'), self._binDir)
+			_downloadVersionedBinaryFile('ninja.exe', ninjaUrl.format('win'), NINJA_VERSION, self._binDir)
 			_downloadVersionedBinaryFile('gn.exe', gnUrl.format('windows'), gnVersion, self._binDir)
 
 	def fetchProjectDependencies(self, platforms: List[PlatformType] = None):
@@ -263,19 +364,7 @@ class V8:
 				'v8/third_party/colorama/src',
 				'v8/third_party/cpu_features/src',
 			])
-		namespace = {}
-		with open(os.path.join(self._v8Dir, 'DEPS')) as file:
-			exec('Var = lambda name: vars[name]; Str = str', namespace)
-			exec(file.read(), namespace)
-		deps = namespace.get('deps')
-		for name, url in deps.items():
-			if not name.startswith('v8'):
-				name = 'v8/' + name
-			if name in requiredDeps:
-				if(isinstance(url, dict)):
-					git.fetch(url["url"], name)
-				else:
-					git.fetch(url, name)
+		self._fetchDeps(requiredDeps)
 
 		if PlatformType.Android in platforms:
 			self.fetchAndroidToolchain()
@@ -289,29 +378,75 @@ class V8:
 		# Required for is_clang=true; update.py is self-contained and uses its own stamp file.
 		clangUpdateScript = os.path.join(self._v8Dir, 'tools', 'clang', 'scripts', 'update.py')
 		clangStampFile = os.path.join(self._v8Dir, 'third_party', 'llvm-build', 'Release+Asserts', 'cr_build_revision')
-		if os.path.exists(clangUpdateScript) and not os.path.exists(clangStampFile):
+		def _downloadClang():
 			print("Downloading prebuilt clang toolchain (this may take a while)...")
 			subprocess.check_call([sys.executable, clangUpdateScript])
+		if os.path.exists(clangUpdateScript):
+			self.journal.run(
+				'toolchain/clang',
+				Journal.fingerprint(toolchain.getClangKey(self._v8Dir)),
+				_downloadClang,
+				outputs=[clangStampFile],
+			)
 
-	def fetchAndroidToolchain(self):
+	def provisionToolchains(self, platforms: List[PlatformType] = None):
+		"""Fetch only what is needed to download the toolchains of the requested platforms."""
+		platforms = set(platforms or list(PlatformType))
+		self._fetchDeps(['v8/build', 'v8/tools/clang'])
+		env = os.environ.copy()
+		if PlatformType.Windows in platforms:
+			self._ensureClangToolchain('clang-cl.exe', env)
+		if PlatformType.Linux in platforms or PlatformType.Android in platforms:
+			self._ensureClangToolchain('clang', env)
+		if PlatformType.Linux in platforms:
+			# Linux Arm64 is cross-compiled against Debian sysroots.
+			self._ensureSysroot('amd64', env)
+			self._ensureSysroot('arm64', env)
+		if PlatformType.Android in platforms:
+			self.fetchAndroidToolchain()
+			self._ensureSysroot('amd64', env)
+
+	def _readDeps(self):
 		namespace = {}
 		with open(os.path.join(self._v8Dir, 'DEPS')) as file:
 			exec('Var = lambda name: vars[name]; Str = str', namespace)
 			exec(file.read(), namespace)
-		dependency = namespace['deps']['third_party/android_toolchain/ndk']
+		return namespace
+
+	def _fetchDeps(self, requiredDeps: List[str]):
+		deps = self._readDeps().get('deps')
+		for name, url in deps.items():
+			if not name.startswith('v8'):
+				name = 'v8/' + name
+			if name in requiredDeps:
+				depUrl = url["url"] if isinstance(url, dict) else url
+				# Deps are pinned by DEPS, so a completed fetch of the same URL
+				# can be skipped when resuming.
+				self.journal.run(
+					'fetch/' + name,
+					Journal.fingerprint(depUrl),
+					lambda: git.fetch(depUrl, name),
+					outputs=[os.path.join(self._root, name, '.git')],
+				)
+
+	def fetchAndroidToolchain(self):
+		toolchain.resolveOnce(('ndk', self._v8Dir), self._fetchAndroidToolchain)
+
+	def _fetchAndroidToolchain(self):
+		dependency = self._readDeps()['deps']['third_party/android_toolchain/ndk']
 		package = dependency['packages'][0]
 		version = package['version']
 		toolchainDir = os.path.join(self._v8Dir, 'third_party', 'android_toolchain', 'ndk')
 		stampFile = os.path.join(toolchainDir, '.cipd-version')
+		if not os.path.isfile(stampFile):
+			toolchain.restoreDirectory('ndk', version, toolchainDir)
 		if os.path.isfile(stampFile):
 			with open(stampFile) as file:
 				if file.read().strip() == version:
+					self.journal.complete('toolchain/ndk', Journal.fingerprint(version))
 					return
 
-		url = (
-			'https://chrome-infra-packages.appspot.com/dl/'
-			f"{package['package']}/+/{version}"
-		)
+		url = f"{V8.CIPD_URL}/{package['package']}/+/{version}"
 		archiveFile = os.path.join(self._v8Dir, 'third_party', 'android_toolchain.zip')
 		print('Downloading Android NDK toolchain (this may take a while)...')
 		response = requests.get(url, stream=True)
@@ -319,16 +454,19 @@ class V8:
 		with open(archiveFile, 'wb') as archive:
 			for chunk in response.iter_content(chunk_size=1024 * 1024):
 				archive.write(chunk)
-		if os.path.isdir(toolchainDir):
-			shutil.rmtree(toolchainDir)
+		toolchain.removeTree(toolchainDir)
 		os.makedirs(toolchainDir, exist_ok=True)
 		with zipfile.ZipFile(archiveFile) as archive:
 			archive.extractall(toolchainDir)
 		os.remove(archiveFile)
 		with open(stampFile, 'w') as file:
 			file.write(version)
+		toolchain.publishDirectory('ndk', version, toolchainDir)
+		self.journal.complete('toolchain/ndk', Journal.fingerprint(version))
 
 	def resetRepository(self):
+		for step in ('patches', 'gn/', 'compile/', 'export/', 'archive/'):
+			self.journal.invalidate(step)
 		git.reset(self._v8Dir)
 		buildDir = os.path.join(self._v8Dir, 'build')
 		if os.path.isdir(os.path.join(buildDir, '.git')):
@@ -336,7 +474,17 @@ class V8:
 		outDir = os.path.join(self._v8Dir, 'out.gn')
 		if os.path.isdir(outDir):
 			print(f"Removing generated build outputs from '{outDir}'")
-			shutil.rmtree(outDir)
+			if os.path.ismount(outDir):
+				# out.gn may be a tmpfs mount inside the container; clear its
+				# contents instead of removing the mount point itself.
+				for name in os.listdir(outDir):
+					path = os.path.join(outDir, name)
+					if os.path.isdir(path) and not os.path.islink(path):
+						shutil.rmtree(path)
+					else:
+						os.remove(path)
+			else:
+				shutil.rmtree(outDir)
 
 	def applyPatches(self):
 		print('Applying patches')
@@ -346,18 +494,48 @@ class V8:
 		# sub-repo inside v8/. For example:
 		#   patches/13/build/foo.patch  -> applied to v8/build
 		#   patches/13/foo.patch        -> applied to v8
-		patchDirs = [
-			os.path.join(self._patchDir, f'{self.version.major}'), 
-	    	os.path.join(self._patchDir, f'{self.version.major}.{self.version.minor}')
-		]
-		for patchDir in patchDirs:
-			for root, _, files in os.walk(patchDir):
-				for file in files:
-					if file.endswith('.patch'):
-						file_path = os.path.join(root, file)
-						relPath = os.path.relpath(root, patchDir)
-						targetRepo = 'v8' if relPath == '.' else os.path.join('v8', relPath)
-						git.applyPatch(os.path.abspath(file_path), targetRepo)
+		appliedSets = []
+		patchSets = self.getPatchSets()
+		try:
+			for targetRepo, patchFiles in patchSets.items():
+				# Only revert what this call applied; earlier runs may have
+				# applied some of the patches already.
+				applied = git.applyPatches(patchFiles, targetRepo)
+				if applied:
+					appliedSets.append((targetRepo, applied))
+		except RuntimeError:
+			self.journal.invalidate('patches')
+			for targetRepo, patchFiles in reversed(appliedSets):
+				git.revertPatches(patchFiles, targetRepo)
+			raise
+		self.recordPatches(patchSets)
+
+	def recordPatches(self, patchSets):
+		"""Fingerprint the applied patches; builds regenerate when it changes."""
+		self.journal.complete('patches', self.getPatchFingerprint(patchSets))
+
+	def getPatchFingerprint(self, patchSets=None):
+		"""Fingerprint of the patches applied to the checkout, read from the on-disk patch stamps.
+
+		Repositories are named relative to the checkout, so the fingerprint is
+		the same in every process and on every host.
+		"""
+		if patchSets is None:
+			patchSets = self.getPatchSets()
+		return Journal.fingerprint([
+			(os.path.relpath(targetRepo, self._v8Dir).replace(os.sep, '/'), git.readHead(targetRepo), git.getPatchStamp(targetRepo))
+			for targetRepo in sorted(patchSets)
+		])
+
+	def getPatchSets(self):
+		"""Patch files of this V8 version by the repository they apply to, in order."""
+		patchSets = dict()
+		for patchFile in self._getPatchFiles():
+			# <version>/<sub-repo...>/<name>.patch
+			parts = patchFile.replace('\\', '/').split('/')
+			targetRepo = os.path.join(self._v8Dir, *parts[1:-1])
+			patchSets.setdefault(targetRepo, []).append(os.path.join(self._patchDir, patchFile))
+		return patchSets
 
 	def _getPatchFiles(self):
 		patchFiles = []
@@ -365,68 +543,236 @@ class V8:
 			os.path.join(self._patchDir, f'{self.version.major}'),
 			os.path.join(self._patchDir, f'{self.version.major}.{self.version.minor}')
 		]
+		# Major version patches apply before the minor version ones.
 		for patchDir in patchDirs:
 			if not os.path.isdir(patchDir):
 				continue
+			dirFiles = []
 			for root, _, files in os.walk(patchDir):
 				for file in files:
 					if file.endswith('.patch'):
-						patchFiles.append(os.path.relpath(os.path.join(root, file), self._patchDir))
-		return sorted(patchFiles)
+						dirFiles.append(os.path.relpath(os.path.join(root, file), self._patchDir))
+			patchFiles.extend(sorted(dirFiles))
+		return patchFiles
 
 
-	def build(self, outDir: str, projectSettings: ProjectSettings, buildSettingsList: List[BuildSettings]):
+	def build(self, outDir: str, projectSettings: ProjectSettings, buildSettingsList: List[BuildSettings], archiveDir: str = None):
+		"""Compile each configuration and package it while the next one compiles.
+
+		When archiveDir is given, each platform/arch archive is written
+		incrementally. Returns the (platform, arch) directory names archived.
+		"""
 		outDir = os.path.abspath(outDir)
 		buildSet = set()
 		buildInfo = dict()
-		for buildSettings in buildSettingsList:
-			buildOutDir = os.path.join(outDir, os.path.join(buildSettings.platform.value, buildSettings.arch.value).lower())
-
-			# Compile and export libraries
-			result = False
-			libOutDir = os.path.join(buildOutDir, 'libs', buildSettings.config.value.lower())
-			if buildSettings.platform == PlatformType.Windows:
-				result = self._buildWindows(libOutDir, projectSettings, buildSettings)
-			if buildSettings.platform == PlatformType.Linux:
-				result = self._buildLinux(libOutDir, projectSettings, buildSettings)
-			if buildSettings.platform == PlatformType.Android:
-				result = self._buildAndroid(libOutDir, projectSettings, buildSettings)
-
-			# Copy static dependencies for each platform/arch
-			if result and not (buildSettings.platform, buildSettings.arch) in buildSet:
-				os.makedirs(buildOutDir, exist_ok=True)
-				with open(os.path.join(buildOutDir, 'v8-version.txt'), 'w') as file:
-					file.write(self.version.toString())
-				self.exportLicense(buildOutDir)
-				self.exportIncludes(os.path.join(buildOutDir, "include"))
-				buildSet.add((buildSettings.platform, buildSettings.arch))
-			if result:
-				self.exportCompileDefinitions(libOutDir, projectSettings, buildSettings)
-				key = (buildOutDir, buildSettings.platform, buildSettings.arch)
-				buildInfo.setdefault(key, []).append(buildSettings.config)
-
-		for (buildOutDir, platform, arch), configs in buildInfo.items():
-			self.exportBuildInfo(buildOutDir, projectSettings, platform, arch, configs)
-
-	def archive(self, archiveDir: str, buildDir: str):
+		archives = dict()
+		pending = []
+		# Static forms whose consumer links are measured after the last compile.
+		linkMeasurements = []
+
+		def _checkPending():
+			for future in pending:
+				if future.done():
+					future.result()
+
+		# A single worker keeps packaging ordered and off the compile path.
+		with concurrent.futures.ThreadPoolExecutor(max_workers=1) as exporter:
+			try:
+				for buildSettings in buildSettingsList:
+					_checkPending()
+					buildOutDir = os.path.join(outDir, os.path.join(buildSettings.platform.value, buildSettings.arch.value).lower())
+
+					# Compile libraries
+					projectPath = None
+					libOutDir = os.path.join(buildOutDir, 'libs', buildSettings.config.value.lower())
+					if buildSettings.platform == PlatformType.Windows:
+						projectPath = self._buildWindows(projectSettings, buildSettings)
+					if buildSettings.platform == PlatformType.Linux:
+						projectPath = self._buildLinux(projectSettings, buildSettings)
+					if buildSettings.platform == PlatformType.Android:
+						projectPath = self._buildAndroid(projectSettings, buildSettings)
+					if not projectPath:
+						continue
+
+					packageKey = (buildSettings.platform, buildSettings.arch)
+					exportShared = packageKey not in buildSet
+					buildSet.add(packageKey)
+					if archiveDir and packageKey not in archives:
+						os.makedirs(archiveDir, exist_ok=True)
+						archiveFile = os.path.join(archiveDir, f"{buildSettings.platform.value.lower()}-{buildSettings.arch.value.lower()}.zip")
+						archives[packageKey] = PackageArchive(archiveFile, outDir)
+					pending.append(exporter.submit(
+						self._exportConfig,
+						buildOutDir,
+						libOutDir,
+						projectPath,
+						projectSettings,
+						buildSettings,
+						exportShared,
+						archives.get(packageKey),
+					))
+					key = (buildOutDir, buildSettings.platform, buildSettings.arch)
+					buildInfo.setdefault(key, []).append(buildSettings.config)
+					if projectSettings.staticForms and projectSettings.libraryType == V8.LibraryType.Static:
+						linkMeasurements.append((libOutDir, projectPath, buildSettings, archives.get(packageKey)))
+
+				for future in pending:
+					future.result()
+				for libOutDir, projectPath, buildSettings, archive in linkMeasurements:
+					buildName = getBuildName(buildSettings)
+					self.journal.run(
+						'links/' + buildName,
+						Journal.fingerprint(self.journal.getFingerprint('forms/' + buildName)),
+						lambda: self.measureStaticForms(libOutDir, projectPath, projectSettings, buildSettings),
+						outputs=[os.path.join(libOutDir, staticlib.LINKS_FILE)],
+					)
+					if archive:
+						archive.addFile(os.path.join(libOutDir, staticlib.LINKS_FILE))
+				for (buildOutDir, platform, arch), configs in buildInfo.items():
+					self.exportBuildInfo(buildOutDir, projectSettings, platform, arch, configs)
+					archive = archives.get((platform, arch))
+					if archive:
+						archive.addFile(os.path.join(buildOutDir, 'info.txt'))
+						archive.addFile(os.path.join(buildOutDir, 'info.json'))
+						archive.close()
+						self.journal.complete(
+							f'archive/{platform.value.lower()}-{arch.value.lower()}',
+							self._getPackageFingerprint(buildOutDir),
+						)
+						print(f"Archived '{archive.archiveFile}'")
+			except BaseException:
+				for future in pending:
+					future.cancel()
+				concurrent.futures.wait(pending)
+				for archive in archives.values():
+					archive.discard()
+				raise
+
+		return set(
+			(platform.value.lower(), arch.value.lower())
+			for platform, arch in archives
+		)
+
+	def _exportConfig(
+		self,
+		buildOutDir: str,
+		libOutDir: str,
+		projectPath: str,
+		projectSettings: ProjectSettings,
+		buildSettings: BuildSettings,
+		exportShared: bool,
+		archive: PackageArchive = None,
+	):
+		def _export():
+			self._exportLibs(projectPath, libOutDir, buildSettings.platform, buildSettings.config, projectSettings.libraryType)
+			if projectSettings.externalStartupData:
+				self._exportStartupData(projectPath, libOutDir)
+			if projectSettings.startupOptimization and projectSettings.libraryType == V8.LibraryType.Shared:
+				self._exportStartupReport(projectPath, libOutDir)
+			else:
+				for name in (startup.REPORT_FILE, startup.ORDERING_FILE):
+					if os.path.isfile(os.path.join(libOutDir, name)):
+						os.remove(os.path.join(libOutDir, name))
+			self.exportCompileDefinitions(libOutDir, projectSettings, buildSettings)
+		buildName = getBuildName(buildSettings)
+		self.journal.run(
+			'export/' + buildName,
+			Journal.fingerprint(
+				self.journal.getFingerprint('compile/' + buildName),
+				self.journal.getFingerprint('startup/' + buildName),
+				libOutDir,
+			),
+			_export,
+			outputs=[os.path.join(libOutDir, 'definitions.txt')],
+		)
+
+		# Copy static dependencies for each platform/arch
+		sharedFiles = []
+		if exportShared:
+			os.makedirs(buildOutDir, exist_ok=True)
+			with open(os.path.join(buildOutDir, 'v8-version.txt'), 'w') as file:
+				file.write(self.version.toString())
+			self.exportLicense(buildOutDir)
+			self.exportIncludes(os.path.join(buildOutDir, "include"))
+			sharedFiles = ['v8-version.txt', 'LICENSE', 'include']
+
+		pchOutDir = None
+		if projectSettings.precompiledHeaders:
+			pchOutDir = os.path.join(buildOutDir, 'pch', buildSettings.config.value.lower())
+			self.journal.run(
+				'pch/' + buildName,
+				Journal.fingerprint(
+					self.journal.getFingerprint('compile/' + buildName),
+					projectSettings.getCompileDefinitions(buildSettings),
+				),
+				lambda: self.exportPrecompiledHeaders(pchOutDir, projectPath, projectSettings, buildSettings),
+				outputs=[os.path.join(pchOutDir, 'v8-pch.h'), os.path.join(pchOutDir, 'v8-pch.rsp')],
+			)
+
+		if projectSettings.staticForms and projectSettings.libraryType == V8.LibraryType.Static:
+			self.journal.run(
+				'forms/' + buildName,
+				Journal.fingerprint(self.journal.getFingerprint('compile/' + buildName), sorted(projectSettings.staticForms)),
+				lambda: self.exportStaticForms(libOutDir, projectPath, projectSettings, buildSettings),
+				outputs=[os.path.join(libOutDir, staticlib.FORMS_FILE)],
+			)
+
+		if archive:
+			archive.addTree(libOutDir)
+			if pchOutDir:
+				archive.addTree(pchOutDir)
+			for name in sharedFiles:
+				path = os.path.join(buildOutDir, name)
+				if os.path.isdir(path):
+					archive.addTree(path)
+				else:
+					archive.addFile(path)
+
+	def archive(self, archiveDir: str, buildDir: str, exclude: set = None, deduplicate: bool = False):
 		os.makedirs(archiveDir, exist_ok=True)
 		print(f"Archiving libraries in '{archiveDir}'")
+		if deduplicate:
+			packageDirs = sorted(
+				os.path.join(buildDir, platformDir, archDir)
+				for platformDir in os.listdir(buildDir) if os.path.isdir(os.path.join(buildDir, platformDir))
+				for archDir in os.listdir(os.path.join(buildDir, platformDir)) if os.path.isdir(os.path.join(buildDir, platformDir, archDir))
+			)
+			outputs = [os.path.join(archiveDir, 'common.zip')]
+			outputs.extend(
+				os.path.join(archiveDir, os.path.relpath(packageDir, buildDir).replace(os.sep, '-') + '.zip')
+				for packageDir in packageDirs
+			)
+			self.journal.run(
+				'archive/deduplicated',
+				Journal.fingerprint([self._getPackageFingerprint(packageDir) for packageDir in packageDirs]),
+				lambda: writeDeduplicatedArchives(archiveDir, buildDir, packageDirs),
+				outputs=outputs,
+			)
+			return
 		for platformDir in os.listdir(buildDir):
 			platformPath = os.path.join(buildDir, platformDir)
 			if os.path.isdir(platformPath):
 				for archDir in os.listdir(platformPath):
+					if exclude and (platformDir, archDir) in exclude:
+						# Already archived while building.
+						continue
 					archPath = os.path.join(platformPath, archDir)
-					archiveFile = f"{platformDir}-{archDir}.zip"
-					with zipfile.ZipFile(
-						os.path.join(archiveDir, archiveFile),
-						'w',
-						compression=zipfile.ZIP_DEFLATED,
-						compresslevel=6,
-					) as archive:
-						for root, dirs, files in os.walk(archPath):
-							for file in files:
-								file_path = os.path.join(root, file)
-								archive.write(file_path, arcname=os.path.relpath(file_path, buildDir))
+					archiveFile = os.path.join(archiveDir, f"{platformDir}-{archDir}.zip")
+					self.journal.run(
+						f'archive/{platformDir}-{archDir}',
+						self._getPackageFingerprint(archPath),
+						lambda: writeArchive(archiveFile, archPath, buildDir),
+						outputs=[archiveFile],
+					)
+
+	def _getPackageFingerprint(self, packageDir: str):
+		files = []
+		for root, _, names in os.walk(packageDir):
+			for name in names:
+				path = os.path.join(root, name)
+				fileStat = os.stat(path)
+				files.append((os.path.relpath(path, packageDir), fileStat.st_size, fileStat.st_mtime_ns))
+		return Journal.fingerprint(sorted(files))
 
 	def exportIncludes(self, outIncludeDir):
 		v8IncludeDir = os.path.join(self._v8Dir, 'include')
@@ -441,6 +787,260 @@ class V8:
 					os.makedirs(os.path.dirname(targetFile), exist_ok=True)
 					shutil.copy(sourceFile, targetFile)
 
+	def exportPrecompiledHeaders(
+		self,
+		pchOutDir: str,
+		projectPath: str,
+		projectSettings: ProjectSettings,
+		buildSettings: BuildSettings,
+	):
+		"""Export a prefix header for v8.h and libplatform.h and the flags to precompile it with.
+
+		A precompiled header only loads in the exact compiler build, flags and
+		include paths it was made with, so consumers precompile v8-pch.h
+		themselves. v8-pch.rsp holds the language standard of the V8 compile
+		commands and exactly the definitions in definitions.txt.
+		"""
+		if os.path.isdir(pchOutDir):
+			shutil.rmtree(pchOutDir)
+		os.makedirs(pchOutDir)
+		with open(os.path.join(pchOutDir, 'v8-pch.h'), 'w', newline='\n') as file:
+			file.write('#include <v8.h>\n#include <libplatform/libplatform.h>\n')
+
+		_, flags = self._getConsumerCompileFlags(projectPath)
+		definitions = projectSettings.getCompileDefinitions(buildSettings)
+		# cl.exe and clang-cl both accept the MSVC spelling.
+		msvc = buildSettings.platform == PlatformType.Windows
+		arguments = [flag for flag in flags if flag.startswith('/std:' if msvc else '-std=')]
+		arguments.extend(('/D' if msvc else '-D') + definition for definition in definitions)
+		with open(os.path.join(pchOutDir, 'v8-pch.rsp'), 'w', newline='\n') as file:
+			file.write('\n'.join(arguments) + '\n')
+		print(f'Exported the prefix header for {getBuildName(buildSettings)}')
+
+	def _getConsumerCompileFlags(self, projectPath: str):
+		"""Compiler and flags of a V8 compile command that also apply to consumers."""
+		result = subprocess.run(
+			[self._getBinExecutable('ninja'), '-C', projectPath, '-t', 'compdb', 'cxx'],
+			capture_output=True,
+			text=True,
+		)
+		if result.returncode != 0:
+			raise RuntimeError(f"Unable to read compile commands of {projectPath}:\n{result.stderr}")
+		# Outputs of the default toolchain live in obj/; host tools have their own directory.
+		entry = next((
+			entry for entry in json.loads(result.stdout)
+			if entry['output'].replace('\\', '/').startswith('obj/') and entry['file'].endswith('.cc')
+		), None)
+		if entry is None:
+			raise RuntimeError(f"No target compile command was found in {projectPath}")
+
+		windows = sysPlatform.system() == 'Windows'
+		args = shlex.split(entry['command'], posix=not windows)
+		compilerIndex = next(
+			index for index, arg in enumerate(args)
+			if re.search(r'(clang\+\+|clang-cl)(\.exe)?"?$', arg)
+		)
+		compiler = args[compilerIndex].strip('"')
+		if not os.path.isabs(compiler):
+			compiler = os.path.normpath(os.path.join(projectPath, compiler))
+
+		flags = []
+		pairedFlags = ('-target', '-isysroot', '--sysroot')
+		prefixes = ('--target=', '--sysroot=', '-std=', '/std:', '-march=', '-mcpu=', '-fms-compatibility-version=', '/MD', '/MT')
+		arguments = iter(args[compilerIndex + 1:])
+		for arg in arguments:
+			if arg in pairedFlags:
+				value = next(arguments, None)
+				if value is not None:
+					flags.extend([arg, value if os.path.isabs(value) else os.path.normpath(os.path.join(projectPath, value))])
+			elif arg.startswith(prefixes) or arg in ('-m64', '-m32'):
+				if arg.startswith('--sysroot=') and not os.path.isabs(arg[len('--sysroot='):]):
+					arg = '--sysroot=' + os.path.normpath(os.path.join(projectPath, arg[len('--sysroot='):]))
+				flags.append(arg)
+		return compiler, flags
+
+	def _getConsumerLinkFlags(self, flags: List[str]):
+		"""Flags of _getConsumerCompileFlags that consumer links need too."""
+		pairedFlags = ('-target', '-isysroot', '--sysroot')
+		linkFlags = ['-fuse-ld=lld']
+		for index, flag in enumerate(flags):
+			if flag in pairedFlags:
+				linkFlags.extend(flags[index:index + 2])
+			elif flag.startswith(('--target=', '--sysroot=')) or flag in ('-m64', '-m32'):
+				linkFlags.append(flag)
+		return linkFlags
+
+	def optimizeStartup(self, projectPath: str, projectSettings: ProjectSettings, buildSettings: BuildSettings, env):
+		"""Relink the shared libraries for startup: identical code folding, section GC and symbol ordering.
+
+		The libraries are first relinked with their default flags. When the
+		target runs on this host, a minimal embedder records startup page faults
+		before and after, and without a given symbol ordering file one is
+		generated from a perf profile of the embedder.
+		"""
+		buildName = getBuildName(buildSettings)
+		print(f'Optimizing shared libraries of {buildName} for startup')
+		ninja = self._getBinExecutable('ninja')
+		libraries = startup.findSharedLibraries(projectPath)
+		if not libraries:
+			raise RuntimeError(f"No shared libraries were found in {projectPath}")
+		for library in libraries:
+			os.remove(os.path.join(projectPath, library))
+		# keeprsp leaves the response files the link commands refer to.
+		self._call([ninja, '-d', 'keeprsp', '-C', projectPath, *libraries], projectPath, env, 'startup-baseline-' + buildName.replace('/', '-'))
+		libraryPaths = [os.path.join(projectPath, library) for library in libraries]
+
+		hostArch = {'x86_64': ArchType.x64, 'amd64': ArchType.x64, 'aarch64': ArchType.Arm64, 'arm64': ArchType.Arm64}.get(sysPlatform.machine().lower())
+		runnable = buildSettings.platform == PlatformType.Linux and sysPlatform.system() == 'Linux' and buildSettings.arch == hostArch
+		report = {
+			'libraries': libraries,
+			'flags': list(startup.OPTIMIZATION_FLAGS),
+			'baseline': {'textSize': startup.getTextSizes(projectPath, libraries)},
+		}
+		embedder = None
+		if runnable:
+			compiler, flags = self._getConsumerCompileFlags(projectPath)
+			compileFlags = [
+				*flags,
+				*[f'-D{definition}' for definition in projectSettings.getCompileDefinitions(buildSettings)],
+				'-I', os.path.join(self._v8Dir, 'include'),
+			]
+			workDir = os.path.join(self._root, '.v8-packager', 'startup', buildName.replace('/', '-'))
+			embedder = startup.buildEmbedder(compiler, compileFlags, self._getConsumerLinkFlags(flags), projectPath, workDir)
+			report['baseline']['startup'] = startup.measureStartup([embedder], libraryPaths)
+		else:
+			print('	- Startup is only measured for Linux builds of the host architecture')
+
+		orderingFile = projectSettings.symbolOrderingFile
+		if orderingFile:
+			report['ordering'] = {'source': os.path.basename(orderingFile)}
+		elif embedder:
+			orderingFile = os.path.join(projectPath, startup.ORDERING_FILE)
+			symbolCount = startup.profileOrdering([embedder], libraryPaths, orderingFile)
+			if symbolCount is None:
+				orderingFile = None
+			else:
+				report['ordering'] = {'source': 'perf', 'symbols': symbolCount}
+		if orderingFile:
+			# Symbols of the other libraries in the file are expected.
+			report['flags'].extend([f'-Wl,--symbol-ordering-file={os.path.abspath(orderingFile)}', '-Wl,--no-warn-symbol-ordering'])
+		else:
+			print('	- No symbol ordering file; relinking with code folding and section GC only')
+
+		for library in libraries:
+			# Link commands are shell command lines; the extra flags go to the final linker invocation.
+			command = ' '.join([startup.getLinkCommand(ninja, projectPath, library), *map(shlex.quote, report['flags'])])
+			self._call(['/bin/sh', '-c', command], projectPath, env, 'startup-link-' + library.replace('.', '-'))
+		report['optimized'] = {'textSize': startup.getTextSizes(projectPath, libraries)}
+		if embedder:
+			report['optimized']['startup'] = startup.measureStartup([embedder], libraryPaths)
+			shutil.rmtree(os.path.dirname(embedder), ignore_errors=True)
+		for library in libraries:
+			before, after = report['baseline']['textSize'][library], report['optimized']['textSize'][library]
+			print(f'\t- {library}: .text {before / (1024 * 1024):.1f} MiB -> {after / (1024 * 1024):.1f} MiB')
+		if embedder:
+			before, after = report['baseline']['startup'], report['optimized']['startup']
+			print(f'\t- Startup page faults: {before["minorFaults"] + before["majorFaults"]} -> {after["minorFaults"] + after["majorFaults"]}')
+		startup.writeReport(projectPath, report)
+
+	def _discardStartupOptimization(self, projectPath: str):
+		"""Remove libraries optimizeStartup relinked outside ninja so the next compile links them again."""
+		if not os.path.isfile(os.path.join(projectPath, startup.REPORT_FILE)):
+			return
+		print(f"Discarding startup-optimized libraries in '{projectPath}'")
+		for name in [*startup.findSharedLibraries(projectPath), startup.REPORT_FILE, startup.ORDERING_FILE]:
+			path = os.path.join(projectPath, name)
+			if os.path.isfile(path):
+				os.remove(path)
+
+	def exportStaticForms(self, libOutDir: str, projectPath: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
+		"""Package the static library in the extra forms of projectSettings.staticForms.
+
+		The objects of v8_monolith are read from the ninja graph. Consumer link
+		times are measured later by measureStaticForms.
+		"""
+		if buildSettings.platform == PlatformType.Windows:
+			print('\t- Static library forms are only packaged for ELF platforms, skipping')
+			staticlib.writeForms(libOutDir, dict())
+			return
+		print(f'Packaging static library forms for {getBuildName(buildSettings)}')
+		clangBinDir = os.path.join(self._v8Dir, 'third_party', 'llvm-build', 'Release+Asserts', 'bin')
+
+		def _findTool(name: str, fallback: str):
+			tool = os.path.join(clangBinDir, name)
+			if os.path.isfile(tool):
+				return tool
+			tool = shutil.which(name) or shutil.which(fallback)
+			if tool is None:
+				raise RuntimeError(f"Unable to find {name} for packaging static library forms")
+			return tool
+
+		ar = _findTool('llvm-ar', 'ar')
+		nm = _findTool('llvm-nm', 'nm')
+		monolith = os.path.join(libOutDir, 'libv8.a')
+		# Measurements of the previous forms must not be packaged with the new ones.
+		linksFile = os.path.join(libOutDir, staticlib.LINKS_FILE)
+		if os.path.isfile(linksFile):
+			os.remove(linksFile)
+		objects = staticlib.readArchiveObjects(self._getBinExecutable('ninja'), projectPath, 'obj/libv8_monolith.a')
+		forms = dict()
+
+		def _record(form: str, files: List[str]):
+			paths = [os.path.relpath(path, libOutDir).replace(os.sep, '/') for path in files]
+			forms[form] = {'files': paths}
+			print(f'\t- {form}: {", ".join(paths)}')
+
+		if 'prelinked' in projectSettings.staticForms:
+			# GNU ld can drop dead sections from relocatable output, but only for
+			# the host architecture; other targets are prelinked with lld.
+			bfd = shutil.which('ld.bfd')
+			gcSections = bool(bfd) and buildSettings.platform == PlatformType.Linux and buildSettings.arch == ArchType.x64 \
+				and sysPlatform.machine().lower() in ('x86_64', 'amd64')
+			linker = bfd if gcSections else _findTool('ld.lld', 'ld.lld')
+			prelinked = os.path.join(libOutDir, 'libv8_prelinked.o')
+			_record('prelinked', staticlib.writePrelinked(linker, nm, monolith, prelinked, gcSections))
+			forms['prelinked']['gcSections'] = gcSections
+		if 'components' in projectSettings.staticForms:
+			componentsDir = os.path.join(libOutDir, 'components')
+			_record('components', staticlib.writeComponents(ar, nm, projectPath, objects, componentsDir))
+		if 'thin' in projectSettings.staticForms:
+			_record('thin', staticlib.writeThin(ar, projectPath, objects, os.path.join(libOutDir, 'thin')))
+
+		forms['monolithic'] = {'files': ['libv8.a']}
+		for form, entry in forms.items():
+			entry['size'] = sum(getPathSize(os.path.join(libOutDir, path)) for path in entry['files'])
+			if form == 'thin':
+				entry['size'] = getPathSize(os.path.join(libOutDir, 'thin'))
+		staticlib.writeForms(libOutDir, forms)
+
+	def measureStaticForms(self, libOutDir: str, projectPath: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
+		"""Link a minimal embedder against each packaged form and record the link times.
+
+		Runs once no configuration is compiling, so ninja does not skew the
+		timings and peak memory.
+		"""
+		forms = staticlib.readForms(libOutDir)
+		if not forms:
+			staticlib.writeLinks(libOutDir, dict())
+			return
+		print(f'Measuring consumer links of {getBuildName(buildSettings)}')
+		compiler, flags = self._getConsumerCompileFlags(projectPath)
+		linkFlags = self._getConsumerLinkFlags(flags)
+		compileFlags = [
+			*flags,
+			*[f'-D{definition}' for definition in projectSettings.getCompileDefinitions(buildSettings)],
+			'-I', os.path.join(self._v8Dir, 'include'),
+		]
+		systemLibraries = ['-llog', '-ldl', '-lm'] if buildSettings.platform == PlatformType.Android else ['-lpthread', '-ldl', '-lm']
+		links = staticlib.measureLinks(
+			compiler,
+			compileFlags,
+			linkFlags,
+			{form: [*staticlib.getLinkArgs(libOutDir, form, entry), *systemLibraries] for form, entry in sorted(forms.items())},
+			os.path.join(self._root, '.v8-packager', 'link-benchmark', getBuildName(buildSettings).replace('/', '-')),
+		)
+		staticlib.writeLinks(libOutDir, links)
+
 	def exportLicense(self, outDir: str):
 		licenseFile = os.path.join(self._v8Dir, 'LICENSE')
 		if not os.path.isfile(licenseFile):
@@ -454,101 +1054,28 @@ class V8:
 		platform: PlatformType,
 		arch: ArchType,
 		configs: List[BuildConfig],
+		patchFingerprint: str = None,
 	):
-		def _readText(path: str):
-			if os.path.isfile(path):
-				with open(path, encoding='utf-8', errors='replace') as file:
-					return file.read().strip()
-			return None
+		"""Write info.txt and info.json of a package.
 
+		patchFingerprint overrides the patches of this checkout in the cache
+		key, e.g. with the patches the merged shards were built with.
+		"""
 		def _yesNo(value):
 			return 'yes' if value else 'no'
 
 		def _enabled(value):
 			return 'enabled' if value else 'disabled'
 
-		def _readProperties(path: str):
-			properties = dict()
-			if os.path.isfile(path):
-				with open(path, encoding='utf-8', errors='replace') as file:
-					for line in file:
-						key, separator, value = line.partition('=')
-						if separator:
-							properties[key.strip()] = value.strip()
-			return properties
-
-		def _getClangVersion(platform: PlatformType):
-			compilerName = 'clang-cl.exe' if platform == PlatformType.Windows else 'clang'
-			compiler = os.path.join(
-				self._v8Dir,
-				'third_party',
-				'llvm-build',
-				'Release+Asserts',
-				'bin',
-				compilerName,
-			)
-			if not os.path.isfile(compiler):
-				return None
-
-			try:
-				output = subprocess.check_output(
-					[compiler, '--version'],
-					text=True,
-					stderr=subprocess.STDOUT,
-				)
-				firstLine = output.splitlines()[0].strip()
-				match = re.search(r'clang version (\d+(?:\.\d+)+)', firstLine)
-				return match.group(1) if match else firstLine
-			except Exception:
-				return None
-
-		def _getGnVersion(platform: PlatformType):
-			def _cleanVersion(version):
-				prefix = 'git_revision:'
-				return version[len(prefix):] if version.startswith(prefix) else version
-
-			gnName = 'gn.exe' if platform == PlatformType.Windows else 'gn'
-			version = _readText(os.path.join(self._binDir, gnName + '.version'))
-			if version:
-				return _cleanVersion(version)
-
-			version = _readText(os.path.join(self._binDir, 'gn.version'))
-			if version:
-				return _cleanVersion(version)
-
-			gn = os.path.join(self._binDir, gnName)
-			if not os.path.isfile(gn):
-				return None
-
-			try:
-				output = subprocess.check_output(
-					[gn, '--version'],
-					text=True,
-					stderr=subprocess.STDOUT,
-				)
-				return _cleanVersion(output.splitlines()[0].strip())
-			except Exception:
-				return None
-
-		clangRevision = _readText(os.path.join(
-			self._v8Dir,
-			'third_party',
-			'llvm-build',
-			'Release+Asserts',
-			'cr_build_revision',
-		))
-		gnVersion = _getGnVersion(platform)
-		androidNdkProperties = _readProperties(os.path.join(
-			self._v8Dir,
-			'third_party',
-			'android_toolchain',
-			'ndk',
-			'source.properties',
-		))
-		androidNdkRevision = androidNdkProperties.get('Pkg.Revision')
-		clangVersion = _getClangVersion(platform)
-		releaseArgs = projectSettings.getBuildArgs(V8.BuildSettings(platform, arch, BuildConfig.Release))
-		debugArgs = projectSettings.getBuildArgs(V8.BuildSettings(platform, arch, BuildConfig.Debug))
+		toolchains = self.getToolchainManifest().toDict(platform.value)
+		clangVersion = toolchains['clangVersion']
+		clangRevision = toolchains['clangRevision']
+		gnVersion = toolchains['gnVersion']
+		ninjaVersion = toolchains['ninjaVersion'] or NINJA_VERSION
+		androidNdkRevision = toolchains.get('ndkRevision')
+		buildArgs = {config: projectSettings.getBuildArgs(V8.BuildSettings(platform, arch, config)) for config in BuildConfig}
+		releaseArgs = buildArgs[BuildConfig.Release]
+		debugArgs = buildArgs[BuildConfig.Debug]
 
 		lines = [
 			'V8 Package Information',
@@ -570,6 +1097,9 @@ class V8:
 			f'Component/shared build: {_yesNo(releaseArgs.get("is_component_build", False))}',
 			f'Static monolithic V8 archive: {_yesNo(releaseArgs.get("v8_monolithic", False))}',
 			f'Debug symbols: Debug symbol_level={debugArgs.get("symbol_level", "unknown")}, Release symbol_level={releaseArgs.get("symbol_level", "unknown")}',
+			f'Precompiled headers: {"pch/<config>/v8-pch.h with the flags in v8-pch.rsp, precompiled by the consumer" if projectSettings.precompiledHeaders else "no"}',
+			f'Static library forms: {", ".join(projectSettings.staticForms) or "none"}',
+			f'Startup-optimized shared libraries: {_yesNo(projectSettings.startupOptimization)}',
 			'',
 			'Toolchain',
 			'---------',
@@ -577,7 +1107,7 @@ class V8:
 			f'Clang version: {clangVersion or "unknown"}',
 			f'Chromium Clang revision: {clangRevision or "unknown"}',
 			f'GN version: {gnVersion or "unknown"}',
-			'Ninja version: 1.13.2',
+			f'Ninja version: {ninjaVersion}',
 		]
 
 		if platform == PlatformType.Windows:
@@ -586,9 +1116,19 @@ class V8:
 				'MSVC iterator debug level: Debug=2, Release=0',
 			])
 		elif platform == PlatformType.Linux:
+			if releaseArgs.get('use_sysroot', False):
+				sysrootDir = releaseArgs.get('target_sysroot') or toolchain.getSysroot(self._v8Dir, 'arm64')[0]
+				sysrootLines = [
+					'C++ standard library: sysroot libstdc++',
+					f'Linux sysroot: {os.path.basename(sysrootDir) if sysrootDir else "unknown"}',
+				]
+			else:
+				sysrootLines = [
+					'C++ standard library: system libstdc++',
+					'Linux sysroot: disabled; uses container system libraries',
+				]
 			lines.extend([
-				'C++ standard library: system libstdc++',
-				'Linux sysroot: disabled; uses container system libraries',
+				*sysrootLines,
 				f'Shared-library-safe static TLS: {_yesNo(releaseArgs.get("v8_tls_used_in_library", False))}',
 			])
 		elif platform == PlatformType.Android:
@@ -597,9 +1137,144 @@ class V8:
 				f'Android NDK revision: {androidNdkRevision or "unknown"}',
 			])
 
+		startupData = dict()
+		for config in configs:
+			blobFile = os.path.join(outDir, 'libs', config.value.lower(), STARTUP_DATA_FILE)
+			if os.path.isfile(blobFile):
+				startupData[config.value] = {
+					'file': f'libs/{config.value.lower()}/{STARTUP_DATA_FILE}',
+					'size': os.path.getsize(blobFile),
+					'sha256': _sha256File(blobFile),
+				}
+		if startupData:
+			lines.extend([
+				'',
+				'Startup data',
+				'------------',
+				'Load with v8::V8::InitializeExternalStartupDataFromFile() or mmap the file',
+				'read-only and pass it to v8::V8::SetSnapshotDataBlob(). In the archive it is',
+				'stored uncompressed and page-aligned.',
+			])
+			for config, blob in startupData.items():
+				lines.append(f'{config}: {blob["file"]}, {blob["size"]} bytes, sha256 {blob["sha256"]}')
+
+		staticForms = {
+			config.value: staticlib.readForms(os.path.join(outDir, 'libs', config.value.lower()))
+			for config in configs
+		}
+		if any(staticForms.values()):
+			lines.extend([
+				'',
+				'Static library forms',
+				'--------------------',
+			])
+			for config, forms in staticForms.items():
+				for form, entry in sorted(forms.items()):
+					link = entry.get('link') or dict()
+					if 'seconds' in link:
+						linkInfo = f'consumer link {link["seconds"]:.2f}s, peak {link["peakMemoryKiB"] // 1024} MiB'
+					else:
+						linkInfo = f'consumer link failed: {link.get("error", "not measured")}'
+					if form == 'thin':
+						# The thin archive references copies of the monolithic archive's objects.
+						linkInfo += ', duplicates the objects of libv8.a'
+					lines.append(f'{config} {form}: {", ".join(entry["files"])} ({entry["size"] / (1024 * 1024):.1f} MiB), {linkInfo}')
+
+		startupReports = {
+			config.value: startup.readReport(os.path.join(outDir, 'libs', config.value.lower()))
+			for config in configs
+		}
+		if any(startupReports.values()):
+			lines.extend([
+				'',
+				'Startup optimization',
+				'--------------------',
+			])
+			for config, report in startupReports.items():
+				if not report:
+					continue
+				ordering = report.get('ordering')
+				if ordering is None:
+					orderingInfo = 'no symbol ordering'
+				elif ordering['source'] == 'perf':
+					orderingInfo = f'{ordering["symbols"]} symbols ordered by a perf profile ({startup.ORDERING_FILE})'
+				else:
+					orderingInfo = f'symbols ordered by {ordering["source"]}'
+				flags = [
+					'-Wl,--symbol-ordering-file=' + os.path.basename(flag.split('=', 1)[1]) if flag.startswith('-Wl,--symbol-ordering-file=') else flag
+					for flag in report['flags']
+				]
+				lines.append(f'{config}: {" ".join(flags)}; {orderingInfo}')
+				for library in report['libraries']:
+					before, after = report['baseline']['textSize'][library], report['optimized']['textSize'][library]
+					lines.append(f'{config} {library}: .text {before / (1024 * 1024):.1f} MiB -> {after / (1024 * 1024):.1f} MiB')
+				if 'startup' in report['baseline']:
+					before, after = report['baseline']['startup'], report['optimized']['startup']
+					lines.append(
+						f'{config} startup page faults: {before["minorFaults"]} minor, {before["majorFaults"]} major -> '
+						f'{after["minorFaults"]} minor, {after["majorFaults"]} major'
+					)
+				else:
+					lines.append(f'{config} startup page faults: not measured')
+
 		with open(os.path.join(outDir, 'info.txt'), 'w', encoding='utf-8') as file:
 			file.write('\n'.join(lines) + '\n')
 
+		info = {
+			'v8Version': self.version.toString(),
+			'platform': platform.value,
+			'arch': arch.value,
+			'libraryType': projectSettings.libraryType.value,
+			'configs': [config.value for config in configs],
+			'precompiledHeaders': projectSettings.precompiledHeaders,
+			'staticForms': {config: forms for config, forms in staticForms.items() if forms},
+			'startupData': startupData,
+			'startupOptimization': {config: report for config, report in startupReports.items() if report},
+			'buildArgs': {config.value: buildArgs[config] for config in configs},
+			'toolchain': dict(toolchains, ninjaVersion=ninjaVersion),
+			'cacheKey': self.getCacheKey(projectSettings, platform, arch, configs, buildArgs, patchFingerprint),
+		}
+		with open(os.path.join(outDir, 'info.json'), 'w', encoding='utf-8') as file:
+			json.dump(info, file, indent=2, sort_keys=True)
+			file.write('\n')
+
+	def getRevision(self):
+		return git.readHead(self._v8Dir)
+
+	def getToolchainManifest(self) -> toolchain.ToolchainManifest:
+		if self._toolchainManifest is None:
+			self._toolchainManifest = toolchain.ToolchainManifest(self._v8Dir, self._binDir)
+		return self._toolchainManifest
+
+	def getCacheKey(
+		self,
+		projectSettings: ProjectSettings,
+		platform: PlatformType,
+		arch: ArchType,
+		configs: List[BuildConfig],
+		buildArgs: dict = None,
+		patchFingerprint: str = None,
+	):
+		"""Key of a package built from this checkout, its settings and toolchain.
+
+		buildArgs maps configs to their GN args when the caller already has them.
+		"""
+		if buildArgs is None:
+			buildArgs = {config: projectSettings.getBuildArgs(V8.BuildSettings(platform, arch, config)) for config in configs}
+		return self.getToolchainManifest().cacheKey(
+			platform.value,
+			self.version.toString(),
+			git.readHead(self._v8Dir),
+			patchFingerprint or self.getPatchFingerprint(),
+			arch.value,
+			projectSettings.libraryType.value,
+			projectSettings.precompiledHeaders,
+			sorted(projectSettings.staticForms),
+			projectSettings.startupOptimization,
+			projectSettings.getSymbolOrderingHash(),
+			{config.value: buildArgs[config] for config in configs},
+		)
+
 	def exportCompileDefinitions(self, definitionsDir: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
 		os.makedirs(definitionsDir, exist_ok=True)
 		defs = projectSettings.getCompileDefinitions(buildSettings)
@@ -607,50 +1282,86 @@ class V8:
 		with open(releaseFile, 'w') as file:
 			file.write(';'.join(defs))
 
-	def _buildWindows(self, outLibDir: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
+	def _buildWindows(self, projectSettings: ProjectSettings, buildSettings: BuildSettings):
 		if sysPlatform.system() != "Windows":
 			print(f'Skipping Windows build, not supported on {sysPlatform.system()}')
-			return False
+			return None
 		if ArchType.Arm64 == buildSettings.arch:
 			print(f'Skipping Windows build for Arm64, not supported.')
-			return False
+			return None
 
 		print(f'Building V8 v{self.version.toString()} for Windows {buildSettings.arch.value}:')
 
 		env = self._setupWindowsEnv()
-		self._compileAndExport(outLibDir, projectSettings, buildSettings, env)
-		return True
+		return self._compile(projectSettings, buildSettings, env)
 
-	def _buildLinux(self, outLibDir: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
+	def _buildLinux(self, projectSettings: ProjectSettings, buildSettings: BuildSettings):
 		if sysPlatform.system() != "Linux":
 			print(f'Skipping Linux build, not supported on {sysPlatform.system()}')
-			return False
-		if ArchType.Arm64 == buildSettings.arch:
-			print(f'Skipping Linux build for Arm64, not supported.')
-			return False
+			return None
+		if ArchType.Arm64 == buildSettings.arch and not projectSettings.linuxSysroot \
+			and toolchain.getSysroot(self._v8Dir, 'arm64')[0] is None:
+			print(f'Skipping Linux build for Arm64, this V8 checkout pins no Arm64 sysroot.')
+			return None
 		print(f'Building V8 v{self.version.toString()} for Linux {buildSettings.arch.value}:')
 
-		env = self._setupLinuxEnv(buildSettings.arch)
-		self._compileAndExport(outLibDir, projectSettings, buildSettings, env)
-		return True
+		env = self._setupLinuxEnv(buildSettings.arch, projectSettings.linuxSysroot)
+		return self._compile(projectSettings, buildSettings, env)
 
-	def _buildAndroid(self, outLibDir: str, projectSettings: ProjectSettings, buildSettings: BuildSettings):
+	def _buildAndroid(self, projectSettings: ProjectSettings, buildSettings: BuildSettings):
 		if sysPlatform.system() != "Linux":
 			print(f'Skipping Android build, not supported on {sysPlatform.system()}')
-			return False
+			return None
 		print(f'Building V8 v{self.version.toString()} for Android {buildSettings.arch.value}:')
 
 		self.fetchAndroidToolchain()
 		env = self._setupAndroidEnv()
-		self._compileAndExport(outLibDir, projectSettings, buildSettings, env)
-		return True
+		return self._compile(projectSettings, buildSettings, env)
 
-	def _compileAndExport(self, outLibDir: str, projectSettings: ProjectSettings, buildSettings: BuildSettings, env):
+	def _compile(self, projectSettings: ProjectSettings, buildSettings: BuildSettings, env):
 		projectPath = os.path.join(self._v8Dir,'out.gn', buildSettings.platform.value.lower(), buildSettings.arch.value.lower(), buildSettings.config.value.lower())
-		self._generateProject(projectPath, projectSettings.getBuildArgs(buildSettings), env)
-		target = 'v8_monolith' if projectSettings.libraryType == V8.LibraryType.Static else 'v8'
-		self._compileProject(projectPath, target, env)
-		self._exportLibs(projectPath, outLibDir, buildSettings.platform, buildSettings.config, projectSettings.libraryType)
+		buildName = getBuildName(buildSettings)
+		buildArgs = projectSettings.getBuildArgs(buildSettings)
+		gnFingerprint = Journal.fingerprint(
+			buildArgs,
+			git.readHead(self._v8Dir),
+			self.journal.getFingerprint('patches'),
+			self.journal.getFingerprint('toolchain/clang'),
+			os.path.getmtime(self._getBinExecutable('gn')),
+		)
+		self.journal.run(
+			'gn/' + buildName,
+			gnFingerprint,
+			lambda: self._generateProject(projectPath, buildArgs, env),
+			outputs=[os.path.join(projectPath, 'build.ninja')],
+		)
+		targets = ['v8_monolith' if projectSettings.libraryType == V8.LibraryType.Static else 'v8']
+		if projectSettings.externalStartupData:
+			targets.append(STARTUP_DATA_FILE)
+		optimizeStartup = projectSettings.startupOptimization and projectSettings.libraryType == V8.LibraryType.Shared \
+			and buildSettings.platform != PlatformType.Windows
+		orderingFile = projectSettings.symbolOrderingFile if optimizeStartup else None
+		if not optimizeStartup:
+			self._discardStartupOptimization(projectPath)
+		self.journal.run(
+			'compile/' + buildName,
+			# The relinked libraries live in out.gn, so switching startup
+			# optimization off must bring ninja's libraries back.
+			Journal.fingerprint(gnFingerprint, *targets, optimizeStartup, _sha256File(orderingFile) if orderingFile else None),
+			lambda: self._compileProject(projectPath, targets, env),
+			outputs=[os.path.join(projectPath, '.ninja_log')],
+		)
+		if optimizeStartup:
+			self.journal.run(
+				'startup/' + buildName,
+				Journal.fingerprint(
+					self.journal.getFingerprint('compile/' + buildName),
+					_sha256File(orderingFile) if orderingFile else None,
+				),
+				lambda: self.optimizeStartup(projectPath, projectSettings, buildSettings, env),
+				outputs=[os.path.join(projectPath, startup.REPORT_FILE)],
+			)
+		return projectPath
 
 	def _exportLibs(self, projectLibDir: str, outLibDir: str, platform: PlatformType, buildConfig: BuildConfig, libraryType: 'V8.LibraryType' = None):
 		# Generate pattern to search library
@@ -718,7 +1429,28 @@ class V8:
 							print(f'\t{filename}')
 							shutil.copy(libPath, outPath)
 
+	def _exportStartupReport(self, projectPath: str, outLibDir: str):
+		report = startup.readReport(projectPath)
+		if not report:
+			return
+		# Ship a generated ordering file so embedders can relink with it.
+		orderingFile = os.path.join(projectPath, startup.ORDERING_FILE)
+		if report.get('ordering', {}).get('source') == 'perf' and os.path.isfile(orderingFile):
+			shutil.copy(orderingFile, os.path.join(outLibDir, startup.ORDERING_FILE))
+		startup.writeReport(outLibDir, report)
+
+	def _exportStartupData(self, projectPath: str, outLibDir: str):
+		# mksnapshot writes the blob to the root of the build directory.
+		blobFile = os.path.join(projectPath, STARTUP_DATA_FILE)
+		if not os.path.isfile(blobFile):
+			raise RuntimeError(f"Error: Expected external startup data at {blobFile}")
+		print(f'\t{STARTUP_DATA_FILE}')
+		shutil.copy(blobFile, os.path.join(outLibDir, STARTUP_DATA_FILE))
+
 	def _setupWindowsEnv(self) -> EnvVars:
+		return dict(toolchain.resolveOnce(('windows-env', self._v8Dir), self._resolveWindowsEnv))
+
+	def _resolveWindowsEnv(self) -> EnvVars:
 		env = os.environ.copy()
 		self._ensureClangToolchain('clang-cl.exe', env)
 
@@ -744,23 +1476,7 @@ class V8:
 		vcVarsScript = os.path.join(msvcPath, "Auxiliary", "Build", "vcvarsall.bat")
 		if not os.path.isfile(vcVarsScript):
 			raise RuntimeError(f"Error: Visual Studio environment script was not found: {vcVarsScript}")
-		vcVarsResult = subprocess.run(
-			f'call "{vcVarsScript}" amd64 && set',
-			shell=True,
-			capture_output=True,
-			text=True,
-			env=env,
-		)
-		if vcVarsResult.returncode != 0:
-			raise RuntimeError(
-				f"Visual Studio environment setup failed:\n"
-				f"{vcVarsResult.stdout}{vcVarsResult.stderr}"
-			)
-		vcArgs = vcVarsResult.stdout
-		for line in vcArgs.splitlines():
-			if '=' in line:
-				key, value = line.split('=', 1)
-				env[key] = value
+		env.update(self._getVcVarsEnv(vcVarsScript, env))
 		env[f'vs{vsVersion}_install'] = os.path.dirname(msvcPath)
 		print(f'\t- Visual Studio {vsVersion} in {msvcPath}')
 		toolset = env.get('VCToolsVersion')
@@ -773,36 +1489,118 @@ class V8:
 		v8WinBuildTools = os.path.join(self._v8Dir, 'buildtools', 'win')
 		if not os.path.exists(v8WinBuildTools):
 			os.makedirs(v8WinBuildTools)
-		shutil.copy(self._getBinExecutable('gn'), v8WinBuildTools)
-		self._call([sys.executable, 'lastchange.py', '-o', 'LASTCHANGE'], 'build/util',env)
+		gnExecutable = self._getBinExecutable('gn')
+		gnTarget = os.path.join(v8WinBuildTools, os.path.basename(gnExecutable))
+		def _fileStamp(path):
+			fileStat = os.stat(path)
+			return fileStat.st_size, int(fileStat.st_mtime)
+		if not os.path.isfile(gnTarget) or _fileStamp(gnTarget) != _fileStamp(gnExecutable):
+			shutil.copy2(gnExecutable, gnTarget)
+		buildDir = os.path.join(self._v8Dir, 'build')
+		self.journal.run(
+			'toolchain/lastchange',
+			Journal.fingerprint(git.readHead(buildDir) if os.path.isdir(os.path.join(buildDir, '.git')) else None),
+			lambda: self._call([sys.executable, 'lastchange.py', '-o', 'LASTCHANGE'], 'build/util', env),
+			outputs=[os.path.join(buildDir, 'util', 'LASTCHANGE')],
+		)
 		return env
 
-	def _setupLinuxEnv(self, arch: ArchType) -> EnvVars:
+	def _getVcVarsEnv(self, vcVarsScript: str, env: EnvVars) -> EnvVars:
+		"""Variables set by vcvarsall.bat, cached in the workspace by script and input environment."""
+		cacheFile = os.path.join(self._root, '.v8-packager', 'vcvars.json')
+		cacheKey = Journal.fingerprint(vcVarsScript, os.path.getmtime(vcVarsScript), sorted(env.items()))
+		if os.path.isfile(cacheFile):
+			try:
+				with open(cacheFile) as file:
+					cached = json.load(file)
+				if cached.get('key') == cacheKey:
+					return cached['env']
+			except (OSError, ValueError, KeyError):
+				pass
+		vcVarsResult = subprocess.run(
+			f'call "{vcVarsScript}" amd64 && set',
+			shell=True,
+			capture_output=True,
+			text=True,
+			env=env,
+		)
+		if vcVarsResult.returncode != 0:
+			raise RuntimeError(
+				f"Visual Studio environment setup failed:\n"
+				f"{vcVarsResult.stdout}{vcVarsResult.stderr}"
+			)
+		vcEnv = dict()
+		for line in vcVarsResult.stdout.splitlines():
+			if '=' in line:
+				key, value = line.split('=', 1)
+				if env.get(key) != value:
+					vcEnv[key] = value
+		os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+		with open(cacheFile, 'w') as file:
+			json.dump({'key': cacheKey, 'env': vcEnv}, file, indent=1)
+		return vcEnv
+
+	def _setupLinuxEnv(self, arch: ArchType, sysroot: str = None) -> EnvVars:
 		env = os.environ.copy()
 		self._ensureClangToolchain('clang', env)
+		if ArchType.Arm64 == arch:
+			# use_sysroot also applies to the x64 host toolchain that builds
+			# mksnapshot and torque.
+			self._ensureSysroot('amd64', env)
+			if sysroot:
+				if not os.path.isdir(os.path.join(sysroot, 'usr', 'include')):
+					raise RuntimeError(f"Error: Expected a Linux Arm64 sysroot at {sysroot}")
+			else:
+				self._ensureSysroot('arm64', env)
 		return env
 
 	def _setupAndroidEnv(self) -> EnvVars:
 		env = os.environ.copy()
 		self._ensureClangToolchain('clang', env)
+		self._ensureSysroot('amd64', env)
+		return env
+
+	def _ensureSysroot(self, arch: str, env: EnvVars):
+		toolchain.resolveOnce(('sysroot', self._v8Dir, arch), lambda: self._installSysroot(arch, env))
+
+	def _installSysroot(self, arch: str, env: EnvVars):
+		sysrootDir, sysrootKey = toolchain.getSysroot(self._v8Dir, arch)
+		if sysrootDir is not None and toolchain.isSysrootInstalled(sysrootDir, sysrootKey):
+			toolchain.publishDirectory('sysroot', sysrootKey, sysrootDir)
+			return
+		if sysrootDir is not None and (toolchain.isLink(sysrootDir) or not os.path.isdir(sysrootDir)):
+			# install-sysroot.py cannot replace a linked sysroot itself.
+			if not toolchain.restoreDirectory('sysroot', sysrootKey, sysrootDir):
+				toolchain.removeTree(sysrootDir)
 		self._call(
-			[sys.executable, 'install-sysroot.py', '--arch=amd64'],
+			[sys.executable, 'install-sysroot.py', f'--arch={arch}'],
 			'build/linux/sysroot_scripts',
 			env,
 		)
-		return env
+		if sysrootDir is not None:
+			toolchain.publishDirectory('sysroot', sysrootKey, sysrootDir)
 
 	def _ensureClangToolchain(self, compilerExecutable: str, env: EnvVars):
+		toolchain.resolveOnce(
+			('clang', self._v8Dir, compilerExecutable),
+			lambda: self._installClangToolchain(compilerExecutable, env),
+		)
+
+	def _installClangToolchain(self, compilerExecutable: str, env: EnvVars):
 		clangDir = os.path.join(self._v8Dir, 'third_party', 'llvm-build', 'Release+Asserts')
 		compiler = os.path.join(clangDir, 'bin', compilerExecutable)
-		if not os.path.isfile(compiler):
-			# Windows and WSL share this checkout but require different Clang
-			# archives. Their revision stamps are identical, so remove the
-			# incompatible archive before running the updater.
-			if os.path.isdir(clangDir):
-				shutil.rmtree(clangDir)
-			print(f'\t- Installing Clang toolchain for {sysPlatform.system()}')
-		self._call([sys.executable, 'update.py'], 'tools/clang/scripts', env)
+		clangKey = toolchain.getClangKey(self._v8Dir)
+		if toolchain.isLink(clangDir) or not os.path.isfile(compiler):
+			if not toolchain.restoreDirectory('clang', clangKey, clangDir):
+				# Windows and WSL share this checkout but require different Clang
+				# archives. Their revision stamps are identical, so remove the
+				# incompatible archive before running the updater.
+				toolchain.removeTree(clangDir)
+				print(f'\t- Installing Clang toolchain for {sysPlatform.system()}')
+		clangRevision = toolchain.getClangRevision(self._v8Dir)
+		if not (os.path.isfile(compiler) and clangRevision is not None and toolchain.readClangStamp(clangDir) == clangRevision):
+			self._call([sys.executable, 'update.py'], 'tools/clang/scripts', env)
+		toolchain.publishDirectory('clang', clangKey, clangDir)
 
 	def _generateProject(self, projectPath: str, genArgs: dict, env: EnvVars):
 		def _formatGnValue(value):
@@ -817,17 +1615,27 @@ class V8:
 		gnArgs = list()
 		for k, v in genArgs.items():
 			gnArgs.append(k + '=' + _formatGnValue(v))
-		self._call([self._getBinExecutable('gn'), 'gen', projectPath, '--args=' + ' '.join(gnArgs)], '', env)
+		logName = 'gn-' + os.path.relpath(projectPath, os.path.join(self._v8Dir, 'out.gn')).replace(os.sep, '-')
+		self._call([self._getBinExecutable('gn'), 'gen', projectPath, '--args=' + ' '.join(gnArgs)], '', env, logName)
 		if not os.path.isdir(projectPath):
 			raise RuntimeError(f"\nExpected generated project directory to exist {projectPath}")
 
-	def _compileProject(self, projectPath: str, target: str, env: EnvVars):
+	def _compileProject(self, projectPath: str, targets: List[str], env: EnvVars):
 		args = [self._getBinExecutable('ninja'), '-C', projectPath]
 		jobs = env.get('V8_PACKAGER_JOBS')
 		if jobs:
 			args.extend(['-j', jobs])
-		args.append(target)
-		self._call(args, '', env)
+		args.extend(targets)
+		buildName = os.path.relpath(projectPath, os.path.join(self._v8Dir, 'out.gn')).replace(os.sep, '/')
+		env = dict(env, NINJA_STATUS=NINJA_STATUS)
+		progress = NinjaProgress(buildName, os.path.join(self._root, '.v8-packager', 'ninja-history.json'))
+		try:
+			self._call(args, '', env, 'ninja-' + buildName.replace('/', '-'), progress.feed)
+		except RuntimeError:
+			progress.finish(False)
+			raise
+		progress.finish(True)
+		self.ninjaStats[buildName] = progress.getStats()
 
 	def _getBinExecutable(self, name: str):
 		file = os.path.join(self._binDir, f"{name}{'' if sysPlatform.system() == 'Linux' else '.exe'}")
@@ -835,9 +1643,17 @@ class V8:
 			raise RuntimeError(f"\nExpected to find V8 binary dependency '{name}'")
 		return file
 
-	def _call(self, args: List[str], dir: str, env: EnvVars):
+	def _call(self, args: List[str], dir: str, env: EnvVars, logName: str = None, onLine=None):
+		"""Run a command in the V8 checkout, logging its output to .v8-packager/logs.
+
+		Output is only printed when the command fails.
+		"""
 		cwd = os.path.join(self._v8Dir, dir)
-		result = subprocess.run(args, cwd=cwd, env=env)
-		if result.returncode != 0:
+		if logName is None:
+			command = args[1] if args[0] == sys.executable and len(args) > 1 else args[0]
+			logName = os.path.splitext(os.path.basename(command))[0]
+		logFile = os.path.join(logDirectory(self._root), logName + '.log.gz')
+		returncode = runLogged(args, cwd, env, logFile, onLine)
+		if returncode != 0:
 			command = ' '.join(args)
-			raise RuntimeError(f"Command failed with exit code {result.returncode}: {command}")
+			raise RuntimeError(f"Command failed with exit code {returncode}: {command}")
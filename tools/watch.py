@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List
+
+import tools.git as git
+from tools.progress import formatDuration
+from tools.v8 import V8
+
+# Copies of the patch files as they were applied; a changed patch is
+# reverse-applied from its copy because the file itself already holds the edit.
+APPLIED_DIR = os.path.join('.v8-packager', 'watch', 'applied')
+_STATE_FILE = 'applied.json'
+
+
+def _hashFile(path: str) -> str:
+	with open(path, 'rb') as file:
+		return hashlib.sha256(file.read()).hexdigest()
+
+
+class PatchWatcher:
+	"""Keeps a checkout patched with the current patch files and rebuilds it on changes.
+
+	Only the patches of a repository from the first changed one onwards are
+	reverted and applied again, so the other patches and the out.gn
+	directories stay untouched and ninja rebuilds incrementally.
+	"""
+
+	def __init__(self, v8: V8, root: str):
+		self._v8 = v8
+		self._patchDir = os.path.abspath(os.path.join(root, 'patches'))
+		self._appliedDir = os.path.abspath(os.path.join(root, APPLIED_DIR))
+		self._stateFile = os.path.join(self._appliedDir, _STATE_FILE)
+		# Repository -> patch files relative to the patch directory, in applied order.
+		self._applied: Dict[str, List[str]] = dict()
+
+	def _getAppliedFile(self, relativePath: str) -> str:
+		return os.path.join(self._appliedDir, relativePath)
+
+	def _readState(self) -> bool:
+		"""Load copies of a previous session if the checkout still has them applied."""
+		if not os.path.isfile(self._stateFile):
+			return False
+		with open(self._stateFile) as file:
+			applied = json.load(file)
+		for targetRepo, relativePaths in applied.items():
+			appliedFiles = [self._getAppliedFile(relativePath) for relativePath in relativePaths]
+			if not all(os.path.isfile(appliedFile) for appliedFile in appliedFiles) or not git.isPatched(appliedFiles, targetRepo):
+				return False
+		self._applied = applied
+		return True
+
+	def _writeState(self):
+		os.makedirs(self._appliedDir, exist_ok=True)
+		stagingFile = self._stateFile + '.tmp'
+		with open(stagingFile, 'w') as file:
+			json.dump(self._applied, file, indent=1, sort_keys=True)
+		os.replace(stagingFile, self._stateFile)
+
+	def _copyApplied(self, patchFile: str):
+		appliedFile = self._getAppliedFile(os.path.relpath(patchFile, self._patchDir))
+		os.makedirs(os.path.dirname(appliedFile), exist_ok=True)
+		shutil.copy2(patchFile, appliedFile)
+
+	def start(self):
+		"""Bring the checkout to the current patch files."""
+		if self._readState():
+			self.sync()
+			return
+		# Without copies the checkout must match the patch files on disk.
+		try:
+			self._v8.applyPatches()
+		except RuntimeError as error:
+			raise RuntimeError(f"{error}\nThe checkout does not match the patch files; run 'python3 -m tools.run --reset' first.")
+		if os.path.isdir(self._appliedDir):
+			shutil.rmtree(self._appliedDir)
+		self._applied = dict()
+		for targetRepo, patchFiles in self._v8.getPatchSets().items():
+			for patchFile in patchFiles:
+				self._copyApplied(patchFile)
+			self._applied[targetRepo] = [os.path.relpath(patchFile, self._patchDir) for patchFile in patchFiles]
+		self._writeState()
+
+	def scan(self) -> Dict[str, tuple]:
+		"""Size and modification time of every patch file."""
+		files = dict()
+		for root, _, names in os.walk(self._patchDir):
+			for name in names:
+				if name.endswith('.patch'):
+					fileStat = os.stat(os.path.join(root, name))
+					files[os.path.join(root, name)] = (fileStat.st_size, fileStat.st_mtime_ns)
+		return files
+
+	def sync(self) -> List[str]:
+		"""Revert and reapply the patches that differ from their applied copies.
+
+		Returns the changed patch files relative to the patch directory. When
+		a new patch does not apply, the previous patches are applied again and
+		RuntimeError is raised.
+		"""
+		patchSets = self._v8.getPatchSets()
+		changed = []
+		for targetRepo in sorted(set(patchSets) | set(self._applied)):
+			applied = self._applied.get(targetRepo, [])
+			current = [os.path.relpath(patchFile, self._patchDir) for patchFile in patchSets.get(targetRepo, [])]
+			appliedKeys = [(relativePath, _hashFile(self._getAppliedFile(relativePath))) for relativePath in applied]
+			currentKeys = [(relativePath, _hashFile(os.path.join(self._patchDir, relativePath))) for relativePath in current]
+			if appliedKeys == currentKeys:
+				continue
+			first = 0
+			while first < min(len(appliedKeys), len(currentKeys)) and appliedKeys[first] == currentKeys[first]:
+				first += 1
+			# Later patches may touch the same lines, so everything after the
+			# first change is reverted as well.
+			revertFiles = [self._getAppliedFile(relativePath) for relativePath in applied[first:]]
+			applyFiles = [os.path.join(self._patchDir, relativePath) for relativePath in current[first:]]
+			if revertFiles:
+				git.revertPatches(revertFiles, targetRepo)
+			try:
+				if applyFiles:
+					git.applyPatches(applyFiles, targetRepo)
+			except RuntimeError:
+				if revertFiles:
+					git.applyPatches(revertFiles, targetRepo)
+				git.markPatched([self._getAppliedFile(relativePath) for relativePath in applied], targetRepo)
+				raise
+			for relativePath in applied[first:]:
+				os.remove(self._getAppliedFile(relativePath))
+			for patchFile in applyFiles:
+				self._copyApplied(patchFile)
+			git.markPatched([os.path.join(self._patchDir, relativePath) for relativePath in current], targetRepo)
+			if current:
+				self._applied[targetRepo] = current
+			else:
+				del self._applied[targetRepo]
+			self._writeState()
+			changed.extend(sorted(set(relativePath for relativePath, _ in appliedKeys[first:] + currentKeys[first:])))
+		if changed:
+			self._v8.recordPatches(patchSets)
+		return changed
+
+	def watch(self, buildDir: str, projectSettings: V8.ProjectSettings, buildSettingsList: List[V8.BuildSettings], interval: float = 1.0):
+		"""Poll the patch directory and rebuild the given configurations after each change.
+
+		Polling also sees edits made on the host through Docker bind mounts,
+		which do not forward file system events.
+		"""
+		print(f"Watching '{self._patchDir}' for changes; press Ctrl+C to stop")
+		signature = self.scan()
+		try:
+			while True:
+				time.sleep(interval)
+				current = self.scan()
+				if current == signature:
+					continue
+				# Editors may save in several writes; wait until the files settle.
+				while True:
+					time.sleep(interval)
+					settled = self.scan()
+					if settled == current:
+						break
+					current = settled
+				signature = current
+				try:
+					changed = self.sync()
+				except RuntimeError as error:
+					print(f'Error: {error}')
+					print('Kept the previous patches; waiting for the next change')
+					continue
+				if not changed:
+					continue
+				print(f'Patches changed: {", ".join(changed)}')
+				self._v8.ninjaStats.clear()
+				start = time.monotonic()
+				try:
+					self._v8.build(buildDir, projectSettings, buildSettingsList)
+				except RuntimeError as error:
+					print(f'Error: {error}')
+					print(f'Rebuild failed after {formatDuration(time.monotonic() - start)}; waiting for the next change')
+					continue
+				edges = sum(stats['edges'] for stats in self._v8.ninjaStats.values())
+				print(f'Rebuilt {len(buildSettingsList)} configuration(s) in {formatDuration(time.monotonic() - start)} ({edges} ninja edges)')
+		except KeyboardInterrupt:
+			print('Stopped watching patches')